@@ -27,102 +27,424 @@ $/LicenseInfo$
 """
 
 import copy
+import errno
 import os
+import threading
 import traceback
 import time
 import types
+import weakref
 
 from os.path import dirname, getmtime, join, realpath
 from indra.base import llsd
 
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
 _g_config = None
+_g_watcher = None
 
-class IndraConfig(object):
-    """
-    IndraConfig loads a 'indra' xml configuration file
-    and loads into memory.  This representation in memory
-    can get updated to overwrite values or add new values.
+_missing = object()
 
-    The xml configuration file is considered a live file and changes
-    to the file are checked and reloaded periodically.  If a value had
-    been overwritten via the update or set method, the loaded values
-    from the file are ignored (the values from the update/set methods
-    override)
+def _changed_keys(old, new):
     """
-    def __init__(self, indra_config_file):
-        self._indra_config_file = indra_config_file
-        self._reload_check_interval = 30 # seconds
-        self._last_check_time = 0
-        self._last_mod_time = 0
+    Returns the keys that were added, removed or changed between two
+    dicts.
+    """
+    changed = [key for key, value in new.iteritems()
+               if key not in old or old[key] != value]
+    changed.extend([key for key in old if key not in new])
+    return changed
 
-        self._config_overrides = {}
-        self._config_file_dict = {}
-        self._combined_dict = {}
+def _parse_file(path):
+    config_file = open(path)
+    try:
+        return llsd.parse(config_file.read())
+    finally:
+        config_file.close()
 
-        self._load()
+class ConfigSource(object):
+    """
+    One layer of an IndraConfig.  A source holds a dict of values;
+    values from sources later in an IndraConfig's stack override those
+    from earlier ones.
+    """
+    # set by sources whose changes cannot be seen through inotify
+    poll = False
 
-    def _load(self):
-        if self._indra_config_file is None:
-            return
+    def __init__(self):
+        self.values = {}
+        self.live = True
 
-        config_file = open(self._indra_config_file)
-        self._config_file_dict = llsd.parse(config_file.read())
-        self._combine_dictionaries()
-        config_file.close()
+    def load(self):
+        """
+        Returns the current values of this source as a dict.
+        """
+        return {}
+
+    def has_changed(self):
+        """
+        Returns True if load() would return different values.
+        """
+        return False
 
-        self._last_mod_time = self._get_last_modified_time()
-        self._last_check_time = time.time() # now
+    def watched_paths(self):
+        """
+        Returns the filesystem paths whose changes affect this source.
+        """
+        return []
 
-    def _get_last_modified_time(self):
+    def refresh(self):
         """
-        Returns the mtime (last modified time) of the config file,
-        if such exists.
+        Reloads the values and returns the keys that were added,
+        removed or changed.
         """
-        if self._indra_config_file is not None:
-            return os.path.getmtime(self._indra_config_file)
+        old = self.values
+        self.values = self.load()
+        return _changed_keys(old, self.values)
 
-        return 0
+    def close(self):
+        pass
 
-    def _combine_dictionaries(self):
-        self._combined_dict = {}
-        self._combined_dict.update(self._config_file_dict)
-        self._combined_dict.update(self._config_overrides)
+class FileSource(ConfigSource):
+    """
+    A single llsd file, such as indra.xml.
+    """
+    def __init__(self, path):
+        ConfigSource.__init__(self)
+        self.path = path
+        self._last_mod_time = 0
+
+    def load(self):
+        # take the mtime of the file actually read, so a missing file
+        # raises IOError like the parse does
+        config_file = open(self.path)
+        try:
+            mod_time = os.fstat(config_file.fileno()).st_mtime
+            values = llsd.parse(config_file.read())
+        finally:
+            config_file.close()
+        self._last_mod_time = mod_time
+        return values
+
+    def has_changed(self):
+        return getmtime(self.path) > self._last_mod_time
 
-    def _reload_if_necessary(self):
-        now = time.time()
+    def watched_paths(self):
+        return [self.path]
 
-        if (now - self._last_check_time) > self._reload_check_interval:
-            self._last_check_time = now
+class DirectorySource(ConfigSource):
+    """
+    A directory of llsd config fragments, merged in filename order.
+    """
+    def __init__(self, path, suffix = '.xml'):
+        ConfigSource.__init__(self)
+        self.path = path
+        self.suffix = suffix
+        self._stamps = None
+
+    def _fragment_stamps(self):
+        names = [name for name in os.listdir(self.path)
+                 if name.endswith(self.suffix)]
+        names.sort()
+        stamps = []
+        for name in names:
+            fragment = join(self.path, name)
             try:
-                modtime = self._get_last_modified_time()
-                if modtime > self._last_mod_time:
-                    self._load()
+                stamps.append((fragment, getmtime(fragment)))
             except OSError, e:
-                if e.errno == errno.ENOENT: # file not found
-                    # someone messed with our internal state
-                    # or removed the file
+                if e.errno != errno.ENOENT:
+                    raise
+        return stamps
 
-                    print 'WARNING: Configuration file has been removed ' + (self._indra_config_file)
-                    print 'Disabling reloading of configuration file.'
+    def load(self):
+        stamps = self._fragment_stamps()
+        values = {}
+        for fragment, mod_time in stamps:
+            values.update(_parse_file(fragment))
+        self._stamps = stamps
+        return values
 
-                    traceback.print_exc()
+    def has_changed(self):
+        return self._fragment_stamps() != self._stamps
 
-                    self._indra_config_file = None
-                    self._last_check_time = 0
-                    self._last_mod_time = 0
-                else:
-                    raise  # pass the exception along to the caller
+    def watched_paths(self):
+        return [self.path]
 
-    def __getitem__(self, key):
-        self._reload_if_necessary()
+class EnvironmentSource(ConfigSource):
+    """
+    Environment variables starting with prefix.  INDRA_CONFIG_FOO_BAR
+    sets the key 'foo-bar'.  Values are always strings; use the typed
+    accessors to read them.
+    """
+    def __init__(self, prefix = 'INDRA_CONFIG_', environ = None):
+        ConfigSource.__init__(self)
+        self.prefix = prefix
+        if environ is None:
+            environ = os.environ
+        self._environ = environ
+
+    def load(self):
+        values = {}
+        prefix_len = len(self.prefix)
+        for name, value in self._environ.items():
+            if name.startswith(self.prefix):
+                values[name[prefix_len:].lower().replace('_', '-')] = value
+        return values
+
+    def has_changed(self):
+        return self.load() != self.values
+
+class DictSource(ConfigSource):
+    """
+    In-memory values, changed through the IndraConfig that owns the
+    source.
+    """
+    def __init__(self, values = None):
+        ConfigSource.__init__(self)
+        if values:
+            self.values = dict(values)
+
+    def load(self):
+        return self.values
+
+def _to_bool(value):
+    if isinstance(value, basestring):
+        lowered = value.strip().lower()
+        if lowered in ('1', 'true', 'yes', 'on'):
+            return True
+        if lowered in ('0', 'false', 'no', 'off', ''):
+            return False
+        raise ValueError('not a boolean: %r' % (value,))
+    return bool(value)
+
+def _to_list(value):
+    if isinstance(value, basestring):
+        return tuple([item.strip() for item in value.split(',')
+                      if item.strip()])
+    return tuple(value)
+
+_converters = {
+    'int' : int,
+    'float' : float,
+    'bool' : _to_bool,
+    'list' : _to_list,
+    }
+
+class IndraConfig(object):
+    """
+    IndraConfig loads a 'indra' xml configuration file
+    and loads into memory.  This representation in memory
+    can get updated to overwrite values or add new values.
+
+    The configuration is an ordered stack of ConfigSource layers: the
+    xml file, any sources passed in or added with add_source (fragment
+    directories, the environment, in-memory dicts), and finally the
+    values given to the update or set methods, which override
+    everything else.  A background watcher (see _ConfigWatcher)
+    notices changes to the files behind the sources and reloads only
+    the layers that changed.
+
+    Readers never take a lock.  The merged view is maintained
+    incrementally: a change to one key is stored directly into the
+    merged dict, and a change to several keys builds a new merged dict
+    and swaps it in with a single attribute assignment, so a lookup
+    sees either the old or the new configuration, never a mix.
+    Callbacks registered with add_reload_callback are called with the
+    config after each change.
+
+    The typed accessors (get_int, get_bool, get_float, get_list)
+    remember each converted value until the underlying value changes.
+    """
+    def __init__(self, indra_config_file, reload_check_interval = 30,
+                 sources = None):
+        self._indra_config_file = indra_config_file
+        self._reload_check_interval = reload_check_interval # seconds
+
+        self._write_lock = threading.RLock()
+        self._callbacks = []
+        self._combined_dict = {}
+        self._typed_cache = {}
+
+        self._overrides = DictSource()
+        self._sources = []
+        if indra_config_file is not None:
+            self._sources.append(FileSource(indra_config_file))
+        if sources:
+            self._sources.extend(sources)
+        self._sources.append(self._overrides)
+
+        combined_dict = {}
+        for source in self._sources:
+            source.values = source.load()
+            combined_dict.update(source.values)
+        self._combined_dict = combined_dict
+
+        self._watch()
+
+    def _watch(self):
+        if self._watched_paths():
+            _get_watcher().watch(self)
+
+    def _watched_paths(self):
+        paths = []
+        for source in self._sources:
+            if source.live:
+                paths.extend([realpath(path)
+                              for path in source.watched_paths()])
+        return paths
+
+    def _needs_polling(self):
+        for source in self._sources:
+            if source.live and source.poll:
+                return True
+        return False
+
+    def _resolve(self, key):
+        for source in reversed(self._sources):
+            values = source.values
+            if key in values:
+                return values[key]
+        return _missing
+
+    def _apply_changes(self, keys):
+        """
+        Brings the merged dict up to date for the given changed keys and
+        publishes it.  Callers must hold _write_lock.
+        """
+        if not keys:
+            return
+        # never change the published dict; readers and as_dict() may be
+        # using it
+        combined_dict = self._combined_dict.copy()
+        for key in keys:
+            value = self._resolve(key)
+            if value is _missing:
+                combined_dict.pop(key, None)
+            else:
+                combined_dict[key] = value
+            for kind in _converters:
+                self._typed_cache.pop((kind, key), None)
+        self._combined_dict = combined_dict
+        self._fire_callbacks()
+
+    def _fire_callbacks(self):
+        for callback in self._callbacks[:]:
+            try:
+                callback(self)
+            except Exception:
+                print 'WARNING: configuration reload callback failed'
+                traceback.print_exc()
+
+    def _check_for_changes(self):
+        """
+        Reloads the sources that have changed.  Called from the watcher
+        thread, never from a lookup.
+        """
+        self._write_lock.acquire()
+        try:
+            changed = {}
+            for source in self._sources:
+                if not source.live:
+                    continue
+                try:
+                    if source.has_changed():
+                        changed.update(dict.fromkeys(source.refresh()))
+                except (IOError, OSError), e:
+                    if e.errno == errno.ENOENT: # file not found
+                        # someone messed with our internal state
+                        # or removed the file
+
+                        print 'WARNING: Configuration source has been ' \
+                              'removed ' + ', '.join(source.watched_paths())
+                        print 'Disabling reloading of that source.'
+
+                        traceback.print_exc()
+
+                        source.live = False
+                    else:
+                        raise  # pass the exception along to the caller
+            self._apply_changes(changed.keys())
+        finally:
+            self._write_lock.release()
+
+    def add_source(self, source, position = None):
+        """
+        Adds a ConfigSource to the stack.  By default it goes above
+        every other source except the update/set overrides.
+        """
+        if position is None:
+            position = len(self._sources) - 1
+        source.values = source.load()
+        self._write_lock.acquire()
+        try:
+            self._sources.insert(position, source)
+            self._apply_changes(source.values.keys())
+        finally:
+            self._write_lock.release()
+        self._watch()
+
+    def add_reload_callback(self, callback):
+        """
+        Registers callback(config) to be called whenever the combined
+        configuration changes, whether from a reload or from the
+        update/set methods.  Callbacks may run on the watcher thread.
+        """
+        self._callbacks.append(callback)
+
+    def remove_reload_callback(self, callback):
+        self._callbacks.remove(callback)
+
+    def close(self):
+        """
+        Stops watching the config sources for changes.
+        """
+        if _g_watcher is not None:
+            _g_watcher.unwatch(self)
+        for source in self._sources:
+            source.close()
 
+    def __getitem__(self, key):
         return self._combined_dict[key]
 
     def get(self, key, default = None):
-        try:
-            return self.__getitem__(key)
-        except KeyError:
+        return self._combined_dict.get(key, default)
+
+    def _get_typed(self, kind, key, default):
+        value = self._combined_dict.get(key, _missing)
+        if value is _missing:
             return default
+        cached = self._typed_cache.get((kind, key))
+        if cached is not None and cached[0] is value:
+            return cached[1]
+        try:
+            converted = _converters[kind](value)
+        except (TypeError, ValueError), e:
+            raise ValueError('config value %s=%r is not a valid %s: %s'
+                             % (key, value, kind, e))
+        self._typed_cache[(kind, key)] = (value, converted)
+        return converted
+
+    def get_int(self, key, default = None):
+        return self._get_typed('int', key, default)
+
+    def get_float(self, key, default = None):
+        return self._get_typed('float', key, default)
+
+    def get_bool(self, key, default = None):
+        """
+        Accepts booleans, numbers and the strings true/false, yes/no,
+        on/off and 1/0.
+        """
+        return self._get_typed('bool', key, default)
+
+    def get_list(self, key, default = None):
+        """
+        Returns a tuple.  A string value is split on commas.
+        """
+        return self._get_typed('list', key, default)
 
     def __setitem__(self, key, value):
         """
@@ -132,8 +454,12 @@ class IndraConfig(object):
         that key/value pair will remain set with that value until
         change via the update or set method
         """
-        self._config_overrides[key] = value
-        self._combine_dictionaries()
+        self._write_lock.acquire()
+        try:
+            self._overrides.values[key] = value
+            self._apply_changes([key])
+        finally:
+            self._write_lock.release()
 
     def set(self, key, newval):
         return self.__setitem__(key, newval)
@@ -151,12 +477,14 @@ class IndraConfig(object):
             overrides = new_conf
         else:
             # assuming that it is a filename
-            config_file = open(new_conf)
-            overrides = llsd.parse(config_file.read())
-            config_file.close()
-  
-        self._config_overrides.update(overrides)
-        self._combine_dictionaries()
+            overrides = _parse_file(new_conf)
+
+        self._write_lock.acquire()
+        try:
+            self._overrides.values.update(overrides)
+            self._apply_changes(overrides.keys())
+        finally:
+            self._write_lock.release()
 
     def as_dict(self):
         """
@@ -164,6 +492,130 @@ class IndraConfig(object):
         """
         return copy.deepcopy(self._combined_dict)
 
+class _ConfigWatcher(object):
+    """
+    Watches the files behind live IndraConfig objects and asks them to
+    reload when the files change.  When pyinotify is installed the
+    directories holding the files are watched for writes and renames;
+    otherwise (or when a config has a source that must be polled) a
+    single daemon thread checks each config once per its
+    _reload_check_interval.
+    """
+    _inotify_mask = 0
+    if pyinotify is not None:
+        _inotify_mask = (pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO |
+                         pyinotify.IN_CREATE | pyinotify.IN_DELETE)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._configs = weakref.WeakKeyDictionary()
+        self._polled = weakref.WeakKeyDictionary()
+        self._poll_interval = None
+        self._thread = None
+        self._notifier = None
+        self._watch_manager = None
+        self._watched_dirs = {}
+
+    def watch(self, config):
+        paths = config._watched_paths()
+        self._lock.acquire()
+        try:
+            self._configs[config] = paths
+            if pyinotify is not None and not config._needs_polling():
+                for path in paths:
+                    self._watch_dir(dirname(path))
+                    if os.path.isdir(path):
+                        self._watch_dir(path)
+                return
+            interval = config._reload_check_interval
+            self._polled[config] = time.time() + interval
+            if self._poll_interval is None or interval < self._poll_interval:
+                self._poll_interval = interval
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._poll,
+                                                name='IndraConfigWatcher')
+                self._thread.setDaemon(True)
+                self._thread.start()
+        finally:
+            self._lock.release()
+
+    def unwatch(self, config):
+        self._lock.acquire()
+        try:
+            self._configs.pop(config, None)
+            self._polled.pop(config, None)
+        finally:
+            self._lock.release()
+
+    def _watched(self):
+        self._lock.acquire()
+        try:
+            return self._configs.items()
+        finally:
+            self._lock.release()
+
+    def _due(self, now):
+        self._lock.acquire()
+        try:
+            due = []
+            for config, next_check in self._polled.items():
+                if now >= next_check:
+                    self._polled[config] = \
+                        now + config._reload_check_interval
+                    due.append(config)
+            return due
+        finally:
+            self._lock.release()
+
+    def _check(self, config):
+        try:
+            config._check_for_changes()
+        except Exception:
+            print 'WARNING: Unable to reload configuration ' + \
+                  ', '.join(config._watched_paths())
+            traceback.print_exc()
+
+    def _poll(self):
+        # keep local references; module globals are cleared during
+        # interpreter shutdown while this daemon thread may still run
+        sleep = time.sleep
+        now = time.time
+        while True:
+            sleep(self._poll_interval)
+            for config in self._due(now()):
+                self._check(config)
+
+    def _watch_dir(self, path):
+        if self._notifier is None:
+            self._watch_manager = pyinotify.WatchManager()
+            self._notifier = pyinotify.ThreadedNotifier(
+                self._watch_manager, _InotifyHandler(watcher=self))
+            self._notifier.setDaemon(True)
+            self._notifier.start()
+        if path not in self._watched_dirs:
+            self._watched_dirs[path] = self._watch_manager.add_watch(
+                path, self._inotify_mask)
+
+    def _file_changed(self, path):
+        directory = dirname(path)
+        for config, paths in self._watched():
+            if path in paths or directory in paths:
+                self._check(config)
+
+if pyinotify is not None:
+    class _InotifyHandler(pyinotify.ProcessEvent):
+        def my_init(self, watcher=None):
+            self._watcher = watcher
+
+        def process_default(self, event):
+            self._watcher._file_changed(realpath(event.pathname))
+
+def _get_watcher():
+    global _g_watcher
+    if _g_watcher is None:
+        _g_watcher = _ConfigWatcher()
+    return _g_watcher
+
 def load(indra_xml_file = None):
     global _g_config
 
@@ -177,11 +629,28 @@ def load(indra_xml_file = None):
 
     try:
         _g_config = IndraConfig(indra_xml_file)
-    except IOError:
+    except (IOError, OSError):
         # indra.xml was not openable, so let's initialize with an empty dict
         # some code relies on config behaving this way
         _g_config = IndraConfig(None)
 
+def load_shared(shm_path = None, indra_xml_file = None):
+    """
+    Use the configuration published to shm_path by a
+    shared_config.ConfigPublisher, falling back to loading
+    indra_xml_file directly if nothing has been published.
+    """
+    global _g_config
+    from indra.base import shared_config
+
+    if shm_path is None:
+        shm_path = shared_config.DEFAULT_PATH
+
+    try:
+        _g_config = shared_config.SharedIndraConfig(shm_path)
+    except (IOError, OSError, shared_config.SharedConfigError):
+        load(indra_xml_file)
+
 def dump(indra_xml_file, indra_cfg = None, update_in_mem=False):
     '''
     Dump config contents into a file
@@ -229,6 +698,38 @@ def get(key, default = None):
 
     return _g_config.get(key, default)
 
+def get_int(key, default = None):
+    global _g_config
+
+    if _g_config is None:
+        load()
+
+    return _g_config.get_int(key, default)
+
+def get_float(key, default = None):
+    global _g_config
+
+    if _g_config is None:
+        load()
+
+    return _g_config.get_float(key, default)
+
+def get_bool(key, default = None):
+    global _g_config
+
+    if _g_config is None:
+        load()
+
+    return _g_config.get_bool(key, default)
+
+def get_list(key, default = None):
+    global _g_config
+
+    if _g_config is None:
+        load()
+
+    return _g_config.get_list(key, default)
+
 def set(key, newval):
     """
     Sets the value of the config setting of key to be newval
@@ -0,0 +1,118 @@
+"""\
+@file config_test.py
+@brief Tests for layered IndraConfig sources.
+
+$LicenseInfo:firstyear=2009&license=mit$
+
+Copyright (c) 2009, Linden Research, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+$/LicenseInfo$
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from indra.base import config
+from indra.base import llsd
+
+class TestLayeredConfig(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.indra_xml = os.path.join(self.dir, 'indra.xml')
+        self.fragments = os.path.join(self.dir, 'indra.d')
+        os.mkdir(self.fragments)
+        self._write(self.indra_xml, {'port': '8080', 'debug': 'false',
+                                     'name': 'file'})
+        self._write(os.path.join(self.fragments, '10-name.xml'),
+                    {'name': 'fragment'})
+        self.config = config.IndraConfig(
+            self.indra_xml, sources = [
+                config.DirectorySource(self.fragments),
+                config.EnvironmentSource(environ = {
+                    'INDRA_CONFIG_HOSTS': 'a, b',
+                    'INDRA_CONFIG_DEBUG': 'on'})])
+
+    def tearDown(self):
+        self.config.close()
+        shutil.rmtree(self.dir)
+
+    def _write(self, path, values):
+        f = open(path, 'w')
+        f.write(llsd.format_xml(values))
+        f.close()
+
+    def test_precedence(self):
+        self.assertEqual(self.config['name'], 'fragment')
+        self.assertEqual(self.config.get_bool('debug'), True)
+        self.config.set('name', 'override')
+        self.assertEqual(self.config['name'], 'override')
+
+    def test_typed(self):
+        self.assertEqual(self.config.get_int('port'), 8080)
+        self.assertEqual(self.config.get_list('hosts'), ('a', 'b'))
+        self.assertEqual(self.config.get_int('missing', 3), 3)
+        self.assertRaises(ValueError, self.config.get_int, 'name')
+
+    def test_typed_cache_follows_changes(self):
+        self.assertEqual(self.config.get_int('port'), 8080)
+        self.config.set('port', '9090')
+        self.assertEqual(self.config.get_int('port'), 9090)
+
+    def test_reload_changed_layer(self):
+        seen = []
+        self.config.add_reload_callback(lambda c: seen.append(c['name']))
+        self._write(os.path.join(self.fragments, '20-name.xml'),
+                    {'name': 'later', 'extra': 1})
+        # force the modification to be visible regardless of timestamp
+        # granularity
+        os.utime(os.path.join(self.fragments, '20-name.xml'), (0, 0))
+        self.config._check_for_changes()
+        self.assertEqual(self.config['name'], 'later')
+        self.assertEqual(self.config['extra'], 1)
+        self.assertEqual(seen, ['later'])
+
+    def test_set_publishes_new_snapshot(self):
+        snapshot = self.config._combined_dict
+        self.config.set('name', 'override')
+        self.assertEqual(snapshot['name'], 'fragment')
+        self.assertEqual(self.config.as_dict()['name'], 'override')
+
+class TestMissingConfig(unittest.TestCase):
+    def setUp(self):
+        self._g_config = config._g_config
+
+    def tearDown(self):
+        if config._g_config is not None:
+            config._g_config.close()
+        config._g_config = self._g_config
+
+    def test_missing_file(self):
+        path = os.path.join(tempfile.gettempdir(), 'no-such-dir',
+                            'indra.xml')
+        self.assertRaises(IOError, config.FileSource(path).load)
+        config.load(path)
+        self.assertEqual(config.get('port', 8080), 8080)
+        self.assertEqual(config.get_int('port', 8080), 8080)
+        self.assertEqual(config.get_config().as_dict(), {})
+
+if __name__ == '__main__':
+    unittest.main()
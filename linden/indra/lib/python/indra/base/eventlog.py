@@ -0,0 +1,465 @@
+"""\
+@file eventlog.py
+@brief Indexed binary log of LLMETRICS and LLLOGMESSAGE events.
+
+$LicenseInfo:firstyear=2009&license=mit$
+
+Copyright (c) 2009, Linden Research, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+$/LicenseInfo$
+"""
+
+import getopt
+import os
+import re
+import struct
+import sys
+import threading
+import time
+
+from indra.base import llsd
+
+# File layout:
+#
+#   magic 'LLEVLOG1'
+#   records, each a fixed header followed by a payload:
+#     type (event, table or index), kind (LLMETRICS or LLLOGMESSAGE),
+#     table id, payload length, sequence id, timestamp
+#   trailer (only once the writer is closed):
+#     offset of the last index record, magic 'LLEVEND1'
+#
+# Event payloads are binary LLSD.  A table record names a table id the
+# first time it is used.  Every index_interval events the writer adds
+# an index record describing the chunk of records since the previous
+# one: where it starts, its time range, which tables it holds, the
+# tables it introduced, and where the previous index record is.  With
+# the trailer, a reader can walk the index chain backwards and only
+# visit chunks that can hold matching events.
+
+MAGIC = 'LLEVLOG1'
+TRAILER_MAGIC = 'LLEVEND1'
+
+EVENT = 1
+TABLE = 2
+INDEX = 3
+
+KINDS = ['LLMETRICS', 'LLLOGMESSAGE']
+_kind_ids = dict([(name, i) for i, name in enumerate(KINDS)])
+
+_record = struct.Struct('<BBHIQd')
+_index = struct.Struct('<QQddIHH')
+_table_id = struct.Struct('<H')
+_trailer = struct.Struct('<Q8s')
+
+class EventLogError(Exception):
+    pass
+
+class Event(object):
+    __slots__ = ('kind', 'sequence', 'timestamp', 'table', 'data')
+
+    def __init__(self, kind, sequence, timestamp, table, data):
+        self.kind = kind
+        self.sequence = sequence
+        self.timestamp = timestamp
+        self.table = table
+        self.data = data
+
+    def __repr__(self):
+        return 'Event(%r, %r, %r, %r, %r)' % (self.kind, self.sequence,
+                                              self.timestamp, self.table,
+                                              self.data)
+
+class _Chunk(object):
+    def __init__(self, start):
+        self.start = start
+        self.min_time = None
+        self.max_time = None
+        self.count = 0
+        self.tables = {}
+        self.new_tables = []
+
+    def add(self, table_id, timestamp):
+        if self.min_time is None or timestamp < self.min_time:
+            self.min_time = timestamp
+        if self.max_time is None or timestamp > self.max_time:
+            self.max_time = timestamp
+        self.tables[table_id] = True
+        self.count += 1
+
+class EventLogWriter(object):
+    """
+    Appends events to a binary event log.  Can be passed as the dest
+    of indra.base.metrics.record_metrics/record_event, or as the
+    event_log of an indra.base.lllog.Logger.
+
+    Reopening an existing, cleanly closed log appends to it.
+    """
+    def __init__(self, path, index_interval=1024):
+        self._lock = threading.Lock()
+        self._index_interval = index_interval
+        self._tables = {}
+        self._previous_index = 0
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            self._open_existing(path)
+        else:
+            self._file = open(path, 'wb')
+            self._file.write(MAGIC)
+            self._chunk = _Chunk(self._file.tell())
+
+    def _open_existing(self, path):
+        reader = EventLogReader(path)
+        try:
+            for table_id, name in reader._table_names.iteritems():
+                self._tables[name] = table_id
+            self._previous_index = reader._last_index
+            end = reader._data_end
+            # events after the last index (left by a writer that did not
+            # close cleanly) belong to the chunk being started
+            chunk = _Chunk(len(MAGIC))
+            if self._previous_index:
+                length = reader._read_header(self._previous_index)[3]
+                chunk = _Chunk(self._previous_index + _record.size + length)
+            for offset, header in reader._headers(chunk.start, end):
+                if header[0] == EVENT:
+                    chunk.add(header[2], header[5])
+                elif header[0] == TABLE:
+                    # only the next index can name it for readers
+                    chunk.new_tables.append(
+                        (header[2], reader._table_names[header[2]]))
+        finally:
+            reader.close()
+        self._file = open(path, 'r+b')
+        self._file.seek(end)
+        self._file.truncate()
+        self._chunk = chunk
+
+    def _write_record(self, type, kind, table_id, sequence, timestamp,
+                      payload):
+        self._file.write(_record.pack(type, kind, table_id, len(payload),
+                                      sequence, timestamp))
+        self._file.write(payload)
+
+    def _table(self, table):
+        table_id = self._tables.get(table)
+        if table_id is None:
+            table_id = len(self._tables)
+            if table_id > 0xffff:
+                raise EventLogError('too many tables')
+            self._tables[table] = table_id
+            self._chunk.new_tables.append((table_id, table))
+            self._write_record(TABLE, 0, table_id, 0, 0, table)
+        return table_id
+
+    def write_event(self, header, sequence, table, data, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        payload = llsd.format_binary(data)
+        self._lock.acquire()
+        try:
+            table_id = self._table(table)
+            self._write_record(EVENT, _kind_ids[header], table_id,
+                               sequence, timestamp, payload)
+            self._chunk.add(table_id, timestamp)
+            if self._chunk.count >= self._index_interval:
+                self._write_index()
+        finally:
+            self._lock.release()
+
+    def _write_index(self):
+        chunk = self._chunk
+        if not chunk.count:
+            return
+        offset = self._file.tell()
+        parts = [_index.pack(chunk.start, self._previous_index,
+                             chunk.min_time, chunk.max_time, chunk.count,
+                             len(chunk.tables), len(chunk.new_tables))]
+        table_ids = chunk.tables.keys()
+        table_ids.sort()
+        for table_id in table_ids:
+            parts.append(_table_id.pack(table_id))
+        for table_id, name in chunk.new_tables:
+            parts.append(_table_id.pack(table_id))
+            parts.append(struct.pack('<H', len(name)) + name)
+        self._write_record(INDEX, 0, 0, 0, 0, ''.join(parts))
+        self._previous_index = offset
+        self._chunk = _Chunk(self._file.tell())
+
+    def flush(self):
+        self._lock.acquire()
+        try:
+            self._file.flush()
+        finally:
+            self._lock.release()
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            if self._file is None:
+                return
+            self._write_index()
+            self._file.write(_trailer.pack(self._previous_index,
+                                           TRAILER_MAGIC))
+            self._file.close()
+            self._file = None
+        finally:
+            self._lock.release()
+
+class EventLogReader(object):
+    """
+    Reads a binary event log, filtering on kind, table and time range
+    from the record headers alone; only matching payloads are decoded.
+    """
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        if self._file.read(len(MAGIC)) != MAGIC:
+            raise EventLogError('%s is not an event log' % path)
+        self._file.seek(0, 2)
+        self._size = self._file.tell()
+        self._table_names = {}
+        self._chunks = None
+        self._last_index = 0
+        self._data_end = self._size
+        if self._size >= len(MAGIC) + _trailer.size:
+            self._file.seek(-_trailer.size, 2)
+            last_index, magic = _trailer.unpack(self._file.read(_trailer.size))
+            if magic == TRAILER_MAGIC:
+                self._last_index = last_index
+                self._data_end = self._size - _trailer.size
+                self._read_index_chain()
+        if self._chunks is None:
+            self._scan_tables()
+
+    def close(self):
+        self._file.close()
+
+    def _read_header(self, offset):
+        self._file.seek(offset)
+        header = self._file.read(_record.size)
+        if len(header) < _record.size:
+            return None
+        return _record.unpack(header)
+
+    def _read_index_chain(self):
+        chunks = []
+        offset = self._last_index
+        while offset:
+            type, kind, table_id, length, sequence, timestamp = \
+                  self._read_header(offset)
+            if type != INDEX:
+                raise EventLogError('corrupt index at offset %d' % offset)
+            payload = self._file.read(length)
+            (start, previous, min_time, max_time, count, table_count,
+             new_table_count) = _index.unpack_from(payload, 0)
+            position = _index.size
+            tables = {}
+            for i in xrange(table_count):
+                tables[_table_id.unpack_from(payload, position)[0]] = True
+                position += _table_id.size
+            for i in xrange(new_table_count):
+                table_id, name_length = struct.unpack_from('<HH', payload,
+                                                           position)
+                position += 4
+                self._table_names[table_id] = payload[position:position +
+                                                      name_length]
+                position += name_length
+            chunks.append((start, offset, min_time, max_time, tables))
+            offset = previous
+        chunks.reverse()
+        self._chunks = chunks
+
+    def _scan_tables(self):
+        end = len(MAGIC)
+        for offset, header in self._headers(len(MAGIC), self._data_end):
+            if header[0] == TABLE:
+                self._file.seek(offset + _record.size)
+                self._table_names[header[2]] = self._file.read(header[3])
+            elif header[0] == INDEX:
+                self._last_index = offset
+            end = offset + _record.size + header[3]
+        # drop any record left half-written by a writer that crashed
+        self._data_end = end
+
+    def _headers(self, start, end):
+        offset = start
+        while offset < end:
+            header = self._read_header(offset)
+            if header is None or offset + _record.size + header[3] > end:
+                # a record still being written
+                break
+            yield offset, header
+            offset += _record.size + header[3]
+
+    def tables(self):
+        names = self._table_names.values()
+        names.sort()
+        return names
+
+    def events(self, tables=None, start_time=None, end_time=None,
+               kinds=None, decode=True):
+        """
+        Yields the Events matching every given filter, in file order.
+        tables and kinds are sequences of names; the time range is
+        inclusive.  With decode=False the data of each Event is left
+        as None.
+        """
+        table_ids = None
+        if tables is not None:
+            wanted = dict.fromkeys(tables)
+            table_ids = dict([(table_id, True) for table_id, name
+                              in self._table_names.iteritems()
+                              if name in wanted])
+        kind_ids = None
+        if kinds is not None:
+            kind_ids = dict([(_kind_ids[kind], True) for kind in kinds])
+
+        if self._chunks is None:
+            ranges = [(len(MAGIC), self._data_end)]
+        else:
+            ranges = []
+            for start, end, min_time, max_time, chunk_tables in self._chunks:
+                if start_time is not None and max_time < start_time:
+                    continue
+                if end_time is not None and min_time > end_time:
+                    continue
+                if table_ids is not None:
+                    for table_id in chunk_tables:
+                        if table_id in table_ids:
+                            break
+                    else:
+                        continue
+                ranges.append((start, end))
+
+        for start, end in ranges:
+            for offset, header in self._headers(start, end):
+                type, kind, table_id, length, sequence, timestamp = header
+                if type != EVENT:
+                    continue
+                if kind_ids is not None and kind not in kind_ids:
+                    continue
+                if table_ids is not None and table_id not in table_ids:
+                    continue
+                if start_time is not None and timestamp < start_time:
+                    continue
+                if end_time is not None and timestamp > end_time:
+                    continue
+                data = None
+                if decode:
+                    self._file.seek(offset + _record.size)
+                    data = llsd.parse_binary(self._file.read(length))
+                yield Event(KINDS[kind], sequence, timestamp,
+                            self._table_names.get(table_id), data)
+
+_text_line_re = re.compile(r'(LLMETRICS|LLLOGMESSAGE) \((\d+)\) (\S+) (.*)$')
+_syslog_time_re = re.compile(r'^([A-Z][a-z]{2} [ \d]\d \d\d:\d\d:\d\d) ')
+
+def _syslog_timestamp(line, year):
+    match = _syslog_time_re.match(line)
+    if match is None:
+        return None
+    try:
+        parsed = time.strptime('%d %s' % (year, match.group(1)),
+                               '%Y %b %d %H:%M:%S')
+    except ValueError:
+        return None
+    return float(time.mktime(parsed))
+
+def convert_text_log(lines, writer, year=None):
+    """
+    Copies the LLMETRICS and LLLOGMESSAGE records found in lines of a
+    text log (metrics output or syslog) to an EventLogWriter.  Syslog
+    timestamps, which carry no year, are taken to be in year (default:
+    the current year); lines without one get timestamp 0.  Returns the
+    number of events written.
+    """
+    if year is None:
+        year = time.localtime().tm_year
+    count = 0
+    for line in lines:
+        match = _text_line_re.search(line)
+        if match is None:
+            continue
+        header, sequence, table, notation = match.groups()
+        try:
+            data = llsd.parse_notation(notation.strip())
+        except Exception:
+            continue
+        timestamp = _syslog_timestamp(line, year)
+        if timestamp is None:
+            timestamp = 0.0
+        writer.write_event(header, long(sequence), table, data, timestamp)
+        count += 1
+    return count
+
+def usage():
+    print "Usage:"
+    print sys.argv[0] + " [options] (convert TEXTLOG EVENTLOG | dump EVENTLOG)"
+    print "  convert   Copy LLMETRICS/LLLOGMESSAGE lines from a text log into"
+    print "            a binary event log."
+    print "  dump      Print events from a binary event log as text log lines."
+    print
+    print "Options:"
+    print "  -t, --table   Only dump this table (may be repeated)."
+    print "  -s, --start   Only dump events at or after this unix time."
+    print "  -e, --end     Only dump events at or before this unix time."
+    print "  -h, --help    Print this message and exit."
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    opts, args = getopt.getopt(argv, "t:s:e:h",
+                               ["table=", "start=", "end=", "help"])
+    tables = None
+    start_time = None
+    end_time = None
+    for o, a in opts:
+        if o in ("-t", "--table"):
+            tables = (tables or []) + [a]
+        if o in ("-s", "--start"):
+            start_time = float(a)
+        if o in ("-e", "--end"):
+            end_time = float(a)
+        if o in ("-h", "--help"):
+            usage()
+            return 0
+
+    if len(args) == 3 and args[0] == 'convert':
+        writer = EventLogWriter(args[2])
+        text_log = open(args[1], 'rU')
+        try:
+            count = convert_text_log(text_log, writer)
+        finally:
+            text_log.close()
+            writer.close()
+        print "Converted %d events" % count
+    elif len(args) == 2 and args[0] == 'dump':
+        reader = EventLogReader(args[1])
+        try:
+            for event in reader.events(tables, start_time, end_time):
+                print event.kind, "(%d)" % event.sequence, event.table, \
+                      llsd.format_notation(event.data)
+        finally:
+            reader.close()
+    else:
+        usage()
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
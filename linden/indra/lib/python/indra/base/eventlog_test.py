@@ -0,0 +1,167 @@
+"""\
+@file eventlog_test.py
+@brief Test cases for the binary event log.
+
+$LicenseInfo:firstyear=2009&license=mit$
+
+Copyright (c) 2009, Linden Research, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+$/LicenseInfo$
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from indra.base import eventlog, metrics
+from indra.base.eventlog import EventLogWriter, EventLogReader, EventLogError
+
+class TestEventLog(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'events.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, writer, first, count):
+        for i in xrange(first, first + count):
+            table = ('sim', 'viewer', 'login')[i % 3]
+            kind = ('LLMETRICS', 'LLLOGMESSAGE')[i % 2]
+            writer.write_event(kind, i, table, {'n': i}, 1000.0 + i)
+
+    def read(self, **kwargs):
+        reader = EventLogReader(self.path)
+        try:
+            return [(event.sequence, event.table, event.data)
+                    for event in reader.events(**kwargs)]
+        finally:
+            reader.close()
+
+    def expected(self, sequences):
+        return [(i, ('sim', 'viewer', 'login')[i % 3], {'n': i})
+                for i in sequences]
+
+    def test_round_trip(self):
+        writer = EventLogWriter(self.path, index_interval=10)
+        self.write(writer, 0, 35)
+        writer.close()
+        reader = EventLogReader(self.path)
+        self.assertEquals(reader.tables(), ['login', 'sim', 'viewer'])
+        self.assertEquals(len(reader._chunks), 4)
+        reader.close()
+        self.assertEquals(self.read(), self.expected(range(35)))
+        self.assertEquals(self.read(tables=['viewer']),
+                          self.expected(range(1, 35, 3)))
+        self.assertEquals(self.read(start_time=1012, end_time=1021),
+                          self.expected(range(12, 22)))
+        self.assertEquals([data for sequence, table, data
+                           in self.read(kinds=['LLLOGMESSAGE'])],
+                          [{'n': i} for i in range(1, 35, 2)])
+
+    def test_reopen_appends(self):
+        writer = EventLogWriter(self.path, index_interval=10)
+        self.write(writer, 0, 15)
+        writer.close()
+        writer = EventLogWriter(self.path, index_interval=10)
+        self.write(writer, 15, 20)
+        writer.write_event('LLMETRICS', 35, 'new', {}, 2000.0)
+        writer.close()
+        self.assertEquals(self.read(start_time=1000),
+                          self.expected(range(35)) + [(35, 'new', {})])
+        self.assertEquals(self.read(tables=['new']), [(35, 'new', {})])
+        self.assertEquals(self.read(tables=['sim'], end_time=1020),
+                          self.expected(range(0, 21, 3)))
+
+    def test_never_closed(self):
+        writer = EventLogWriter(self.path, index_interval=10)
+        self.write(writer, 0, 25)
+        writer.flush()
+        # as if the writer died in the middle of a record
+        writer._file.write(eventlog._record.pack(eventlog.EVENT, 0, 0, 100,
+                                                 99, 0.0) + 'abc')
+        writer._file.close()
+        self.assertEquals(self.read(), self.expected(range(25)))
+        self.assertEquals(self.read(tables=['login']),
+                          self.expected(range(2, 25, 3)))
+
+        # reopening drops the partial record and picks up the chunk
+        writer = EventLogWriter(self.path, index_interval=10)
+        self.write(writer, 25, 10)
+        writer.close()
+        reader = EventLogReader(self.path)
+        self.assert_(reader._chunks is not None)
+        reader.close()
+        self.assertEquals(self.read(), self.expected(range(35)))
+        self.assertEquals(self.read(start_time=1020, end_time=1029),
+                          self.expected(range(20, 30)))
+
+    def test_new_table_after_last_index(self):
+        writer = EventLogWriter(self.path, index_interval=2)
+        writer.write_event('LLMETRICS', 1, 'a', {}, 1.0)
+        writer.write_event('LLMETRICS', 2, 'a', {}, 2.0)
+        # a new table after the last index, then the writer dies
+        writer.write_event('LLMETRICS', 3, 'b', {}, 3.0)
+        writer._file.close()
+
+        writer = EventLogWriter(self.path, index_interval=2)
+        writer.write_event('LLMETRICS', 4, 'c', {}, 4.0)
+        writer.close()
+        reader = EventLogReader(self.path)
+        self.assertEquals(reader.tables(), ['a', 'b', 'c'])
+        self.assertEquals([(e.sequence, e.table) for e in reader.events()],
+                          [(1, 'a'), (2, 'a'), (3, 'b'), (4, 'c')])
+        self.assertEquals([e.sequence for e in reader.events(tables=['b'])],
+                          [3])
+        reader.close()
+
+    def test_not_an_event_log(self):
+        open(self.path, 'wb').write('LLMETRICS (1) sim {}\n')
+        self.assertRaises(EventLogError, EventLogReader, self.path)
+
+    def test_metrics_dest(self):
+        writer = EventLogWriter(self.path)
+        metrics.record_metrics('sim', {'fps': 45.0}, writer)
+        metrics.record_event('login', {'agent': 'x'}, writer)
+        writer.close()
+        self.assertEquals([(e.kind, e.table, e.data)
+                           for e in EventLogReader(self.path).events()],
+                          [('LLMETRICS', 'sim', {'fps': 45.0}),
+                           ('LLLOGMESSAGE', 'login', {'agent': 'x'})])
+
+    def test_convert_text_log(self):
+        lines = ['Oct 19 05:58:06 sim1 simulator: '
+                 'LLMETRICS (7) sim {\'fps\':r45}\n',
+                 'unrelated\n',
+                 'LLLOGMESSAGE (8) login {\'agent\':\'x\'}\n',
+                 'LLMETRICS (9) sim {not notation\n']
+        writer = EventLogWriter(self.path)
+        self.assertEquals(eventlog.convert_text_log(lines, writer, 2009), 2)
+        writer.close()
+        events = list(EventLogReader(self.path).events())
+        self.assertEquals([(e.sequence, e.table, e.data) for e in events],
+                          [(7, 'sim', {'fps': 45.0}),
+                           (8, 'login', {'agent': 'x'})])
+        self.assert_(events[0].timestamp > 0)
+        self.assertEquals(events[1].timestamp, 0.0)
+
+if __name__ == '__main__':
+    unittest.main()
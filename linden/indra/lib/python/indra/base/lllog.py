@@ -26,6 +26,15 @@ THE SOFTWARE.
 $/LicenseInfo$
 """
 
+import errno
+import itertools
+import os
+import random
+import socket
+import threading
+import time
+from collections import deque
+
 from indra.base.llsd import format_notation
 
 try:
@@ -45,8 +54,13 @@ except ImportError:
         syslog = staticmethod(syslog)
 
 class Logger(object):
-    def __init__(self, name='indra'):
+    """
+    Writes LLLOGMESSAGE records to syslog, and also to event_log (an
+    indra.base.eventlog.EventLogWriter) if one is given.
+    """
+    def __init__(self, name='indra', event_log=None):
         self._sequence = 0
+        self._event_log = event_log
         try:
             syslog.openlog(name, syslog.LOG_CONS | syslog.LOG_PID,
                            syslog.LOG_LOCAL0)
@@ -59,9 +73,262 @@ class Logger(object):
         return self._sequence
 
     def log(self, msg, llsd):
-        payload = 'INFO: log: LLLOGMESSAGE (%d) %s %s' % (self.next(), msg,
+        sequence = self.next()
+        payload = 'INFO: log: LLLOGMESSAGE (%d) %s %s' % (sequence, msg,
                                                format_notation(llsd))
         syslog.syslog(payload)
+        if self._event_log is not None:
+            self._event_log.write_event('LLLOGMESSAGE', sequence, msg, llsd)
+
+SYSLOG_ADDRESS = '/dev/log'
+_LOG_LOCAL0 = 16
+_LOG_INFO = 6
+
+class TokenBucket(object):
+    """
+    Allows rate events per second on average, with bursts of up to
+    burst events.
+    """
+    def __init__(self, rate, burst=None):
+        if burst is None:
+            burst = max(rate, 1)
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._tokens = self.burst
+        self._last = time.time()
+
+    def take(self, now):
+        tokens = self._tokens + (now - self._last) * self.rate
+        self._last = now
+        if tokens > self.burst:
+            tokens = self.burst
+        if tokens < 1:
+            self._tokens = tokens
+            return False
+        self._tokens = tokens - 1
+        return True
+
+class AsyncLogger(Logger):
+    """
+    A Logger that never blocks its callers on syslog.
+
+    log() assigns a sequence number and appends the message to a ring
+    buffer of capacity entries; when the buffer is full the oldest
+    entry is overwritten and counted as an overflow.  A daemon thread
+    formats the buffered messages in batches and sends each one as a
+    datagram straight to the syslog socket at address, without going
+    through libc's syslog().  If the socket cannot take more (syslogd
+    has stalled) the writer waits and retries while callers carry on.
+
+    rate_limits maps message names to (rate, burst) token buckets, and
+    sample_rates maps message names to the fraction of messages to
+    keep.  Messages dropped by overflow, rate limiting or sampling are
+    counted, and the counts are logged every report_interval seconds as
+    an 'lllog.dropped' message.
+
+    If the syslog socket is unavailable (e.g. on Windows) messages are
+    written with the syslog module from the writer thread instead.
+    """
+    def __init__(self, name='indra', capacity=10000, batch_size=200,
+                 flush_interval=0.5, rate_limits=None, sample_rates=None,
+                 report_interval=60, address=SYSLOG_ADDRESS, event_log=None):
+        Logger.__init__(self, name, event_log)
+        self._name = name
+        self._counter = itertools.count(1)
+        self._buffer = deque(maxlen=capacity)
+        self._capacity = capacity
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._buckets = {}
+        for msg, (rate, burst) in (rate_limits or {}).items():
+            self._buckets[msg] = TokenBucket(rate, burst)
+        self._sample_rates = sample_rates or {}
+        self._report_interval = report_interval
+        self._address = address
+        self._socket = None
+        self._stats_lock = threading.Lock()
+        self.overflows = 0
+        self.rate_limited = {}
+        self.sampled_out = {}
+        self.send_failures = 0
+        self._reported = (0, {}, {})
+        self._last_report = time.time()
+        self._wakeup = threading.Event()
+        self._write_lock = threading.Lock()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='AsyncLogger')
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def next(self):
+        return self._counter.next()
+
+    def _count(self, counts, msg):
+        self._stats_lock.acquire()
+        try:
+            counts[msg] = counts.get(msg, 0) + 1
+        finally:
+            self._stats_lock.release()
+
+    def _overflowed(self, count):
+        self._stats_lock.acquire()
+        try:
+            self.overflows += count
+        finally:
+            self._stats_lock.release()
+
+    def log(self, msg, llsd):
+        bucket = self._buckets.get(msg)
+        if bucket is not None and not bucket.take(time.time()):
+            self._count(self.rate_limited, msg)
+            return
+        sample_rate = self._sample_rates.get(msg)
+        if sample_rate is not None and random.random() >= sample_rate:
+            self._count(self.sampled_out, msg)
+            return
+        buffer = self._buffer
+        if len(buffer) >= self._capacity:
+            self._overflowed(1)
+        buffer.append((self.next(), msg, llsd))
+        if len(buffer) >= self._batch_size:
+            self._wakeup.set()
+
+    def _connect(self):
+        if not hasattr(socket, 'AF_UNIX'):
+            return None
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            sock.connect(self._address)
+        except socket.error:
+            sock.close()
+            return None
+        sock.setblocking(0)
+        return sock
+
+    def _send(self, payload):
+        """
+        Sends one message.  Returns False if syslog cannot take it yet.
+        """
+        if self._socket is None:
+            self._socket = self._connect()
+            if self._socket is None:
+                syslog.syslog(payload)
+                return True
+        datagram = '<%d>%s %s[%d]: %s' % (
+            _LOG_LOCAL0 * 8 + _LOG_INFO,
+            time.strftime('%b %d %H:%M:%S'), self._name, os.getpid(), payload)
+        try:
+            self._socket.send(datagram)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS):
+                return False
+            # syslogd went away; reconnect on the next message
+            self.send_failures += 1
+            self._socket.close()
+            self._socket = None
+        return True
+
+    def _run(self):
+        # keep a local reference; module globals are cleared during
+        # interpreter shutdown while this daemon thread may still run
+        sleep = time.sleep
+        while self._running:
+            self._wakeup.wait(self._flush_interval)
+            self._wakeup.clear()
+            if not self._write_batches():
+                # syslog is stalled; give it a moment
+                sleep(self._flush_interval)
+            self._report_drops()
+
+    def _write_batches(self):
+        """
+        Sends everything buffered.  Returns False if syslog stalled.
+        """
+        buffer = self._buffer
+        self._write_lock.acquire()
+        try:
+            while buffer:
+                batch = []
+                try:
+                    for i in xrange(self._batch_size):
+                        batch.append(buffer.popleft())
+                except IndexError:
+                    pass
+                for position in xrange(len(batch)):
+                    sequence, msg, llsd = batch[position]
+                    payload = 'INFO: log: LLLOGMESSAGE (%d) %s %s' % (
+                        sequence, msg, format_notation(llsd))
+                    if not self._send(payload):
+                        # put back what was not sent.  Everything in
+                        # the buffer is newer, so if it no longer fits
+                        # the oldest unsent messages are the ones dropped;
+                        # extendleft() on a full deque would drop the
+                        # newest from the other end instead.
+                        unsent = batch[position:]
+                        evicted = len(unsent) - max(0, self._capacity - len(buffer))
+                        if evicted > 0:
+                            self._overflowed(evicted)
+                            unsent = unsent[evicted:]
+                        unsent.reverse()
+                        buffer.extendleft(unsent)
+                        return False
+                    if self._event_log is not None:
+                        self._event_log.write_event('LLLOGMESSAGE', sequence,
+                                                    msg, llsd)
+            return True
+        finally:
+            self._write_lock.release()
+
+    def _report_drops(self, force=False):
+        now = time.time()
+        if not force and now - self._last_report < self._report_interval:
+            return
+        self._last_report = now
+        self._stats_lock.acquire()
+        try:
+            current = (self.overflows, self.rate_limited.copy(),
+                       self.sampled_out.copy())
+        finally:
+            self._stats_lock.release()
+        overflows, rate_limited, sampled_out = current
+        reported_overflows, reported_limited, reported_sampled = self._reported
+        report = {}
+        if overflows != reported_overflows:
+            report['overflow'] = overflows - reported_overflows
+        for key, counts, reported in (('rate_limited', rate_limited, reported_limited),
+                                      ('sampled_out', sampled_out, reported_sampled)):
+            delta = {}
+            for msg, count in counts.iteritems():
+                if count != reported.get(msg, 0):
+                    delta[msg] = count - reported.get(msg, 0)
+            if delta:
+                report[key] = delta
+        self._reported = current
+        if report:
+            self._buffer.append((self.next(), 'lllog.dropped', report))
+            self._write_batches()
+
+    def flush(self):
+        "Send everything buffered so far, waiting for syslog if necessary."
+        while not self._write_batches():
+            time.sleep(self._flush_interval)
+
+    def close(self, timeout=1.0):
+        """
+        Stops the writer, waiting up to timeout seconds for syslog to
+        take what is still buffered.
+        """
+        self._running = False
+        self._wakeup.set()
+        if threading.currentThread() is not self._thread:
+            self._thread.join()
+        self._report_drops(force=True)
+        deadline = time.time() + timeout
+        while not self._write_batches() and time.time() < deadline:
+            time.sleep(0.01)
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
 
 _logger = None
 
@@ -70,3 +337,14 @@ def log(msg, llsd):
     if _logger is None:
         _logger = Logger()
     _logger.log(msg, llsd)
+
+def start_async(name='indra', **kwargs):
+    """
+    Send subsequent log() calls through an AsyncLogger built with these
+    arguments.
+    """
+    global _logger
+    if isinstance(_logger, AsyncLogger):
+        _logger.close()
+    _logger = AsyncLogger(name, **kwargs)
+    return _logger
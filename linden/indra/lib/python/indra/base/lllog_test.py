@@ -0,0 +1,155 @@
+"""\
+@file lllog_test.py
+@brief Tests for the asynchronous syslog pipeline in lllog.
+
+$LicenseInfo:firstyear=2009&license=mit$
+
+Copyright (c) 2009, Linden Research, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+$/LicenseInfo$
+"""
+
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+from indra.base import lllog
+
+class TestAsyncLogger(unittest.TestCase):
+    """
+    Uses a local datagram socket as a stand-in for /dev/log.
+    """
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.address = os.path.join(self.dir, 'log')
+        self.syslogd = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.syslogd.bind(self.address)
+        self.syslogd.settimeout(5)
+        self.logger = None
+
+    def tearDown(self):
+        if self.logger is not None:
+            self.logger.close()
+        self.syslogd.close()
+        shutil.rmtree(self.dir)
+
+    def _received(self):
+        messages = []
+        self.syslogd.setblocking(0)
+        try:
+            while True:
+                messages.append(self.syslogd.recv(65536))
+        except socket.error:
+            pass
+        self.syslogd.settimeout(5)
+        return messages
+
+    def test_delivery(self):
+        self.logger = lllog.AsyncLogger('test', address=self.address)
+        self.logger.log('hello', {'a': 1})
+        self.logger.flush()
+        message = self.syslogd.recv(65536)
+        self.assert_(message.startswith('<134>'))
+        self.assert_(message.endswith(
+            "test[%d]: INFO: log: LLLOGMESSAGE (1) hello {'a':i1}" % os.getpid()))
+
+    def test_stalled_sink_does_not_block(self):
+        self.logger = lllog.AsyncLogger('test', capacity=100,
+                                        batch_size=10, flush_interval=0.01,
+                                        address=self.address)
+        # nobody reads the socket, so its buffer fills and syslog stalls;
+        # a log() that waited for syslog would never finish
+        def spam():
+            for i in xrange(20000):
+                self.logger.log('spam', {'i': i})
+        caller = threading.Thread(target=spam)
+        caller.setDaemon(True)
+        caller.start()
+        caller.join(60)
+        self.failIf(caller.isAlive(), 'log() blocked on a stalled syslog')
+        self.assert_(self.logger.overflows > 0)
+
+        # once syslog drains, logging resumes and the drops are reported
+        received = []
+        def drain():
+            try:
+                while True:
+                    received.append(self.syslogd.recv(65536))
+            except socket.timeout:
+                pass
+        self.syslogd.settimeout(0.5)
+        reader = threading.Thread(target=drain)
+        reader.start()
+        self.logger.close()
+        reader.join()
+        self.assert_('lllog.dropped' in received[-1])
+        self.logger = None
+
+    def test_requeue_drops_oldest(self):
+        self.logger = lllog.AsyncLogger('test', capacity=5, batch_size=3,
+                                        address=self.address)
+        logger = self.logger
+        # stop the writer thread so the buffer is only changed here
+        logger._running = False
+        logger._wakeup.set()
+        logger._thread.join()
+        sent = []
+        def send(payload):
+            if not sent:
+                # two more arrive while m0 is sent, then syslog stalls
+                logger.log('m5', {})
+                logger.log('m6', {})
+            elif len(sent) == 1:
+                return False
+            sent.append(payload)
+            return True
+        logger._send = send
+        for i in xrange(5):
+            logger.log('m%d' % i, {})
+        # m0 is sent and m1 fails; m1 and m2 go back, but with m5 and m6
+        # queued there is only room for one, so the older m1 is dropped
+        self.failIf(logger._write_batches())
+        self.assertEquals([entry[1] for entry in logger._buffer],
+                          ['m2', 'm3', 'm4', 'm5', 'm6'])
+        self.assertEquals(logger.overflows, 1)
+        del logger._send
+        logger.close()
+        self.logger = None
+
+    def test_rate_limit_and_sampling(self):
+        self.logger = lllog.AsyncLogger('test', address=self.address,
+                                        rate_limits={'limited': (1, 5)},
+                                        sample_rates={'sampled': 0})
+        for i in xrange(50):
+            self.logger.log('limited', {})
+            self.logger.log('sampled', {})
+        self.assert_(self.logger.rate_limited['limited'] >= 40)
+        self.assertEqual(self.logger.sampled_out['sampled'], 50)
+        self.logger.close()
+        messages = self._received()
+        self.assert_(len([m for m in messages if ' limited ' in m]) <= 10)
+        self.assert_('lllog.dropped' in messages[-1])
+        self.logger = None
+
+if __name__ == '__main__':
+    unittest.main()
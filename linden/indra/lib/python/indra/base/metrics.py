@@ -28,10 +28,19 @@ THE SOFTWARE.
 $/LicenseInfo$
 """
 
+import atexit
+import itertools
 import sys
+import threading
+from collections import deque
+
 from indra.base import llsd
 
-_sequence_id = 0
+# itertools.count.next() is atomic under the GIL, so concurrent callers
+# never share a sequence id.
+_sequence = itertools.count()
+
+_async_sink = None
 
 def record_metrics(table, stats, dest=None):
     "Write a standard metrics log"
@@ -41,13 +50,192 @@ def record_event(table, data, dest=None):
     "Write a standard logmessage log"
     _log("LLLOGMESSAGE", table, data, dest)
 
+def _format(header, sequence_id, table, data):
+    return "%s (%d) %s %s\n" % (header, sequence_id, table,
+                                llsd.format_notation(data))
+
 def _log(header, table, data, dest):
+    sink = _async_sink
+    if dest is None and sink is not None:
+        sink.enqueue(header, _sequence.next(), table, data)
+        return
     if dest is None:
         # do this check here in case sys.stdout changes at some
         # point. as a default parameter, it will never be
         # re-evaluated.
         dest = sys.stdout
-    global _sequence_id
-    print >>dest, header, "(" + str(_sequence_id) + ")",
-    print >>dest, table, llsd.format_notation(data)
-    _sequence_id += 1
+    if hasattr(dest, 'write_event'):
+        # an indra.base.eventlog.EventLogWriter
+        dest.write_event(header, _sequence.next(), table, data)
+        return
+    dest.write(_format(header, _sequence.next(), table, data))
+
+class AsyncMetricsSink(object):
+    """
+    Moves metrics formatting and I/O off the caller's path.
+
+    Recording an event only appends it to a bounded queue; a daemon
+    thread (a greenlet, if threading has been monkeypatched) formats
+    queued events in batches and writes each batch with a single write
+    call, or hands them to dest.write_event if dest is an
+    indra.base.eventlog.EventLogWriter.  Events are formatted on the
+    writer thread, so callers must not modify the data they record
+    afterwards.
+
+    When the queue is full the DROP policy discards the event and
+    counts it in 'dropped'; the BLOCK policy makes the caller wait for
+    the writer to catch up.  A failed write is counted in
+    'write_errors' and the events it held in 'dropped'.
+    """
+    DROP = 'drop'
+    BLOCK = 'block'
+
+    def __init__(self, dest=None, max_queued=10000, policy=DROP,
+                 batch_size=500, flush_interval=1.0):
+        if policy not in (self.DROP, self.BLOCK):
+            raise ValueError("unknown queue policy: %r" % (policy,))
+        self.dropped = 0
+        self.write_errors = 0
+        self._dest = dest
+        self._max_queued = max_queued
+        self._policy = policy
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._queue = deque()
+        self._wakeup = threading.Event()
+        self._drained = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._running = True
+        self._thread = threading.Thread(target=self._run,
+                                        name='AsyncMetricsSink')
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def enqueue(self, header, sequence_id, table, data):
+        queue = self._queue
+        if len(queue) >= self._max_queued:
+            if self._policy == self.DROP:
+                self._drop()
+                return
+            self._wait_for_space()
+        queue.append((header, sequence_id, table, data))
+        if len(queue) >= self._batch_size:
+            self._wakeup.set()
+
+    def _drop(self):
+        self._drained.acquire()
+        try:
+            self.dropped += 1
+        finally:
+            self._drained.release()
+
+    def _wait_for_space(self):
+        self._drained.acquire()
+        try:
+            while self._running and self._thread.isAlive() and \
+                      len(self._queue) >= self._max_queued:
+                self._wakeup.set()
+                self._drained.wait(self._flush_interval)
+        finally:
+            self._drained.release()
+
+    def _run(self):
+        while self._running:
+            self._wakeup.wait(self._flush_interval)
+            self._wakeup.clear()
+            self._write_batches()
+
+    def _write_batches(self):
+        queue = self._queue
+        popleft = queue.popleft
+        batch_size = self._batch_size
+        self._write_lock.acquire()
+        try:
+            while queue:
+                dest = self._dest
+                if dest is None:
+                    dest = sys.stdout
+                if hasattr(dest, 'write_event'):
+                    for i in xrange(batch_size):
+                        try:
+                            event = popleft()
+                        except IndexError:
+                            break
+                        try:
+                            dest.write_event(*event)
+                        except Exception:
+                            self._write_failed(1)
+                else:
+                    lines = []
+                    try:
+                        for i in xrange(batch_size):
+                            lines.append(_format(*popleft()))
+                    except IndexError:
+                        pass
+                    try:
+                        dest.write(''.join(lines))
+                    except Exception:
+                        self._write_failed(len(lines))
+                self._drained.acquire()
+                try:
+                    self._drained.notifyAll()
+                finally:
+                    self._drained.release()
+            dest = self._dest or sys.stdout
+            if hasattr(dest, 'flush'):
+                try:
+                    dest.flush()
+                except Exception:
+                    self._write_failed(0)
+        finally:
+            self._write_lock.release()
+
+    def _write_failed(self, lost):
+        # keep the writer thread alive; the events are gone either way
+        self._drained.acquire()
+        try:
+            self.write_errors += 1
+            self.dropped += lost
+        finally:
+            self._drained.release()
+
+    def flush(self):
+        """
+        Writes everything queued so far before returning.
+        """
+        self._write_batches()
+
+    def close(self):
+        self._running = False
+        self._wakeup.set()
+        if threading.currentThread() is not self._thread:
+            self._thread.join()
+        self.flush()
+
+def start_async(dest=None, **kwargs):
+    """
+    Route record_metrics and record_event calls that do not name a
+    dest through an AsyncMetricsSink built with these arguments.
+    Queued events are flushed at interpreter exit.
+    """
+    global _async_sink
+    if _async_sink is not None:
+        _async_sink.close()
+    _async_sink = AsyncMetricsSink(dest, **kwargs)
+    return _async_sink
+
+def stop_async():
+    "Flush queued events and go back to writing synchronously"
+    global _async_sink
+    sink = _async_sink
+    _async_sink = None
+    if sink is not None:
+        sink.close()
+
+def flush():
+    "Write any queued metrics now"
+    sink = _async_sink
+    if sink is not None:
+        sink.flush()
+
+atexit.register(stop_async)
@@ -0,0 +1,252 @@
+"""\
+@file metrics_aggregator.py
+@brief In-process counters, gauges and latency histograms reported through metrics.
+
+$LicenseInfo:firstyear=2009&license=mit$
+
+Copyright (c) 2009, Linden Research, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+$/LicenseInfo$
+"""
+
+import atexit
+import itertools
+import threading
+import time
+
+from indra.base import metrics
+from indra.util.histogram import LogLinearHistogram
+
+_gauge_order = itertools.count()
+
+class _Shard(object):
+    """
+    Per-thread metric state.  Only its own thread updates a shard, so
+    its lock is uncontended except while the flusher drains it.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.thread = threading.currentThread()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def drain(self):
+        self.lock.acquire()
+        try:
+            counters, self.counters = self.counters, {}
+            gauges, self.gauges = self.gauges, {}
+            histograms, self.histograms = self.histograms, {}
+        finally:
+            self.lock.release()
+        return counters, gauges, histograms
+
+class MetricsAggregator(object):
+    """
+    Aggregates high-frequency measurements in memory and reports one
+    metrics.record_metrics() record per metric per interval instead of
+    one line per event.
+
+    - counters (increment) report the total for the interval
+    - gauges (gauge) report the most recently set value, every interval
+    - histograms (observe) report count, min, max, mean and percentiles
+      from a LogLinearHistogram
+
+    Every update touches only the calling thread's shard, so recording
+    is O(1) and threads do not contend with each other.  Records are
+    written under table_prefix + name.
+    """
+    def __init__(self, interval=60, table_prefix='', dest=None,
+                 percentiles=(50, 90, 99), sub_buckets=16):
+        self.interval = interval
+        self.table_prefix = table_prefix
+        self.dest = dest
+        self.percentiles = percentiles
+        self.sub_buckets = sub_buckets
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._gauges = {}
+        self._last_flush = time.time()
+        self._thread = None
+        self._stopped = None
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = _Shard()
+            self._shards_lock.acquire()
+            try:
+                self._shards.append(shard)
+            finally:
+                self._shards_lock.release()
+            return shard
+
+    def increment(self, name, amount=1):
+        shard = self._shard()
+        shard.lock.acquire()
+        try:
+            shard.counters[name] = shard.counters.get(name, 0) + amount
+        finally:
+            shard.lock.release()
+
+    def gauge(self, name, value):
+        shard = self._shard()
+        shard.lock.acquire()
+        try:
+            shard.gauges[name] = (_gauge_order.next(), value)
+        finally:
+            shard.lock.release()
+
+    def observe(self, name, value):
+        "Record one sample, such as a latency in microseconds."
+        shard = self._shard()
+        shard.lock.acquire()
+        try:
+            histogram = shard.histograms.get(name)
+            if histogram is None:
+                histogram = shard.histograms[name] = \
+                            LogLinearHistogram(self.sub_buckets)
+            histogram.record(value)
+        finally:
+            shard.lock.release()
+
+    def _drain_shards(self):
+        self._shards_lock.acquire()
+        try:
+            shards = self._shards[:]
+            # forget shards of threads that have gone away; their last
+            # data is collected below
+            self._shards = [shard for shard in shards
+                            if shard.thread.isAlive()]
+        finally:
+            self._shards_lock.release()
+
+        counters = {}
+        histograms = {}
+        for shard in shards:
+            shard_counters, shard_gauges, shard_histograms = shard.drain()
+            for name, amount in shard_counters.iteritems():
+                counters[name] = counters.get(name, 0) + amount
+            for name, gauge in shard_gauges.iteritems():
+                if name not in self._gauges or self._gauges[name][0] < gauge[0]:
+                    self._gauges[name] = gauge
+            for name, histogram in shard_histograms.iteritems():
+                if name in histograms:
+                    histograms[name].merge(histogram)
+                else:
+                    histograms[name] = histogram
+        return counters, histograms
+
+    def flush(self):
+        """
+        Writes one record for every metric updated since the last
+        flush, and one for every gauge.
+        """
+        self._flush_lock.acquire()
+        try:
+            now = time.time()
+            interval = now - self._last_flush
+            self._last_flush = now
+            counters, histograms = self._drain_shards()
+            prefix = self.table_prefix
+            for name, amount in counters.iteritems():
+                metrics.record_metrics(prefix + name,
+                                       {'type': 'counter',
+                                        'count': amount,
+                                        'interval': interval}, self.dest)
+            for name, (order, value) in self._gauges.iteritems():
+                metrics.record_metrics(prefix + name,
+                                       {'type': 'gauge',
+                                        'value': value,
+                                        'interval': interval}, self.dest)
+            for name, histogram in histograms.iteritems():
+                stats = histogram.summary(self.percentiles)
+                stats['type'] = 'histogram'
+                stats['interval'] = interval
+                metrics.record_metrics(prefix + name, stats, self.dest)
+        finally:
+            self._flush_lock.release()
+
+    def start(self):
+        "Flush every interval seconds from a daemon thread."
+        if self._thread is not None:
+            return
+        # each flusher gets its own event, so one that is still asleep
+        # when stop() is called can never outlive it
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run,
+                                        args=(self._stopped,),
+                                        name='MetricsAggregator')
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def _run(self, stopped):
+        while not stopped.isSet():
+            stopped.wait(self.interval)
+            if not stopped.isSet():
+                self.flush()
+
+    def stop(self):
+        "Stop the flusher thread and write what has been collected."
+        thread = self._thread
+        self._thread = None
+        if thread is not None:
+            self._stopped.set()
+            if thread is not threading.currentThread():
+                thread.join()
+        self.flush()
+
+_g_aggregator = None
+
+def get_aggregator():
+    global _g_aggregator
+    if _g_aggregator is None:
+        _g_aggregator = MetricsAggregator()
+    return _g_aggregator
+
+def start(interval=60, **kwargs):
+    """
+    Configure and start the global aggregator.  Its remaining data is
+    flushed at interpreter exit.
+    """
+    global _g_aggregator
+    if _g_aggregator is not None:
+        _g_aggregator.stop()
+    _g_aggregator = MetricsAggregator(interval, **kwargs)
+    _g_aggregator.start()
+    return _g_aggregator
+
+def increment(name, amount=1):
+    get_aggregator().increment(name, amount)
+
+def gauge(name, value):
+    get_aggregator().gauge(name, value)
+
+def observe(name, value):
+    get_aggregator().observe(name, value)
+
+def _flush_at_exit():
+    if _g_aggregator is not None:
+        _g_aggregator.stop()
+
+atexit.register(_flush_at_exit)
@@ -0,0 +1,161 @@
+"""\
+@file metrics_aggregator_test.py
+@brief Test cases for in-memory metrics aggregation.
+
+$LicenseInfo:firstyear=2009&license=mit$
+
+Copyright (c) 2009, Linden Research, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+$/LicenseInfo$
+"""
+
+import threading
+import time
+import unittest
+
+from indra.base import metrics_aggregator
+from indra.base.metrics_aggregator import MetricsAggregator
+
+class _EventDest(object):
+    """ Keeps records the way an eventlog.EventLogWriter would write them """
+    def __init__(self):
+        self.records = []
+
+    def write_event(self, header, sequence_id, table, data):
+        self.records.append((table, data))
+
+    def tables(self):
+        result = {}
+        for table, data in self.records:
+            result[table] = data
+        return result
+
+class _Clock(object):
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+def _flushers():
+    return [thread for thread in threading.enumerate()
+            if thread.getName() == 'MetricsAggregator']
+
+class TestFlush(unittest.TestCase):
+    def setUp(self):
+        self.dest = _EventDest()
+        self.aggregator = MetricsAggregator(table_prefix='test.',
+                                            dest=self.dest)
+
+    def test_counters_across_threads(self):
+        def count():
+            for i in xrange(100):
+                self.aggregator.increment('requests')
+        threads = [threading.Thread(target=count) for i in xrange(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.aggregator.increment('requests', 5)
+        self.aggregator.flush()
+        records = self.dest.tables()
+        self.assertEquals(records.keys(), ['test.requests'])
+        self.assertEquals(records['test.requests']['type'], 'counter')
+        self.assertEquals(records['test.requests']['count'], 405)
+
+        # nothing new to report
+        self.dest.records = []
+        self.aggregator.flush()
+        self.assertEquals(self.dest.records, [])
+
+    def test_gauges_repeat(self):
+        self.aggregator.gauge('queue', 3)
+        self.aggregator.gauge('queue', 7)
+        self.aggregator.flush()
+        self.aggregator.flush()
+        self.assertEquals([(table, data['value'])
+                           for table, data in self.dest.records],
+                          [('test.queue', 7), ('test.queue', 7)])
+
+    def test_histogram(self):
+        for value in (10, 20, 30, 40):
+            self.aggregator.observe('latency', value)
+        self.aggregator.flush()
+        stats = self.dest.tables()['test.latency']
+        self.assertEquals(stats['type'], 'histogram')
+        self.assertEquals(stats['count'], 4)
+        self.assertEquals(stats['min'], 10)
+        self.assertEquals(stats['max'], 40)
+        self.assertEquals(stats['mean'], 25)
+        self.assert_('p99' in stats)
+
+    def test_interval(self):
+        clock = _Clock(1000.0)
+        saved = metrics_aggregator.time
+        metrics_aggregator.time = clock
+        try:
+            aggregator = MetricsAggregator(dest=self.dest)
+            clock.now = 1030.0
+            aggregator.increment('a')
+            aggregator.flush()
+            clock.now = 1090.0
+            aggregator.increment('a')
+            aggregator.flush()
+        finally:
+            metrics_aggregator.time = saved
+        self.assertEquals([data['interval'] for table, data
+                           in self.dest.records], [30.0, 60.0])
+
+class TestFlusher(unittest.TestCase):
+    def test_flushes_every_interval(self):
+        dest = _EventDest()
+        aggregator = MetricsAggregator(interval=0.05, dest=dest)
+        aggregator.start()
+        try:
+            aggregator.increment('a')
+            deadline = time.time() + 5
+            while not dest.records and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertEquals(dest.tables()['a']['count'], 1)
+        finally:
+            aggregator.stop()
+
+    def test_stop_writes_remaining(self):
+        dest = _EventDest()
+        aggregator = MetricsAggregator(interval=60, dest=dest)
+        aggregator.start()
+        aggregator.increment('a', 3)
+        aggregator.stop()
+        self.assertEquals(dest.tables()['a']['count'], 3)
+
+    def test_restart_leaves_one_flusher(self):
+        before = len(_flushers())
+        aggregator = MetricsAggregator(interval=60, dest=_EventDest())
+        aggregator.start()
+        aggregator.stop()
+        aggregator.start()
+        try:
+            self.assertEquals(len(_flushers()), before + 1)
+        finally:
+            aggregator.stop()
+        self.assertEquals(len(_flushers()), before)
+
+if __name__ == '__main__':
+    unittest.main()
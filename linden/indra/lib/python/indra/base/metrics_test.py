@@ -0,0 +1,83 @@
+"""\
+@file metrics_test.py
+@brief Tests for the asynchronous metrics sink.
+
+$LicenseInfo:firstyear=2009&license=mit$
+
+Copyright (c) 2009, Linden Research, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+$/LicenseInfo$
+"""
+
+import threading
+import time
+import unittest
+
+from indra.base import metrics
+
+class _FlakyDest(object):
+    """ Fails its first write, then keeps lines """
+    def __init__(self):
+        self.lines = []
+        self.failures = 1
+
+    def write(self, text):
+        if self.failures:
+            self.failures -= 1
+            raise IOError("disk full")
+        self.lines.extend(text.splitlines())
+
+class TestAsyncMetricsSink(unittest.TestCase):
+    def test_write_error_keeps_writer_running(self):
+        dest = _FlakyDest()
+        sink = metrics.AsyncMetricsSink(dest, batch_size=2, flush_interval=10)
+        try:
+            sink.enqueue("LLMETRICS", 1, "test", {'n': 1})
+            sink.enqueue("LLMETRICS", 2, "test", {'n': 2})
+            sink.flush()
+            self.assertEquals(sink.write_errors, 1)
+            self.assertEquals(sink.dropped, 2)
+            sink.enqueue("LLMETRICS", 3, "test", {'n': 3})
+            sink.flush()
+            self.assertEquals(len(dest.lines), 1)
+            self.assert_(sink._thread.isAlive())
+        finally:
+            sink.close()
+
+    def test_block_policy_gives_up_without_writer(self):
+        sink = metrics.AsyncMetricsSink(_FlakyDest(), max_queued=1,
+                                        policy=metrics.AsyncMetricsSink.BLOCK,
+                                        flush_interval=0.05)
+        # stop the writer thread without draining the queue
+        sink._running = False
+        sink._wakeup.set()
+        sink._thread.join()
+        sink._running = True
+        sink.enqueue("LLMETRICS", 1, "test", {})
+        done = threading.Event()
+        def enqueue():
+            sink.enqueue("LLMETRICS", 2, "test", {})
+            done.set()
+        threading.Thread(target=enqueue).start()
+        done.wait(5)
+        self.assert_(done.isSet())
+
+if __name__ == '__main__':
+    unittest.main()
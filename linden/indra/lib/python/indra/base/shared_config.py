@@ -0,0 +1,233 @@
+"""\
+@file shared_config.py
+@brief Share one parsed indra.xml between the processes on a host.
+
+$LicenseInfo:firstyear=2009&license=mit$
+
+Copyright (c) 2009, Linden Research, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+$/LicenseInfo$
+"""
+
+import getopt
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+from indra.base import config
+from indra.base import llsd
+
+DEFAULT_PATH = "/dev/shm/indra_config.shm"
+
+# The shared file is a fixed header followed by the combined
+# configuration as binary LLSD:
+#   magic 'ICFG', format version, generation, payload length
+_MAGIC = 'ICFG'
+_FORMAT = 1
+_header = struct.Struct('<4sIQI')
+_generation = struct.Struct('<Q')
+_GENERATION_OFFSET = 8
+
+class SharedConfigError(Exception):
+    pass
+
+def _read_generation(path):
+    try:
+        shared = open(path, 'rb')
+    except IOError:
+        return 0
+    try:
+        header = shared.read(_header.size)
+    finally:
+        shared.close()
+    if len(header) < _header.size:
+        return 0
+    magic, format, generation, length = _header.unpack(header)
+    if magic != _MAGIC:
+        return 0
+    return generation
+
+class ConfigPublisher(object):
+    """
+    Compiles the combined contents of an IndraConfig (file plus
+    update/set overrides) into a shared file, normally in /dev/shm,
+    which SharedIndraConfig objects in other processes map.
+
+    Each publish writes a complete new file and renames it into place,
+    then stores the new generation in the header of the file it
+    replaced.  Readers still mapping the old file see the generation
+    change, remap the path and pick up the new contents.
+    """
+    def __init__(self, indra_config, shm_path = DEFAULT_PATH):
+        self._config = indra_config
+        self._path = shm_path
+        self._lock = threading.Lock()
+        self._generation = _read_generation(shm_path)
+        indra_config.add_reload_callback(self._config_changed)
+
+    def _config_changed(self, indra_config):
+        self.publish()
+
+    def publish(self):
+        """
+        Writes the current configuration and returns its generation.
+        """
+        self._lock.acquire()
+        try:
+            generation = self._generation + 1
+            payload = llsd.format_binary(self._config.as_dict())
+            # unique to this thread, so publishers for the same path
+            # in one process don't write the same file
+            tmpname = '%s.%d.%d' % (self._path, os.getpid(),
+                                    threading.currentThread().ident)
+            shared = open(tmpname, 'wb')
+            try:
+                shared.write(_header.pack(_MAGIC, _FORMAT, generation,
+                                          len(payload)))
+                shared.write(payload)
+            finally:
+                shared.close()
+
+            try:
+                previous = open(self._path, 'r+b')
+            except IOError:
+                previous = None
+            try:
+                os.rename(tmpname, self._path)
+                if previous is not None:
+                    previous.seek(_GENERATION_OFFSET)
+                    previous.write(_generation.pack(generation))
+            finally:
+                if previous is not None:
+                    previous.close()
+
+            self._generation = generation
+            return generation
+        finally:
+            self._lock.release()
+
+    def close(self):
+        self._config.remove_reload_callback(self._config_changed)
+
+class SharedMemorySource(config.ConfigSource):
+    """
+    A config source backed by a ConfigPublisher's shared file.
+
+    Checking for changes reads the generation counter in the mapped
+    header, which is a memory read rather than a stat() call, so the
+    watcher polls it instead of relying on inotify.
+    """
+    poll = True
+
+    def __init__(self, shm_path = DEFAULT_PATH):
+        config.ConfigSource.__init__(self)
+        self.path = shm_path
+        self._map = None
+        self._generation = None
+
+    def load(self):
+        shared = open(self.path, 'rb')
+        try:
+            shared_map = mmap.mmap(shared.fileno(), 0,
+                                   access = mmap.ACCESS_READ)
+        finally:
+            shared.close()
+
+        try:
+            magic, format, generation, length = \
+                   _header.unpack_from(shared_map, 0)
+            if magic != _MAGIC or format != _FORMAT:
+                raise SharedConfigError(
+                    '%s is not a shared config file' % self.path)
+            start = _header.size
+            values = llsd.parse_binary(shared_map[start:start + length])
+        except:
+            shared_map.close()
+            raise
+
+        if self._map is not None:
+            self._map.close()
+        self._map = shared_map
+        self._generation = generation
+        return values
+
+    def has_changed(self):
+        shared_map = self._map
+        if shared_map is None:
+            return False
+        generation, = _generation.unpack_from(shared_map, _GENERATION_OFFSET)
+        return generation != self._generation
+
+    def watched_paths(self):
+        return [self.path]
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+class SharedIndraConfig(config.IndraConfig):
+    """
+    An IndraConfig whose file values come from a ConfigPublisher's
+    shared file instead of from parsing indra.xml.  Local overrides via
+    update/set still apply on top of the shared values.
+    """
+    def __init__(self, shm_path = DEFAULT_PATH, reload_check_interval = 1):
+        config.IndraConfig.__init__(self, None, reload_check_interval,
+                                    [SharedMemorySource(shm_path)])
+
+def usage():
+    print "Usage:"
+    print sys.argv[0] + " [options]"
+    print "  Publish indra.xml to a shared file that worker processes map"
+    print "  with indra.base.config.load_shared().  Keeps running and"
+    print "  republishes whenever indra.xml changes."
+    print
+    print "Options:"
+    print "  -i, --in      indra.xml filename."
+    print "  -o, --out     Shared file.  (Default:  %s)" % DEFAULT_PATH
+    print "  -h, --help    Print this message and exit."
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    opts, args = getopt.getopt(argv, "i:o:h", ["in=", "out=", "help"])
+    indra_xml_file = None
+    shm_path = DEFAULT_PATH
+    for o, a in opts:
+        if o in ("-i", "--in"):
+            indra_xml_file = a
+        if o in ("-o", "--out"):
+            shm_path = a
+        if o in ("-h", "--help"):
+            usage()
+            return 0
+
+    config.load(indra_xml_file)
+    publisher = ConfigPublisher(config.get_config(), shm_path)
+    print "Published generation %d to %s" % (publisher.publish(), shm_path)
+    while True:
+        time.sleep(3600)
+
+if __name__ == "__main__":
+    sys.exit(main())
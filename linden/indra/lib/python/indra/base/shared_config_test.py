@@ -0,0 +1,149 @@
+"""\
+@file shared_config_test.py
+@brief Test cases for configuration shared between processes.
+
+$LicenseInfo:firstyear=2009&license=mit$
+
+Copyright (c) 2009, Linden Research, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+$/LicenseInfo$
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from indra.base import config
+from indra.base import llsd
+from indra.base.shared_config import ConfigPublisher, SharedMemorySource, \
+     SharedIndraConfig, SharedConfigError
+
+class TestSharedConfig(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.indra_xml = os.path.join(self.dir, 'indra.xml')
+        self.shm_path = os.path.join(self.dir, 'indra_config.shm')
+        f = open(self.indra_xml, 'w')
+        f.write(llsd.format_xml({'port': '8080', 'name': 'file'}))
+        f.close()
+        self.config = config.IndraConfig(self.indra_xml)
+        self.closers = [self.config]
+
+    def tearDown(self):
+        for closer in reversed(self.closers):
+            closer.close()
+        shutil.rmtree(self.dir)
+
+    def publisher(self):
+        publisher = ConfigPublisher(self.config, self.shm_path)
+        self.closers.append(publisher)
+        return publisher
+
+    def source(self):
+        source = SharedMemorySource(self.shm_path)
+        self.closers.append(source)
+        return source
+
+    def files(self):
+        files = os.listdir(self.dir)
+        files.sort()
+        return files
+
+    def test_publish_and_read(self):
+        self.assertEquals(self.publisher().publish(), 1)
+        source = self.source()
+        self.assertEquals(source.load(), {'port': '8080', 'name': 'file'})
+        self.failIf(source.has_changed())
+        self.assertEquals(self.files(), ['indra.xml', 'indra_config.shm'])
+
+    def test_republish(self):
+        publisher = self.publisher()
+        publisher.publish()
+        source = self.source()
+        source.load()
+        # set() reaches the publisher through the reload callback
+        self.config.set('name', 'override')
+        self.assert_(source.has_changed())
+        self.assertEquals(source.load()['name'], 'override')
+        self.failIf(source.has_changed())
+        self.assertEquals(publisher.publish(), 3)
+
+        # a new publisher carries on from the published generation
+        self.assertEquals(self.publisher().publish(), 4)
+        self.assert_(source.has_changed())
+
+    def test_shared_indra_config(self):
+        self.publisher().publish()
+        shared = SharedIndraConfig(self.shm_path)
+        self.closers.append(shared)
+        self.assertEquals(shared.get_int('port'), 8080)
+        shared.set('port', '9090')
+        self.config.set('name', 'override')
+        shared._check_for_changes()
+        self.assertEquals(shared['name'], 'override')
+        # local overrides stay on top of the shared values
+        self.assertEquals(shared['port'], '9090')
+
+    def test_not_shared_config(self):
+        f = open(self.shm_path, 'wb')
+        f.write('x' * 64)
+        f.close()
+        self.assertRaises(SharedConfigError, self.source().load)
+
+    def test_load_shared(self):
+        saved = config._g_config
+        try:
+            config.load_shared(self.shm_path, self.indra_xml)
+            self.failIf(isinstance(config.get_config(), SharedIndraConfig))
+            self.assertEquals(config.get('name'), 'file')
+            config.get_config().close()
+
+            self.publisher().publish()
+            self.config.set('name', 'override')
+            config.load_shared(self.shm_path, self.indra_xml)
+            self.assert_(isinstance(config.get_config(), SharedIndraConfig))
+            self.assertEquals(config.get('name'), 'override')
+            config.get_config().close()
+        finally:
+            config._g_config = saved
+
+    def test_publishers_in_threads(self):
+        errors = []
+        def publish(publisher):
+            try:
+                for i in xrange(200):
+                    publisher.publish()
+            except Exception, e:
+                errors.append(e)
+        threads = [threading.Thread(target = publish,
+                                    args = (self.publisher(),))
+                   for i in xrange(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals(errors, [])
+        self.assertEquals(self.source().load()['name'], 'file')
+        self.assertEquals(self.files(), ['indra.xml', 'indra_config.shm'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -26,6 +26,11 @@ THE SOFTWARE.
 $/LicenseInfo$
 """
 
+import marshal
+import os
+import sys
+from hashlib import sha1
+
 from compatibility import Incompatible, Older, Newer, Same
 from tokenstream import TokenStream
 
@@ -36,9 +41,76 @@ from tokenstream import TokenStream
 class Template:
     def __init__(self):
         self.messages = { }
+        self._high = None
     
     def addMessage(self, m):
         self.messages[m.name] = m
+        self._high = None
+
+    def _buildDispatch(self):
+        # On the wire High numbers are one byte, Medium ones 0xFF and a
+        # byte, and Low ones 0xFF 0xFF and a big-endian U16.  The Fixed
+        # numbers 0xFFFFFFxx share the Low space, so both go in one dict
+        # keyed on the U16, and a Low 0xFFxx would collide with them.
+        high = [ None ] * 256
+        medium = [ None ] * 256
+        low = { }
+        prefixes = { }
+        for m in self.messages.itervalues():
+            if m.priority == Message.HIGH:
+                table, key, valid = high, m.number, 0 <= m.number < 0xff
+                prefix = chr(key & 0xff)
+            elif m.priority == Message.MEDIUM:
+                table, key, valid = medium, m.number, 0 <= m.number < 0xff
+                prefix = '\xff' + chr(key & 0xff)
+            else:
+                if m.priority == Message.LOW:
+                    key, valid = m.number, 0 <= m.number <= 0xffff
+                else:
+                    key = m.number & 0xffff
+                    valid = m.number & 0xffff0000 == 0xffff0000
+                table = low
+                prefix = '\xff\xff' + chr(key >> 8 & 0xff) + chr(key & 0xff)
+            if not valid:
+                raise ValueError("%s message %s has out of range number 0x%X"
+                                 % (m.priority, m.name, m.number))
+            try:
+                other = table[key]
+            except KeyError:
+                other = None
+            if other is not None:
+                raise ValueError("messages %s and %s are both sent as 0x%s"
+                                 % (other.name, m.name, prefix.encode('hex')))
+            table[key] = m
+            prefixes[m.name] = prefix
+        self._medium = medium
+        self._low = low
+        self._prefixes = prefixes
+        self._high = high
+
+    def decode_header(self, buf, offset=0):
+        """(message, length) for the message number at offset in the
+        str buf; message is None if the number isn't in the template.
+        Raises IndexError if buf ends inside the number, and ValueError
+        if two messages in the template are sent with the same number or
+        one has a number its priority can't send; parsed templates are
+        checked for that when they are parsed, so only templates built
+        with addMessage raise it here."""
+        if self._high is None:
+            self._buildDispatch()
+        first = ord(buf[offset])
+        if first != 0xff:
+            return self._high[first], 1
+        second = ord(buf[offset + 1])
+        if second != 0xff:
+            return self._medium[second], 2
+        return self._low.get((ord(buf[offset + 2]) << 8) | ord(buf[offset + 3])), 4
+
+    def encode_header(self, name):
+        """The message number of message name as sent on the wire."""
+        if self._high is None:
+            self._buildDispatch()
+        return self._prefixes[name]
     
     def compatibleWithBase(self, base):
         messagenames = (
@@ -290,6 +362,10 @@ class TemplateParser:
                 tokens.consume()
                     # just assume (gulp) that this is a comment
                     # line 468: "sim -> dataserver"
+
+        # report clashing or out of range numbers now rather than on
+        # the first encode_header or decode_header
+        t._buildDispatch()
         return t                
 
 
@@ -370,3 +446,98 @@ def parseTemplateString(s):
 
 def parseTemplateFile(f):
     return TemplateParser(TokenStream().fromFile(f)).parseTemplate()
+
+###
+### Cached Message Templates
+###
+
+# Bump when the cached form changes, so old cache files are ignored.
+TEMPLATE_CACHE_FORMAT = 1
+
+def templateToLLSD(t):
+    """Compact LLSD form of a Template: nested arrays rather than maps."""
+    messages = [ ]
+    for m in t.messages.itervalues():
+        blocks = [ ]
+        for b in m.blocks:
+            variables = [ [v.name, v.type, v.size] for v in b.variables ]
+            blocks.append([b.name, b.repeat, b.count, variables])
+        # Fixed message numbers don't fit an LLSD integer; a real holds
+        # them exactly.
+        messages.append([m.name, float(m.number), m.priority, m.trust, m.coding,
+                         m.deprecateLevel, blocks])
+    return { 'version': getattr(t, 'version', None), 'messages': messages }
+
+def templateFromLLSD(d):
+    t = Template()
+    if d['version'] is not None:
+        t.version = d['version']
+    for name, number, priority, trust, coding, deprecateLevel, blocks in d['messages']:
+        m = Message(name, int(number), priority, trust, coding)
+        m.deprecateLevel = deprecateLevel
+        for bname, repeat, count, variables in blocks:
+            b = Block(bname, repeat, count)
+            for vname, type, size in variables:
+                b.addVariable(Variable(vname, type, size))
+            m.addBlock(b)
+        t.addMessage(m)
+    return t
+
+def defaultTemplateCacheDir():
+    """Per-user directory for cached templates, in the system tempdir."""
+    import getpass, tempfile
+    try:
+        user = getpass.getuser()
+    except Exception:
+        user = 'unknown'
+    return os.path.join(tempfile.gettempdir(), 'message_template_cache.%s' % user)
+
+def parseTemplateStringCached(s, cache_dir=None):
+    """Like parseTemplateString, but keeps the parsed template in
+    cache_dir keyed by the SHA-1 of s, so parsing the same text again
+    only loads the cached form.  Cache problems are never fatal: the
+    text is parsed as usual and the cache rewritten if possible.
+
+    The cache holds templateToLLSD() data written with marshal, which
+    loads in a couple of milliseconds where the pure-python binary LLSD
+    parser takes about 40 for the full template.  It is only used from a
+    directory owned by the current user."""
+    if cache_dir is None:
+        cache_dir = defaultTemplateCacheDir()
+    digest = sha1(s).hexdigest()
+    cache_file = os.path.join(cache_dir, digest + '.cache')
+    key = (TEMPLATE_CACHE_FORMAT, sys.version_info[:2], digest)
+
+    try:
+        if _ownedByUser(cache_dir):
+            f = open(cache_file, 'rb')
+            try:
+                cached_key, data = marshal.load(f)
+            finally:
+                f.close()
+            if cached_key == key:
+                return templateFromLLSD(data)
+    except Exception:
+        # missing, stale or damaged; parse again
+        pass
+
+    t = parseTemplateString(s)
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, 0700)
+        if _ownedByUser(cache_dir):
+            tmpname = '%s.%d' % (cache_file, os.getpid())
+            f = open(tmpname, 'wb')
+            try:
+                marshal.dump((key, templateToLLSD(t)), f)
+            finally:
+                f.close()
+            os.rename(tmpname, cache_file)
+    except (IOError, OSError):
+        pass
+    return t
+
+def _ownedByUser(path):
+    if not hasattr(os, 'getuid'):
+        return os.path.isdir(path)
+    return os.stat(path).st_uid == os.getuid()
\ No newline at end of file
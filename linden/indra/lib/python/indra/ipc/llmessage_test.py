@@ -0,0 +1,125 @@
+"""\
+@file llmessage_test.py
+@brief Tests for the message template cache.
+
+$LicenseInfo:firstyear=2009&license=mit$
+
+Copyright (c) 2009, Linden Research, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+$/LicenseInfo$
+"""
+
+import marshal
+import os
+import shutil
+import tempfile
+import unittest
+
+from indra.ipc import llmessage
+
+TEMPLATE = """
+version 2.0
+{
+    TestMessage Low 12 NotTrusted Zerocoded UDPDeprecated
+    {
+        Agent Single
+        {   AgentID     LLUUID  }
+        {   Name        Variable 1 }
+    }
+    {
+        Data Multiple 3
+        {   Hash        Fixed 8 }
+    }
+}
+{
+    PacketAck Fixed 0xFFFFFFFB NotTrusted Unencoded
+    {
+        Packets Variable
+        {   ID          U32     }
+    }
+}
+"""
+
+class TestTemplateCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.dir, 'cache')
+        self.parses = 0
+        self._parseTemplateString = llmessage.parseTemplateString
+        def counting_parse(s):
+            self.parses += 1
+            return self._parseTemplateString(s)
+        llmessage.parseTemplateString = counting_parse
+
+    def tearDown(self):
+        llmessage.parseTemplateString = self._parseTemplateString
+        shutil.rmtree(self.dir)
+
+    def cache_file(self):
+        files = os.listdir(self.cache_dir)
+        self.assertEquals(len(files), 1)
+        return os.path.join(self.cache_dir, files[0])
+
+    def assertSameTemplate(self, template):
+        expected = self._parseTemplateString(TEMPLATE)
+        self.assert_(template.compatibleWithBase(expected).same())
+        self.assert_(expected.compatibleWithBase(template).same())
+        self.assertEquals(template.version, 2.0)
+        self.assertEquals(template.messages['PacketAck'].number, 0xFFFFFFFB)
+
+    def test_round_trip(self):
+        first = llmessage.parseTemplateStringCached(TEMPLATE, self.cache_dir)
+        self.assertEquals(self.parses, 1)
+        self.assertEquals(os.stat(self.cache_dir).st_mode & 0777, 0700)
+        second = llmessage.parseTemplateStringCached(TEMPLATE, self.cache_dir)
+        self.assertEquals(self.parses, 1)
+        self.assertSameTemplate(first)
+        self.assertSameTemplate(second)
+        # a different template gets its own entry
+        llmessage.parseTemplateStringCached(TEMPLATE + "\n", self.cache_dir)
+        self.assertEquals(self.parses, 2)
+        self.assertEquals(len(os.listdir(self.cache_dir)), 2)
+
+    def test_corrupt_cache_file(self):
+        llmessage.parseTemplateStringCached(TEMPLATE, self.cache_dir)
+        cache_file = self.cache_file()
+        open(cache_file, 'wb').write('not a marshalled template')
+        template = llmessage.parseTemplateStringCached(TEMPLATE, self.cache_dir)
+        self.assertEquals(self.parses, 2)
+        self.assertSameTemplate(template)
+        # and the cache was rewritten
+        llmessage.parseTemplateStringCached(TEMPLATE, self.cache_dir)
+        self.assertEquals(self.parses, 2)
+
+    def test_stale_key(self):
+        llmessage.parseTemplateStringCached(TEMPLATE, self.cache_dir)
+        cache_file = self.cache_file()
+        key, data = marshal.load(open(cache_file, 'rb'))
+        # as written by an older cache format, with data that isn't right
+        data['messages'] = data['messages'][:1]
+        stale_key = (key[0] - 1,) + key[1:]
+        marshal.dump((stale_key, data), open(cache_file, 'wb'))
+        template = llmessage.parseTemplateStringCached(TEMPLATE, self.cache_dir)
+        self.assertEquals(self.parses, 2)
+        self.assertSameTemplate(template)
+        self.assertEquals(marshal.load(open(cache_file, 'rb'))[0], key)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,393 @@
+"""\
+@file messagecodec.py
+@brief Template-driven binary encoding and decoding of UDP messages
+
+$LicenseInfo:firstyear=2009&license=mit$
+
+Copyright (c) 2009, Linden Research, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+$/LicenseInfo$
+
+A message on the wire is its message number followed by its blocks in
+template order.  Single blocks appear once, Multiple blocks exactly
+count times and Variable blocks are preceded by a U8 repeat count.
+Numbers are little-endian except IPPORT, which is in network order;
+quaternions are sent as x, y, z of the normalized value, with w >= 0.
+Packet headers and appended acks are not handled here, and zerocoded
+bodies go through indra.ipc.zerocode first.
+
+Decoded messages are dicts of block name to a dict of variable values
+for Single blocks, or to a list of such dicts for Multiple and Variable
+blocks.  Encoding takes the same, or objects with the same attributes.
+"""
+
+import math
+import socket
+import struct
+
+from indra.base import lluuid
+from llmessage import Message, Block, Variable
+
+class CodecError(Exception):
+    pass
+
+###
+### Variable types
+###
+
+def _swap16(value):
+    return ((value & 0xff) << 8) | ((value >> 8) & 0xff)
+
+def _uuidFromBits(bits):
+    u = lluuid.UUID.__new__(lluuid.UUID)
+    u._bits = bits
+    return u
+
+def _uuidToBits(value):
+    if isinstance(value, lluuid.UUID):
+        return value._bits
+    if isinstance(value, str) and len(value) == 16:
+        return value
+    if not lluuid.isUUID(str(value)):
+        raise CodecError("not a UUID: %r" % (value,))
+    return lluuid.UUID(str(value))._bits
+
+def _ipFromBits(bits):
+    return socket.inet_ntoa(bits)
+
+def _ipToBits(value):
+    if len(value) == 4:
+        return value
+    try:
+        return socket.inet_aton(value)
+    except socket.error:
+        raise CodecError("not an IP address: %r" % (value,))
+
+def _quaternionFromPacked(xyz):
+    x, y, z = xyz
+    w = 1.0 - (x * x + y * y + z * z)
+    if w > 0.0:
+        w = math.sqrt(w)
+    else:
+        w = 0.0
+    return (x, y, z, w)
+
+def _quaternionToPacked(value):
+    if len(value) == 3:
+        return value
+    x, y, z, w = value
+    mag = math.sqrt(x * x + y * y + z * z + w * w)
+    if mag > 0.0:
+        if w < 0.0:
+            mag = -mag
+        return (x / mag, y / mag, z / mag)
+    return (0.0, 0.0, 0.0)
+
+def _fixedToBits(size):
+    def toBits(value):
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        if len(value) > size:
+            raise CodecError("%d bytes don't fit Fixed %d" % (len(value), size))
+        return value
+    return toBits
+
+# type -> (struct format, values, decode, encode)
+_typeFormats = {
+    Variable.U8:            ('B', 1, None, None),
+    Variable.U16:           ('H', 1, None, None),
+    Variable.U32:           ('I', 1, None, None),
+    Variable.U64:           ('Q', 1, None, None),
+    Variable.S8:            ('b', 1, None, None),
+    Variable.S16:           ('h', 1, None, None),
+    Variable.S32:           ('i', 1, None, None),
+    Variable.S64:           ('q', 1, None, None),
+    Variable.F32:           ('f', 1, None, None),
+    Variable.F64:           ('d', 1, None, None),
+    Variable.LLVECTOR3:     ('3f', 3, None, None),
+    Variable.LLVECTOR3D:    ('3d', 3, None, None),
+    Variable.LLVECTOR4:     ('4f', 4, None, None),
+    Variable.LLQUATERNION:  ('3f', 3, _quaternionFromPacked, _quaternionToPacked),
+    Variable.LLUUID:        ('16s', 1, _uuidFromBits, _uuidToBits),
+    Variable.BOOL:          ('B', 1, bool, bool),
+    Variable.IPADDR:        ('4s', 1, _ipFromBits, _ipToBits),
+    Variable.IPPORT:        ('H', 1, _swap16, _swap16),
+    }
+
+def _typeFormat(variable):
+    if variable.type == Variable.FIXED:
+        size = int(variable.size)
+        return ('%ds' % size, 1, None, _fixedToBits(size))
+    return _typeFormats[variable.type]
+
+_missing = object()
+
+def _get(container, name):
+    if isinstance(container, dict):
+        value = container.get(name, _missing)
+    else:
+        value = getattr(container, name, _missing)
+    if value is _missing:
+        raise CodecError("missing %s" % name)
+    return value
+
+###
+### Compiled layouts
+###
+
+class _FixedRun(object):
+    """A run of fixed size variables, packed with a single struct."""
+    def __init__(self, variables):
+        format = '<'
+        self.fields = [ ]
+        index = 0
+        for v in variables:
+            code, width, decode, encode = _typeFormat(v)
+            format += code
+            self.fields.append((v.name, index, width, decode, encode))
+            index += width
+        self.struct = struct.Struct(format)
+        self.size = self.struct.size
+        self.names = tuple([ v.name for v in variables ])
+        # nothing to regroup or convert; zip the values straight in
+        self.plain = index == len(variables) and not [
+            f for f in self.fields if f[3] is not None ]
+
+    def decode(self, buf, offset, values):
+        unpacked = self.struct.unpack_from(buf, offset)
+        if self.plain:
+            values.update(zip(self.names, unpacked))
+        else:
+            for name, index, width, decode, encode in self.fields:
+                if width == 1:
+                    value = unpacked[index]
+                else:
+                    value = unpacked[index:index + width]
+                if decode is not None:
+                    value = decode(value)
+                values[name] = value
+        return offset + self.size
+
+    def encode(self, block, out):
+        args = [ ]
+        for name, index, width, decode, encode in self.fields:
+            value = _get(block, name)
+            if encode is not None:
+                value = encode(value)
+            if width == 1:
+                args.append(value)
+            else:
+                if len(value) != width:
+                    raise CodecError("%s needs %d components" % (name, width))
+                args.extend(value)
+        try:
+            out.append(self.struct.pack(*args))
+        except struct.error, e:
+            raise CodecError("%s: %s" % (', '.join(self.names), e))
+
+class _VariableField(object):
+    """A Variable 1 or 2 field: a U8 or U16 length, then the bytes."""
+    def __init__(self, variable):
+        self.name = variable.name
+        if int(variable.size) == 1:
+            self.length = struct.Struct('<B')
+        else:
+            self.length = struct.Struct('<H')
+        self.maxLength = (1 << (8 * self.length.size)) - 1
+
+    def decode(self, buf, offset, values):
+        (length,) = self.length.unpack_from(buf, offset)
+        offset += self.length.size
+        end = offset + length
+        if end > len(buf):
+            raise CodecError("%s runs past the end of the message" % self.name)
+        values[self.name] = buf[offset:end]
+        return end
+
+    def encode(self, block, out):
+        value = _get(block, self.name)
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        if len(value) > self.maxLength:
+            raise CodecError("%s is %d bytes, at most %d fit"
+                             % (self.name, len(value), self.maxLength))
+        out.append(self.length.pack(len(value)))
+        out.append(value)
+
+class _BlockCodec(object):
+    def __init__(self, block):
+        self.name = block.name
+        self.repeat = block.repeat
+        self.count = block.count
+        self.steps = [ ]
+        run = [ ]
+        for v in block.variables:
+            if v.type == Variable.VARIABLE:
+                if run:
+                    self.steps.append(_FixedRun(run))
+                    run = [ ]
+                self.steps.append(_VariableField(v))
+            else:
+                run.append(v)
+        if run:
+            self.steps.append(_FixedRun(run))
+
+    def decode(self, buf, offset):
+        values = { }
+        for step in self.steps:
+            offset = step.decode(buf, offset, values)
+        return values, offset
+
+    def encode(self, block, out):
+        for step in self.steps:
+            step.encode(block, out)
+
+class _MessageCodec(object):
+    def __init__(self, message, prefix):
+        self.name = message.name
+        self.prefix = prefix
+        self.blocks = [ _BlockCodec(b) for b in message.blocks ]
+
+    def decode(self, buf, offset):
+        data = { }
+        for block in self.blocks:
+            if block.repeat == Block.SINGLE:
+                data[block.name], offset = block.decode(buf, offset)
+                continue
+            if block.repeat == Block.MULTIPLE:
+                count = block.count
+            else:
+                count = ord(buf[offset])
+                offset += 1
+            instances = [ ]
+            for i in xrange(count):
+                values, offset = block.decode(buf, offset)
+                instances.append(values)
+            data[block.name] = instances
+        return data, offset
+
+    def encode(self, data, out):
+        out.append(self.prefix)
+        for block in self.blocks:
+            if block.repeat == Block.SINGLE:
+                instance = _get(data, block.name)
+                if isinstance(instance, (list, tuple)):
+                    if len(instance) != 1:
+                        raise CodecError("Single block %s given %d times"
+                                         % (block.name, len(instance)))
+                    instance = instance[0]
+                block.encode(instance, out)
+                continue
+            if block.repeat == Block.MULTIPLE:
+                instances = _get(data, block.name)
+                if len(instances) != block.count:
+                    raise CodecError("Multiple block %s needs %d, given %d"
+                                     % (block.name, block.count, len(instances)))
+            else:
+                try:
+                    instances = _get(data, block.name)
+                except CodecError:
+                    instances = [ ]
+                if instances is None:
+                    instances = [ ]
+                if len(instances) > 255:
+                    raise CodecError("Variable block %s given %d times, at most 255"
+                                     % (block.name, len(instances)))
+                out.append(chr(len(instances)))
+            for instance in instances:
+                block.encode(instance, out)
+
+###
+### Codec
+###
+
+class MessageCodec(object):
+    """Encodes and decodes the messages of a Template.  Each message is
+    compiled to struct layouts the first time it is used; compileAll()
+    does them all up front."""
+    def __init__(self, template):
+        self.template = template
+        self._codecs = { }
+
+    def compile(self, name):
+        codec = self._codecs.get(name)
+        if codec is None:
+            try:
+                message = self.template.messages[name]
+            except KeyError:
+                raise CodecError("unknown message %s" % name)
+            codec = self._codecs[name] = _MessageCodec(
+                message, self.template.encode_header(name))
+        return codec
+
+    def compileAll(self):
+        for name in self.template.messages:
+            self.compile(name)
+
+    def encode(self, name, data):
+        """Wire bytes of message name, starting with its number."""
+        out = [ ]
+        try:
+            self.compile(name).encode(data, out)
+        except CodecError, e:
+            raise CodecError("in message %s: %s" % (name, e))
+        return ''.join(out)
+
+    def decode(self, buf, offset=0):
+        """(name, data) of the message at offset in buf.  Anything past
+        the end of the message, such as appended acks, is ignored."""
+        name, data, end = self.decodeFrom(buf, offset)
+        return name, data
+
+    def decodeFrom(self, buf, offset=0):
+        """Like decode, but also returns the offset just past the
+        message."""
+        try:
+            message, length = self.template.decode_header(buf, offset)
+        except IndexError:
+            raise CodecError("truncated message number")
+        if message is None:
+            raise CodecError("unknown message number %s"
+                             % buf[offset:offset + length].encode('hex'))
+        name = message.name
+        codec = self._codecs.get(name) or self.compile(name)
+        try:
+            data, end = codec.decode(buf, offset + length)
+        except (struct.error, IndexError):
+            raise CodecError("in message %s: truncated" % name)
+        return name, data, end
+
+    def decodeMany(self, buffers, errors=False):
+        """[(name, data)] for a batch of message buffers.  With errors
+        true, undecodable buffers give (None, CodecError) instead of
+        raising."""
+        decodeFrom = self.decodeFrom
+        results = [ ]
+        append = results.append
+        for buf in buffers:
+            try:
+                name, data, end = decodeFrom(buf)
+            except CodecError, e:
+                if not errors:
+                    raise
+                append((None, e))
+                continue
+            append((name, data))
+        return results
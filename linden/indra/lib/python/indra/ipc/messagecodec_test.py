@@ -0,0 +1,339 @@
+"""\
+@file messagecodec_test.py
+@brief Test cases and benchmark for the template-driven message codec.
+
+$LicenseInfo:firstyear=2009&license=mit$
+
+Copyright (c) 2009, Linden Research, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+$/LicenseInfo$
+"""
+
+import os
+import random
+import struct
+import time
+import unittest
+
+from indra.base import lluuid
+from indra.ipc import llmessage
+from indra.ipc.messagecodec import CodecError, MessageCodec
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, os.pardir, os.pardir, os.pardir,
+                             os.pardir, 'scripts', 'messages',
+                             'message_template.msg')
+
+# set INDRA_BENCHMARK in the environment to print timings
+BENCHMARK = bool(os.environ.get('INDRA_BENCHMARK'))
+
+TEMPLATE = """
+version 2.0
+{
+    TestHigh High 3 NotTrusted Unencoded
+    {
+        Agent Single
+        {   AgentID     LLUUID  }
+        {   Flags       U32     }
+        {   Position    LLVector3 }
+        {   Rotation    LLQuaternion }
+        {   Name        Variable 1 }
+        {   Allowed     BOOL    }
+    }
+    {
+        Pair Multiple 2
+        {   Value       S16     }
+        {   Hash        Fixed 4 }
+    }
+    {
+        Sim Variable
+        {   IP          IPADDR  }
+        {   Port        IPPORT  }
+        {   Handle      U64     }
+        {   Data        Variable 2 }
+        {   Global      LLVector3d }
+    }
+}
+{
+    TestMedium Medium 7 NotTrusted Unencoded
+    {
+        Ping Single
+        {   PingID      U8      }
+    }
+}
+{
+    TestLow Low 300 NotTrusted Unencoded
+}
+{
+    TestFixed Fixed 0xFFFFFFFB NotTrusted Unencoded
+    {
+        Packets Variable
+        {   ID          U32     }
+    }
+}
+"""
+
+AGENT_ID = '3c115e51-04f4-523c-9fa6-98aff1034730'
+
+class _Block(object):
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+class TestMessageCodec(unittest.TestCase):
+    def setUp(self):
+        self.codec = MessageCodec(llmessage.parseTemplateString(TEMPLATE))
+
+    def message(self):
+        return {
+            'Agent': {'AgentID': lluuid.UUID(AGENT_ID), 'Flags': 0xdeadbeef,
+                      'Position': (128.0, 64.5, 22.25),
+                      'Rotation': (0.0, 0.0, 0.6, 0.8),
+                      'Name': 'Governor Linden\0', 'Allowed': True},
+            'Pair': [{'Value': -2, 'Hash': 'abcd'}, {'Value': 7, 'Hash': 'wxyz'}],
+            'Sim': [{'IP': '10.1.2.3', 'Port': 13000, 'Handle': 1 << 40,
+                     'Data': 'x' * 300, 'Global': (256000.5, 1024.0, 30.0)}],
+            }
+
+    def test_layout(self):
+        wire = self.codec.encode('TestHigh', self.message())
+        self.assertEquals(wire[0], '\x03')
+        self.assertEquals(wire[1:17], lluuid.UUID(AGENT_ID)._bits)
+        self.assertEquals(struct.unpack('<I', wire[17:21])[0], 0xdeadbeef)
+        # port in network order
+        self.assert_(struct.pack('>H', 13000) in wire)
+        self.assert_(struct.pack('<H', 300) + 'x' * 300 in wire)
+
+    def test_round_trip(self):
+        message = self.message()
+        name, data = self.codec.decode(self.codec.encode('TestHigh', message))
+        self.assertEquals(name, 'TestHigh')
+        agent = data['Agent']
+        self.assertEquals(str(agent['AgentID']), AGENT_ID)
+        self.assertEquals(agent['Flags'], 0xdeadbeef)
+        self.assertEquals(agent['Position'], (128.0, 64.5, 22.25))
+        for got, want in zip(agent['Rotation'], (0.0, 0.0, 0.6, 0.8)):
+            self.assertAlmostEquals(got, want, 6)
+        self.assertEquals(agent['Name'], 'Governor Linden\0')
+        self.assertEquals(agent['Allowed'], True)
+        self.assertEquals(data['Pair'], message['Pair'])
+        self.assertEquals(data['Sim'], message['Sim'])
+
+    def test_objects_and_prefixes(self):
+        self.assertEquals(self.codec.encode('TestMedium', _Block(Ping=_Block(PingID=9))),
+                          '\xff\x07\x09')
+        self.assertEquals(self.codec.encode('TestLow', {}), '\xff\xff\x01\x2c')
+        wire = self.codec.encode('TestFixed', {'Packets': [{'ID': 1}, {'ID': 2}]})
+        self.assertEquals(wire[:5], '\xff\xff\xff\xfb\x02')
+        self.assertEquals(self.codec.decode(wire + 'acks')[1],
+                          {'Packets': [{'ID': 1}, {'ID': 2}]})
+        # missing Variable blocks are empty
+        self.assertEquals(self.codec.encode('TestFixed', {}), '\xff\xff\xff\xfb\x00')
+
+    def test_errors(self):
+        message = self.message()
+        del message['Agent']['Flags']
+        self.assertRaises(CodecError, self.codec.encode, 'TestHigh', message)
+        message = self.message()
+        message['Pair'].pop()
+        self.assertRaises(CodecError, self.codec.encode, 'TestHigh', message)
+        message = self.message()
+        message['Sim'][0]['Data'] = 'x' * 70000
+        self.assertRaises(CodecError, self.codec.encode, 'TestHigh', message)
+        self.assertRaises(CodecError, self.codec.encode, 'NoSuchMessage', {})
+
+        wire = self.codec.encode('TestHigh', self.message())
+        self.assertRaises(CodecError, self.codec.decode, wire[:-5])
+        self.assertRaises(CodecError, self.codec.decode, '\x09')
+        results = self.codec.decodeMany([wire, wire[:10]], errors=True)
+        self.assertEquals(results[0][0], 'TestHigh')
+        self.assertEquals(results[1][0], None)
+        self.assertRaises(CodecError, self.codec.decodeMany, [wire[:10]])
+
+    def test_headers(self):
+        template = self.codec.template
+        for name, prefix in [('TestHigh', '\x03'), ('TestMedium', '\xff\x07'),
+                             ('TestLow', '\xff\xff\x01\x2c'),
+                             ('TestFixed', '\xff\xff\xff\xfb')]:
+            self.assertEquals(template.encode_header(name), prefix)
+            message, length = template.decode_header('..' + prefix + 'body', 2)
+            self.assertEquals((message.name, length), (name, len(prefix)))
+        self.assertEquals(template.decode_header('\x04'), (None, 1))
+        self.assertEquals(template.decode_header('\xff\xff\x01\x2d'), (None, 4))
+        self.assertRaises(IndexError, template.decode_header, '\xff\xff\x01')
+        self.assertRaises(KeyError, template.encode_header, 'NoSuchMessage')
+        # tables follow messages added later
+        template.addMessage(llmessage.Message('TestLater', 4, 'High',
+                                              'NotTrusted', 'Unencoded'))
+        self.assertEquals(template.decode_header('\x04')[0].name, 'TestLater')
+
+    def test_bad_numbers(self):
+        def template(*messages):
+            t = llmessage.Template()
+            for name, number, priority in messages:
+                t.addMessage(llmessage.Message(name, number, priority,
+                                               'NotTrusted', 'Unencoded'))
+            return t
+        for t, names in [
+            (template(('A', 0xfffb, 'Low'), ('B', 0xfffffffb, 'Fixed')), ('A', 'B')),
+            (template(('A', 5, 'High'), ('B', 5, 'High')), ('A', 'B')),
+            (template(('A', 0xff, 'High')), ('A',)),
+            (template(('A', 300, 'Medium')), ('A',)),
+            (template(('A', 0x10000, 'Low')), ('A',)),
+            (template(('A', 0xfffb, 'Fixed')), ('A',))]:
+            try:
+                t.encode_header('A')
+            except ValueError, e:
+                for name in names:
+                    self.assert_(name in str(e), str(e))
+            else:
+                self.fail("no error for %s" % (names,))
+        # parsed templates are checked up front
+        try:
+            llmessage.parseTemplateString("""
+version 2.0
+{ A High 5 NotTrusted Unencoded NotDeprecated }
+{ B High 5 NotTrusted Unencoded NotDeprecated }
+""")
+        except ValueError, e:
+            self.assert_('A' in str(e) and 'B' in str(e), str(e))
+        else:
+            self.fail("no error parsing clashing numbers")
+        # the same number at different priorities is fine
+        t = template(('A', 5, 'High'), ('B', 5, 'Medium'), ('C', 5, 'Low'))
+        self.assertEquals(t.decode_header('\xff\xff\x00\x05')[0].name, 'C')
+
+def _scanHeader(template, buf):
+    """ Finding the message by scanning the template, to compare against """
+    if buf[0] != '\xff':
+        priority, number = 'High', ord(buf[0])
+    elif buf[1] != '\xff':
+        priority, number = 'Medium', ord(buf[1])
+    else:
+        priority, number = None, struct.unpack('>H', buf[2:4])[0]
+    for message in template.messages.itervalues():
+        if priority is None:
+            if message.priority in ('Low', 'Fixed') and \
+                   message.number & 0xffff == number:
+                return message
+        elif message.priority == priority and message.number == number:
+            return message
+    return None
+
+def _sampleValue(variable, rand):
+    t = variable.type
+    V = llmessage.Variable
+    if t in (V.U8, V.BOOL):
+        return rand.randint(0, 1)
+    if t in (V.U16, V.IPPORT):
+        return rand.randint(0, 0xffff)
+    if t in (V.U32, V.S32, V.U64, V.S64, V.S16, V.S8):
+        return rand.randint(0, 127)
+    if t in (V.F32, V.F64):
+        return rand.randint(-4096, 4096) / 8.0
+    if t in (V.LLVECTOR3, V.LLVECTOR3D, V.LLQUATERNION):
+        # short enough to be the x, y, z of a unit quaternion
+        return (rand.random() / 2, 0.25, 0.5)
+    if t == V.LLVECTOR4:
+        return (rand.random(), 0.25, 0.5, 1.0)
+    if t == V.LLUUID:
+        return lluuid.UUID().generate()
+    if t == V.IPADDR:
+        return '10.0.0.%d' % rand.randint(1, 254)
+    if t == V.FIXED:
+        return 'x' * int(variable.size)
+    return 'value %d\0' % rand.randint(0, 1000)
+
+def sampleMessage(message, rand):
+    data = { }
+    for block in message.blocks:
+        if block.repeat == llmessage.Block.SINGLE:
+            count = 1
+        elif block.repeat == llmessage.Block.MULTIPLE:
+            count = block.count
+        else:
+            count = rand.randint(0, 3)
+        instances = [ ]
+        for i in xrange(count):
+            instances.append(dict([ (v.name, _sampleValue(v, rand))
+                                    for v in block.variables ]))
+        if block.repeat == llmessage.Block.SINGLE:
+            data[block.name] = instances[0]
+        else:
+            data[block.name] = instances
+    return data
+
+class TestRealTemplate(unittest.TestCase):
+    def test_every_message(self):
+        if not os.path.exists(TEMPLATE_PATH):
+            return
+        template = llmessage.parseTemplateString(open(TEMPLATE_PATH).read())
+        codec = MessageCodec(template)
+        rand = random.Random(48)
+
+        start = time.time()
+        codec.compileAll()
+        compile_time = time.time() - start
+
+        names = template.messages.keys()
+        names.sort()
+        samples = [ (name, sampleMessage(template.messages[name], rand))
+                    for name in names ]
+        for name, data in samples:
+            wire = codec.encode(name, data)
+            decoded_name, decoded = codec.decode(wire)
+            self.assertEquals(decoded_name, name)
+            self.assertEquals(codec.encode(name, decoded), wire)
+
+        headers = [ template.encode_header(name) for name in names ]
+        for name, header in zip(names, headers):
+            self.assertEquals(template.decode_header(header)[0].name, name)
+            self.assert_(_scanHeader(template, header) is template.messages[name])
+        if not BENCHMARK:
+            return
+
+        start = time.time()
+        for header in headers:
+            _scanHeader(template, header)
+        scan_time = time.time() - start
+        start = time.time()
+        for i in xrange(100):
+            for header in headers:
+                template.decode_header(header)
+        table_time = (time.time() - start) / 100
+
+        rounds = 20
+        start = time.time()
+        for i in xrange(rounds):
+            wires = [ codec.encode(name, data) for name, data in samples ]
+        encode_time = time.time() - start
+        start = time.time()
+        for i in xrange(rounds):
+            codec.decodeMany(wires)
+        decode_time = time.time() - start
+        count = rounds * len(samples)
+        print "\nmessage_template.msg: %d messages compiled in %.3fs, " \
+              "encode %d msgs/s, decode %d msgs/s" % (
+            len(samples), compile_time, count / max(encode_time, 1e-6),
+            count / max(decode_time, 1e-6))
+        print "headers: table %.2fus, template scan %.1fus per packet" % (
+            1e6 * table_time / len(headers), 1e6 * scan_time / len(headers))
+
+if __name__ == '__main__':
+    unittest.main()
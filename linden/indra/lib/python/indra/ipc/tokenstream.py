@@ -45,9 +45,16 @@ _floatRE = re.compile(r'\d+(\.\d*)?')
 class ParseError(Exception):
     def __init__(self, stream, reason):
         self.line = stream.line
-        self.context = stream._context()
+        self._stream = stream
+        self._position = stream._position()
         self.reason = reason
 
+    def context(self):
+        # Most ParseErrors are only tested for truth and dropped, so the
+        # context is not gathered until it is asked for.
+        return self._stream._context(self._position)
+    context = property(context)
+
     def _contextString(self):    
         c = [ ]
         for t in self.context:
@@ -72,9 +79,18 @@ def _optionText(options):
 
 
 class TokenStream(object):
+    """
+    Tokens are kept in one array, with the line number of each token in
+    a parallel array, and read through a cursor, so consuming a token
+    doesn't move the rest of them.
+    """
     def __init__(self):
-        self.line = 0
         self.tokens = [ ]
+        self._lines = [ ]
+        self._index = 0
+        self._count = 0
+        self._lastLine = 0
+        self._matches = { }     # (regex, token) -> full match?
     
     def fromString(self, string):
         return self.fromLines(string.split('\n'))
@@ -83,29 +99,36 @@ class TokenStream(object):
         return self.fromLines(file)
 
     def fromLines(self, lines):
+        tokens = self.tokens
+        lineNumbers = self._lines
         i = 0
         for line in lines:
             i += 1
-            self.tokens.append(_LineMarker(i))
-            self.tokens.extend(_commentRE.sub(" ", line).split())
-        self._consumeLines()
+            lineTokens = _commentRE.sub(" ", line).split()
+            tokens.extend(lineTokens)
+            lineNumbers.extend([i] * len(lineTokens))
+        self._lastLine = i
+        self._count = len(tokens)
         return self
+
+    def line(self):
+        # the line of the next token, or the last line at the end
+        if self._index < self._count:
+            return self._lines[self._index]
+        return self._lastLine
+    line = property(line)
     
     def consume(self):
-        if not self.tokens:
+        i = self._index
+        if i >= self._count:
             return EOF
-        t = self.tokens.pop(0)
-        self._consumeLines()
-        return t
-    
-    def _consumeLines(self):
-        while self.tokens and isinstance(self.tokens[0], _LineMarker):
-            self.line = self.tokens.pop(0)
+        self._index = i + 1
+        return self.tokens[i]
     
     def peek(self):
-        if not self.tokens:
+        if self._index >= self._count:
             return EOF
-        return self.tokens[0]
+        return self.tokens[self._index]
             
     def want(self, t):
         if t == self.peek():
@@ -124,8 +147,12 @@ class TokenStream(object):
     def wantRE(self, re, message=None):
         t = self.peek()
         if t != EOF:
-            m = re.match(t)
-            if m and m.end() == len(t):
+            key = (re, t)
+            matched = self._matches.get(key)
+            if matched is None:
+                m = re.match(t)
+                matched = self._matches[key] = bool(m and m.end() == len(t))
+            if matched:
                 return self.consume()
         if not message:
             message = "expected match for r'%s'" % re.pattern
@@ -139,10 +166,27 @@ class TokenStream(object):
     
     def wantFloat(self):
         return self.wantRE(_floatRE, "expected float")
+
+    def _position(self):
+        return self._index
     
-    def _context(self):
-        n = min(5, len(self.tokens))
-        return self.tokens[0:n]
+    def _context(self, position=None):
+        # the next five entries, with a line marker where a new line starts
+        if position is None:
+            position = self._index
+        context = [ ]
+        line = None
+        if position < self._count:
+            line = self._lines[position]
+        i = position
+        while len(context) < 5 and i < self._count:
+            if self._lines[i] != line:
+                line = self._lines[i]
+                context.append(_LineMarker(line))
+                continue
+            context.append(self.tokens[i])
+            i += 1
+        return context
 
     def require(self, t):
         if t:
@@ -151,4 +195,3 @@ class TokenStream(object):
             raise t
         else:
             raise ParseError(self, "unmet requirement")
-
@@ -0,0 +1,158 @@
+"""\
+@file tokenstream_test.py
+@brief Test cases and benchmark for the message template token stream.
+
+$LicenseInfo:firstyear=2009&license=mit$
+
+Copyright (c) 2009, Linden Research, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+$/LicenseInfo$
+"""
+
+import os
+import time
+import unittest
+
+from indra.ipc import llmessage, tokenstream
+from indra.ipc.tokenstream import EOF, ParseError, TokenStream, _LineMarker
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, os.pardir, os.pardir, os.pardir,
+                             os.pardir, 'scripts', 'messages',
+                             'message_template.msg')
+
+# set INDRA_BENCHMARK in the environment to print timings
+BENCHMARK = bool(os.environ.get('INDRA_BENCHMARK'))
+
+class _ListTokenStream(object):
+    """ The old list-popping token stream, to compare against """
+    for name in ('fromString', 'fromFile', 'want', 'wantOneOf', 'wantEOF',
+                 'wantSymbol', 'wantInteger', 'wantFloat', 'require'):
+        locals()[name] = TokenStream.__dict__[name]
+    del name
+
+    def __init__(self):
+        self.line = 0
+        self.tokens = [ ]
+
+    def fromLines(self, lines):
+        i = 0
+        for line in lines:
+            i += 1
+            self.tokens.append(_LineMarker(i))
+            self.tokens.extend(tokenstream._commentRE.sub(" ", line).split())
+        self._consumeLines()
+        return self
+
+    def consume(self):
+        if not self.tokens:
+            return EOF
+        t = self.tokens.pop(0)
+        self._consumeLines()
+        return t
+
+    def _consumeLines(self):
+        while self.tokens and isinstance(self.tokens[0], _LineMarker):
+            self.line = self.tokens.pop(0)
+
+    def peek(self):
+        if not self.tokens:
+            return EOF
+        return self.tokens[0]
+
+    def wantRE(self, re, message=None):
+        t = self.peek()
+        if t != EOF:
+            m = re.match(t)
+            if m and m.end() == len(t):
+                return self.consume()
+        if not message:
+            message = "expected match for r'%s'" % re.pattern
+        return ParseError(self, message)
+
+    def _position(self):
+        return self.tokens[0:5]
+
+    def _context(self, position):
+        return position
+
+class TestTokenStream(unittest.TestCase):
+    text = "version 2.0\n// comment { }\n\n{ Foo High 3 // trailing\n  NotTrusted }\n"
+
+    def test_tokens_and_lines(self):
+        stream = TokenStream().fromString(self.text)
+        self.assertEquals(stream.line, 1)
+        self.assert_(stream.want("version"))
+        self.assertEquals(stream.wantFloat(), "2.0")
+        self.assertEquals(stream.line, 4)
+        self.assertEquals(stream.peek(), "{")
+        self.assertEquals(stream.consume(), "{")
+        self.assertEquals(stream.wantSymbol(), "Foo")
+        self.assertEquals(stream.wantOneOf(["Low", "High"]), "High")
+        self.assertEquals(stream.wantInteger(), "3")
+        self.assertEquals(stream.line, 5)
+        self.assertEquals(stream.consume(), "NotTrusted")
+        self.assertEquals(stream.consume(), "}")
+        self.assertEquals(stream.peek(), EOF)
+        self.assert_(stream.wantEOF() is EOF)
+        self.assertEquals(stream.line, 6)
+
+    def test_failed_want(self):
+        stream = TokenStream().fromString(self.text)
+        error = stream.want("{")
+        self.failIf(error)
+        self.assert_(isinstance(error, ParseError))
+        self.assertEquals(stream.peek(), "version")
+        self.assertRaises(ParseError, stream.require, stream.wantInteger())
+        self.assertRaises(ParseError, stream.require, stream.wantInteger())
+
+    def test_error_matches_list_stream(self):
+        for consumed in range(8):
+            new = TokenStream().fromString(self.text)
+            old = _ListTokenStream().fromString(self.text)
+            for i in range(consumed):
+                self.assertEquals(new.consume(), old.consume())
+            self.assertEquals(str(ParseError(new, "oops")),
+                              str(ParseError(old, "oops")))
+
+class TestTemplateBenchmark(unittest.TestCase):
+    def test_real_template(self):
+        if not os.path.exists(TEMPLATE_PATH):
+            return
+        text = open(TEMPLATE_PATH).read()
+
+        def parse(stream_class):
+            start = time.time()
+            template = llmessage.TemplateParser(
+                stream_class().fromString(text)).parseTemplate()
+            return template, time.time() - start
+
+        new, new_time = parse(TokenStream)
+        old, old_time = parse(_ListTokenStream)
+        self.assertEquals(sorted(new.messages.keys()), sorted(old.messages.keys()))
+        self.assert_(new.compatibleWithBase(old).same())
+        if not BENCHMARK:
+            return
+        print "\nmessage_template.msg: %d messages, list stream %.3fs, " \
+              "cursor stream %.3fs (%.1fx)" % (
+            len(new.messages), old_time, new_time, old_time / max(new_time, 1e-6))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+"""\
+@file zerocode.py
+@brief Zero-run compression of Zerocoded message bodies
+
+$LicenseInfo:firstyear=2009&license=mit$
+
+Copyright (c) 2009, Linden Research, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+$/LicenseInfo$
+
+In a zerocoded body every run of zero bytes is sent as a 0x00 followed
+by the length of the run, so runs longer than 255 take several pairs.
+Only the message body is zerocoded, never the packet header, so pass
+the part after the header.
+
+The runs are found with re.split and str.find, so the python work is per run
+rather than per byte.  Input may be a str, bytearray or memoryview; the
+_into variants copy the result into a caller's bytearray or memoryview,
+such as a packet buffer, but still build it as a string first.
+"""
+
+import re
+
+_splitRuns = re.compile('(\x00+)').split
+
+# run length -> encoded run, and count byte -> decoded run
+_encodedRuns = [ '' ] + [ '\x00' + chr(n) for n in xrange(1, 256) ]
+_decodedRuns = dict([ (chr(n), '\x00' * n) for n in xrange(256) ])
+
+def _bytes(data):
+    if isinstance(data, str):
+        return data
+    if isinstance(data, memoryview):
+        return data.tobytes()
+    return str(data)
+
+def _encodeLongRun(zeros):
+    full, rest = divmod(len(zeros), 255)
+    return '\x00\xff' * full + _encodedRuns[rest]
+
+def zerocode_encode(data):
+    """Zerocoded form of data."""
+    data = _bytes(data)
+    if '\x00' not in data:
+        return data
+    # split() alternates the bytes between runs with the runs themselves
+    pieces = _splitRuns(data)
+    runs = _encodedRuns
+    pieces[1::2] = [ runs[len(zeros)] if len(zeros) < 256 else _encodeLongRun(zeros)
+                     for zeros in pieces[1::2] ]
+    return ''.join(pieces)
+
+def _decode(data):
+    """(expanded, consumed): decodes data up to a 0x00 that ends it."""
+    find = data.find
+    i = find('\x00')
+    if i < 0:
+        return data, len(data)
+    pieces = [ ]
+    append = pieces.append
+    runs = _decodedRuns
+    pos = 0
+    end = len(data) - 1
+    while i >= 0:
+        if i == end:
+            append(data[pos:i])
+            return ''.join(pieces), i
+        append(data[pos:i])
+        append(runs[data[i + 1]])
+        pos = i + 2
+        i = find('\x00', pos)
+    append(data[pos:])
+    return ''.join(pieces), len(data)
+
+def zerocode_decode(data):
+    """Expands zerocoded data.  Raises ValueError if it ends in the
+    middle of a run."""
+    data = _bytes(data)
+    decoded, consumed = _decode(data)
+    if consumed < len(data):
+        raise ValueError("zerocoded data ends without a run length")
+    return decoded
+
+def _into(result, out, offset):
+    end = offset + len(result)
+    if end > len(out):
+        raise ValueError("%d bytes don't fit in %d at offset %d"
+                         % (len(result), len(out), offset))
+    out[offset:end] = result
+    return len(result)
+
+def zerocode_encode_into(data, out, offset=0):
+    """Writes the zerocoded form of data into the bytearray or
+    memoryview out at offset and returns the number of bytes written."""
+    return _into(zerocode_encode(data), out, offset)
+
+def zerocode_decode_into(data, out, offset=0):
+    """Writes the expanded form of data into the bytearray or memoryview
+    out at offset and returns the number of bytes written."""
+    return _into(zerocode_decode(data), out, offset)
+
+class ZerocodeEncoder(object):
+    """Encodes a stream fed in pieces; a zero run split between pieces
+    is encoded as one run."""
+    def __init__(self):
+        self._zeros = 0
+
+    def feed(self, data):
+        data = _bytes(data)
+        if not data:
+            return ''
+        if self._zeros:
+            stripped = data.lstrip('\x00')
+            if not stripped:
+                self._zeros += len(data)
+                return ''
+            data = '\x00' * (self._zeros + len(data) - len(stripped)) + stripped
+            self._zeros = 0
+        stripped = data.rstrip('\x00')
+        self._zeros = len(data) - len(stripped)
+        return zerocode_encode(stripped)
+
+    def flush(self):
+        """Encodes a trailing zero run held back by feed()."""
+        zeros, self._zeros = self._zeros, 0
+        return zerocode_encode('\x00' * zeros)
+
+class ZerocodeDecoder(object):
+    """Decodes a stream fed in pieces, such as a packet capture read in
+    blocks; a run split between pieces is held back until its length
+    arrives."""
+    def __init__(self):
+        self._pending = ''
+
+    def feed(self, data):
+        data = self._pending + _bytes(data)
+        decoded, consumed = _decode(data)
+        self._pending = data[consumed:]
+        return decoded
+
+    def flush(self):
+        """Raises ValueError if the stream ended in the middle of a run."""
+        if self._pending:
+            self._pending = ''
+            raise ValueError("zerocoded stream ends without a run length")
+        return ''
+
+def zerocode_decode_stream(pieces):
+    """Yields the expanded form of an iterable of zerocoded pieces."""
+    decoder = ZerocodeDecoder()
+    for piece in pieces:
+        decoded = decoder.feed(piece)
+        if decoded:
+            yield decoded
+    decoder.flush()
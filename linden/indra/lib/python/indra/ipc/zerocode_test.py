@@ -0,0 +1,175 @@
+"""\
+@file zerocode_test.py
+@brief Test cases and benchmark for zerocoding.
+
+$LicenseInfo:firstyear=2009&license=mit$
+
+Copyright (c) 2009, Linden Research, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+$/LicenseInfo$
+"""
+
+import os
+import random
+import time
+import unittest
+
+from indra.ipc.zerocode import zerocode_encode, zerocode_decode, \
+     zerocode_encode_into, zerocode_decode_into, ZerocodeEncoder, \
+     ZerocodeDecoder, zerocode_decode_stream
+
+# set INDRA_BENCHMARK in the environment to print timings
+BENCHMARK = bool(os.environ.get('INDRA_BENCHMARK'))
+
+def _byteEncode(data):
+    """ The byte at a time encoder, to compare against """
+    out = [ ]
+    zeros = 0
+    for c in data:
+        if c == '\x00':
+            zeros += 1
+            if zeros == 255:
+                out.append('\x00\xff')
+                zeros = 0
+            continue
+        if zeros:
+            out.append('\x00' + chr(zeros))
+            zeros = 0
+        out.append(c)
+    if zeros:
+        out.append('\x00' + chr(zeros))
+    return ''.join(out)
+
+def _byteDecode(data):
+    out = [ ]
+    i = 0
+    while i < len(data):
+        if data[i] == '\x00':
+            out.append('\x00' * ord(data[i + 1]))
+            i += 2
+        else:
+            out.append(data[i])
+            i += 1
+    return ''.join(out)
+
+def randomBody(rand, size):
+    """ Random bytes with zero runs of all lengths, some over 255 """
+    pieces = [ ]
+    length = 0
+    zero_bias = rand.random()
+    while length < size:
+        if rand.random() < zero_bias:
+            n = rand.choice([1, 1, 2, 3, 7, 16, 254, 255, 256, 600])
+            pieces.append('\x00' * n)
+        else:
+            n = rand.randint(1, 20)
+            pieces.append(''.join([ chr(rand.randint(1, 255)) for i in xrange(n) ]))
+        length += n
+    return ''.join(pieces)[:size]
+
+def objectUpdateBody(rand):
+    """ About the size and zero density of an ObjectUpdate body: ids and
+    positions, then mostly-zero shape parameters and texture entries """
+    pieces = [ ]
+    for i in xrange(rand.randint(1, 4)):
+        pieces.append(''.join([ chr(rand.randint(0, 255)) for j in xrange(60) ]))
+        pieces.append('\x00' * rand.randint(20, 80))
+        pieces.append(''.join([ chr(rand.randint(1, 255)) for j in xrange(20) ]))
+        pieces.append('\x00' * rand.randint(5, 40) + '\x80\x3f' + '\x00' * 18)
+        pieces.append(''.join([ chr(rand.randint(0, 3)) for j in xrange(40) ]))
+    return ''.join(pieces)
+
+class TestZerocode(unittest.TestCase):
+    def test_examples(self):
+        self.assertEquals(zerocode_encode(''), '')
+        self.assertEquals(zerocode_encode('abc'), 'abc')
+        self.assertEquals(zerocode_encode('a\x00\x00\x00b\x00'), 'a\x00\x03b\x00\x01')
+        self.assertEquals(zerocode_encode('\x00' * 600), '\x00\xff\x00\xff\x00\x5a')
+        self.assertEquals(zerocode_decode('a\x00\x03b\x00\x01'), 'a\x00\x00\x00b\x00')
+        self.assertRaises(ValueError, zerocode_decode, 'ab\x00')
+
+    def test_round_trip_property(self):
+        rand = random.Random(49)
+        for i in xrange(500):
+            body = randomBody(rand, rand.randint(0, 1500))
+            encoded = zerocode_encode(body)
+            self.assertEquals(encoded, _byteEncode(body))
+            self.failIf('\x00\x00' in encoded)
+            self.assertEquals(zerocode_decode(encoded), body)
+            self.assertEquals(_byteDecode(encoded), body)
+            self.assertEquals(zerocode_encode(bytearray(body)), encoded)
+            self.assertEquals(zerocode_decode(memoryview(encoded)), body)
+
+    def test_into(self):
+        body = 'ab\x00\x00\x00cd\x00'
+        out = bytearray(20)
+        n = zerocode_encode_into(body, out, 2)
+        self.assertEquals(str(out[2:2 + n]), 'ab\x00\x03cd\x00\x01')
+        back = bytearray(len(body))
+        self.assertEquals(zerocode_decode_into(memoryview(out)[2:2 + n],
+                                               memoryview(back)), len(body))
+        self.assertEquals(str(back), body)
+        self.assertRaises(ValueError, zerocode_decode_into, out[2:2 + n], bytearray(3))
+
+    def test_streams(self):
+        rand = random.Random(4949)
+        for i in xrange(200):
+            body = randomBody(rand, rand.randint(0, 3000))
+            cuts = [0] + sorted([ rand.randint(0, len(body)) for j in xrange(5) ]) \
+                   + [len(body)]
+            encoder = ZerocodeEncoder()
+            encoded = ''.join([ encoder.feed(body[a:b])
+                                for a, b in zip(cuts, cuts[1:]) ]) + encoder.flush()
+            self.assertEquals(encoded, zerocode_encode(body))
+
+            cuts = [0] + sorted([ rand.randint(0, len(encoded)) for j in xrange(5) ]) \
+                   + [len(encoded)]
+            pieces = [ encoded[a:b] for a, b in zip(cuts, cuts[1:]) ]
+            self.assertEquals(''.join(zerocode_decode_stream(pieces)), body)
+
+        decoder = ZerocodeDecoder()
+        self.assertEquals(decoder.feed('a\x00'), 'a')
+        self.assertEquals(decoder.feed('\x02b'), '\x00\x00b')
+        decoder.feed('c\x00')
+        self.assertRaises(ValueError, decoder.flush)
+
+class TestZerocodeBenchmark(unittest.TestCase):
+    def test_object_update_bodies(self):
+        if not BENCHMARK:
+            return
+        rand = random.Random(1)
+        bodies = [ objectUpdateBody(rand) for i in xrange(2000) ]
+        encoded = [ zerocode_encode(body) for body in bodies ]
+        size = sum(map(len, bodies))
+
+        def rate(function, inputs):
+            start = time.time()
+            for data in inputs:
+                function(data)
+            return len(inputs) / max(time.time() - start, 1e-6)
+
+        print "\nObjectUpdate-sized bodies (%d bytes avg, %.0f%% after zerocoding): " \
+              "encode %d/s (byte loop %d/s), decode %d/s (byte loop %d/s)" % (
+            size / len(bodies), 100.0 * sum(map(len, encoded)) / size,
+            rate(zerocode_encode, bodies), rate(_byteEncode, bodies),
+            rate(zerocode_decode, encoded), rate(_byteDecode, encoded))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,426 @@
+#!/usr/bin/env python
+"""\
+@file columnstore.py
+@brief Append-only columnar time-series files for simperf host metrics.
+
+$LicenseInfo:firstyear=2009&license=mit$
+
+Copyright (c) 2009, Linden Research, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+$/LicenseInfo$
+
+File layout, all little-endian:
+
+  header    magic 'LLCOLS01', version, rows per block, header size, then
+            binary LLSD {'ds': [{'name', 'type'}, ...], 'rollups': [ms, ...]}
+  blocks    fixed size, one level each (0 is the raw rows, level n the
+            means over rollups[n - 1] ms buckets):
+              block header: magic 'CBLK', level, rows used, first and
+                            last timestamp (ms)
+              timestamps:   float64 x rows per block
+              columns:      float64 x rows per block, one run per ds
+
+Rows are only ever appended.  The last block of each level is filled in
+place, and its row count is written after its values, so readers never
+see a half-written row.  The block headers, in file order, form the time
+index that readers binary search.
+"""
+
+import bisect
+import csv
+import getopt
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from indra.base import llsd
+
+MAGIC = 'LLCOLS01'
+VERSION = 1
+BLOCK_MAGIC = 'CBLK'
+DEFAULT_BLOCK_ROWS = 1024
+DEFAULT_ROLLUPS = (300000, 3600000)     # 5 minutes, 1 hour
+
+_header = struct.Struct('<8sIII')       # magic, version, block rows, header size
+_block_header = struct.Struct('<4sIIIdd')   # magic, level, rows, unused,
+                                            # first/last timestamp
+_double = struct.Struct('<d')
+
+NaN = float('nan')
+
+def usage():
+    print "Usage:"
+    print sys.argv[0] + " [options] STOREFILE"
+    print "  Print rows of a column store as CSV."
+    print
+    print "Options:"
+    print "  -c, --columns   Comma separated columns.  (Default:  all)"
+    print "  -s, --start     First timestamp (ms).  (Default:  first row)"
+    print "  -e, --end       Last timestamp (ms).  (Default:  last row)"
+    print "  -l, --level     0 for raw rows, n for the n-th rollup.  (Default:  0)"
+    print "  -h, --help      Print this message and exit."
+    print
+    print "Interfaces:"
+    print "   class ColumnStoreWriter(path, ds)   # append(timestamp, values)"
+    print "   class ColumnStoreReader(path)       # read(columns, start, end, level)"
+
+class ColumnStoreError(Exception):
+    pass
+
+class _Layout(object):
+    """ Header fields and block geometry shared by writer and reader """
+    def __init__(self, ds, block_rows, rollups, header_size):
+        self.ds = ds
+        self.names = [d['name'] for d in ds]
+        self.block_rows = block_rows
+        self.rollups = list(rollups)
+        self.header_size = header_size
+        self.block_size = _block_header.size + 8 * block_rows * (len(ds) + 1)
+
+    def column_offset(self, block_offset, column):
+        """ File offset of a column in a block, -1 being the timestamps """
+        return block_offset + _block_header.size + \
+               8 * self.block_rows * (column + 1)
+
+def _read_layout(data):
+    magic, version, block_rows, header_size = _header.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ColumnStoreError("not a column store")
+    meta = llsd.parse(data[_header.size:header_size].rstrip('\0'))
+    return _Layout(meta['ds'], block_rows, meta['rollups'], header_size)
+
+def _ds_columns(ds):
+    return [(d['name'], d.get('type')) for d in ds]
+
+def _scan_blocks(data, layout, size):
+    """ Returns [[(offset, rows, first, last), ...] per level] """
+    levels = [[] for i in range(len(layout.rollups) + 1)]
+    offset = layout.header_size
+    while offset + layout.block_size <= size:
+        magic, level, rows, unused, first, last = \
+               _block_header.unpack_from(data, offset)
+        if magic != BLOCK_MAGIC or level >= len(levels):
+            raise ColumnStoreError("bad block at offset %d" % offset)
+        levels[level].append((offset, rows, first, last))
+        offset += layout.block_size
+    return levels
+
+class _Rollup(object):
+    """ Running means of the current bucket of one rollup level """
+    def __init__(self, bucket, columns):
+        self.bucket = bucket
+        self.start = None
+        self.sums = [0.0] * columns
+        self.counts = [0] * columns
+
+    def add(self, timestamp, values):
+        """ Returns the finished (timestamp, means) row when timestamp
+        starts a new bucket, else None """
+        start = timestamp - timestamp % self.bucket
+        finished = None
+        if self.start is not None and start != self.start:
+            finished = self.finish()
+        self.start = start
+        for j, value in enumerate(values):
+            if value == value:
+                self.sums[j] += value
+                self.counts[j] += 1
+        return finished
+
+    def finish(self):
+        means = [total / count if count else NaN
+                 for total, count in zip(self.sums, self.counts)]
+        row = (self.start, means)
+        self.sums = [0.0] * len(self.sums)
+        self.counts = [0] * len(self.counts)
+        self.start = None
+        return row
+
+class ColumnStoreWriter(object):
+    """
+    Appends rows to a column store, creating it with ds (a list of
+    {'name', 'type'} maps, as in SimPerfHostXMLParser.rrd_ds) if it does
+    not exist.  An existing store must have been created with the same
+    ds.  Timestamps are ms and must increase.
+    """
+    def __init__(self, path, ds=None, block_rows=DEFAULT_BLOCK_ROWS,
+                 rollups=DEFAULT_ROLLUPS):
+        self.path = path
+        if os.path.exists(path) and os.path.getsize(path):
+            self._file = open(path, 'r+b')
+            data = self._file.read()
+            self._layout = _read_layout(data)
+            if ds and _ds_columns(ds) != _ds_columns(self._layout.ds):
+                self._file.close()
+                raise ColumnStoreError("%s holds columns %s, not %s"
+                                       % (path, self._layout.names,
+                                          [d['name'] for d in ds]))
+            levels = _scan_blocks(data, self._layout, len(data))
+            # drop a block that was being added when a writer died
+            while True:
+                ends = [(blocks[-1][0], blocks) for blocks in levels if blocks]
+                if not ends:
+                    break
+                offset, blocks = max(ends)
+                if blocks[-1][1]:
+                    break
+                blocks.pop()
+            self._file.truncate(self._layout.header_size +
+                                sum(map(len, levels)) * self._layout.block_size)
+        else:
+            if not ds:
+                raise ColumnStoreError("a new column store needs ds")
+            self._file = open(path, 'w+b')
+            self._layout = self._create(ds, block_rows, rollups)
+            levels = [[] for i in range(len(rollups) + 1)]
+            data = ''
+        self.ds = self._layout.ds
+        # (offset, rows, first timestamp) of each level's last block
+        self._tails = [list(blocks[-1][:3]) if blocks else None
+                       for blocks in levels]
+        self.last_time = levels[0][-1][3] if levels[0] else None
+        self._rollups = [_Rollup(bucket, len(self.ds))
+                         for bucket in self._layout.rollups]
+        if self.last_time is not None:
+            self._restore_rollups(data, levels[0])
+
+    def _create(self, ds, block_rows, rollups):
+        meta = llsd.format_binary({'ds': ds, 'rollups': list(rollups)})
+        header_size = _header.size + len(meta)
+        header_size += -header_size % 8
+        self._file.write(_header.pack(MAGIC, VERSION, block_rows, header_size))
+        self._file.write(meta.ljust(header_size - _header.size, '\0'))
+        self._file.flush()
+        return _Layout(ds, block_rows, rollups, header_size)
+
+    def _restore_rollups(self, data, blocks):
+        # The rows of each level's unfinished bucket are still in level
+        # 0; add them up again.
+        layout = self._layout
+        for rollup in self._rollups:
+            start = self.last_time - self.last_time % rollup.bucket
+            for offset, rows, first, last in blocks:
+                if last < start:
+                    continue
+                for i in range(rows):
+                    timestamp, = _double.unpack_from(
+                        data, layout.column_offset(offset, -1) + 8 * i)
+                    if timestamp < start:
+                        continue
+                    values = [_double.unpack_from(
+                                  data, layout.column_offset(offset, j) + 8 * i)[0]
+                              for j in range(len(self.ds))]
+                    rollup.add(timestamp, values)
+
+    def append(self, timestamp, values):
+        if len(values) != len(self.ds):
+            raise ColumnStoreError("expected %d values, got %d"
+                                   % (len(self.ds), len(values)))
+        if self.last_time is not None and timestamp <= self.last_time:
+            raise ColumnStoreError("timestamp %s is not after %s"
+                                   % (timestamp, self.last_time))
+        self._append(0, timestamp, values)
+        self.last_time = timestamp
+        for level, rollup in enumerate(self._rollups):
+            row = rollup.add(timestamp, values)
+            if row is not None:
+                self._append(level + 1, row[0], row[1])
+
+    def append_columns(self, timestamps, columns):
+        """
+        Appends the rows of parallel columns, such as those from
+        simperf_host_xml_columns(), skipping rows that are not newer
+        than the last stored one.
+        """
+        for i, timestamp in enumerate(timestamps):
+            if self.last_time is None or timestamp > self.last_time:
+                self.append(timestamp, [column[i] for column in columns])
+
+    def _append(self, level, timestamp, values):
+        layout = self._layout
+        out = self._file
+        tail = self._tails[level]
+        if tail is None or tail[1] == layout.block_rows:
+            # start a new block
+            out.seek(0, 2)
+            tail = self._tails[level] = [out.tell(), 0, timestamp]
+            out.write(_block_header.pack(BLOCK_MAGIC, level, 0, 0,
+                                         timestamp, timestamp))
+            out.truncate(tail[0] + layout.block_size)
+        offset, rows, first = tail
+        out.seek(layout.column_offset(offset, -1) + 8 * rows)
+        out.write(_double.pack(timestamp))
+        for j, value in enumerate(values):
+            out.seek(layout.column_offset(offset, j) + 8 * rows)
+            out.write(_double.pack(value))
+        tail[1] = rows + 1
+        out.seek(offset)
+        out.write(_block_header.pack(BLOCK_MAGIC, level, tail[1], 0,
+                                     first, timestamp))
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        """
+        Closes the store.  Rows of unfinished rollup buckets are kept in
+        level 0 and picked up again by the next writer.
+        """
+        self._file.close()
+
+class ColumnStoreReader(object):
+    """
+    Reads a column store through mmap, so only the pages of the columns
+    and time ranges asked for are touched.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._map = None
+        self.refresh()
+
+    def refresh(self):
+        """ Picks up rows appended since the store was opened """
+        if self._map is not None:
+            self._map.close()
+        source = open(self.path, 'rb')
+        try:
+            self._map = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            source.close()
+        self._layout = _read_layout(self._map)
+        self.ds = self._layout.ds
+        self.names = self._layout.names
+        self.rollups = self._layout.rollups
+        self._levels = _scan_blocks(self._map, self._layout, len(self._map))
+        self._firsts = [[block[2] for block in blocks]
+                        for blocks in self._levels]
+
+    def time_range(self, level=0):
+        blocks = self._levels[level]
+        if not blocks or not blocks[0][1]:
+            return (None, None)
+        return (blocks[0][2], blocks[-1][3])
+
+    def _column(self, offset, column, rows):
+        start = self._layout.column_offset(offset, column)
+        if numpy is not None:
+            return numpy.frombuffer(self._map, dtype='<f8', count=rows,
+                                    offset=start)
+        values = array('d')
+        values.fromstring(self._map[start:start + 8 * rows])
+        if sys.byteorder == 'big':
+            values.byteswap()
+        return values
+
+    def read(self, columns=None, start_time=None, end_time=None, level=0):
+        """
+        Returns (timestamps, {name: values}) for the rows of level with
+        start_time <= timestamp <= end_time.  Values are numpy arrays
+        when numpy is available, array('d') otherwise.
+        """
+        if columns is None:
+            columns = self.names
+        indexes = [self.names.index(name) for name in columns]
+        blocks = self._levels[level]
+        first_block = 0
+        if start_time is not None:
+            first_block = max(0, bisect.bisect_right(self._firsts[level],
+                                                     start_time) - 1)
+        pieces = []
+        for offset, rows, first, last in blocks[first_block:]:
+            if end_time is not None and first > end_time:
+                break
+            if start_time is not None and last < start_time:
+                continue
+            timestamps = self._column(offset, -1, rows)
+            low, high = 0, rows
+            if start_time is not None and first < start_time:
+                low = bisect.bisect_left(timestamps, start_time)
+            if end_time is not None and last > end_time:
+                high = bisect.bisect_right(timestamps, end_time)
+            pieces.append((timestamps[low:high],
+                           [self._column(offset, j, rows)[low:high]
+                            for j in indexes]))
+
+        if numpy is not None:
+            if not pieces:
+                return numpy.zeros(0), dict([(name, numpy.zeros(0))
+                                             for name in columns])
+            timestamps = numpy.concatenate([piece[0] for piece in pieces])
+            values = [numpy.concatenate([piece[1][k] for piece in pieces])
+                      for k in range(len(columns))]
+        else:
+            timestamps = array('d')
+            values = [array('d') for name in columns]
+            for piece_timestamps, piece_values in pieces:
+                timestamps.extend(piece_timestamps)
+                for k in range(len(columns)):
+                    values[k].extend(piece_values[k])
+        return timestamps, dict(zip(columns, values))
+
+    def close(self):
+        self._map.close()
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    opts, args = getopt.getopt(argv, "c:s:e:l:h",
+                               ["columns=", "start=", "end=", "level=", "help"])
+    columns = None
+    start_time = None
+    end_time = None
+    level = 0
+    for o, a in opts:
+        if o in ("-c", "--columns"):
+            columns = a.split(',')
+        if o in ("-s", "--start"):
+            start_time = float(a)
+        if o in ("-e", "--end"):
+            end_time = float(a)
+        if o in ("-l", "--level"):
+            level = int(a)
+        if o in ("-h", "--help"):
+            usage()
+            return 0
+    if len(args) != 1:
+        usage()
+        return 1
+
+    reader = ColumnStoreReader(args[0])
+    if columns is None:
+        columns = reader.names
+    timestamps, values = reader.read(columns, start_time, end_time, level)
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['timestamp'] + columns)
+    for i in range(len(timestamps)):
+        writer.writerow(['%d' % timestamps[i]] +
+                        [repr(float(values[name][i])) for name in columns])
+    reader.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
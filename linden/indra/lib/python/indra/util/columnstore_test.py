@@ -0,0 +1,138 @@
+"""\
+@file columnstore_test.py
+@brief Test cases for the simperf host metrics column store.
+
+$LicenseInfo:firstyear=2009&license=mit$
+
+Copyright (c) 2009, Linden Research, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+$/LicenseInfo$
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from indra.util.columnstore import ColumnStoreWriter, ColumnStoreReader, \
+     ColumnStoreError
+
+DS = [{'name': 'cpu', 'type': 'GAUGE'}, {'name': 'mem', 'type': 'GAUGE'},
+      {'name': 'net', 'type': 'COUNTER'}]
+
+def _row(i):
+    return [float(i), 100.0 + i, 1000.0 * i]
+
+class TestColumnStore(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'host.cols')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, first, count):
+        writer = ColumnStoreWriter(self.path, DS, block_rows=4,
+                                   rollups=(100, 1000))
+        for i in xrange(first, first + count):
+            writer.append(i * 10, _row(i))
+        writer.close()
+
+    def read(self, *args, **kwargs):
+        reader = ColumnStoreReader(self.path)
+        try:
+            timestamps, values = reader.read(*args, **kwargs)
+            return list(timestamps), dict([(name, list(column))
+                                           for name, column
+                                           in values.iteritems()])
+        finally:
+            reader.close()
+
+    def test_store_and_read(self):
+        self.write(0, 30)
+        reader = ColumnStoreReader(self.path)
+        self.assertEquals(reader.names, ['cpu', 'mem', 'net'])
+        self.assertEquals(reader.time_range(), (0, 290))
+        reader.close()
+
+        timestamps, values = self.read()
+        self.assertEquals(timestamps, [i * 10.0 for i in xrange(30)])
+        self.assertEquals(values['mem'], [100.0 + i for i in xrange(30)])
+        # a window crossing block boundaries
+        timestamps, values = self.read(['net'], 35, 120)
+        self.assertEquals(timestamps, [i * 10.0 for i in xrange(4, 13)])
+        self.assertEquals(values.keys(), ['net'])
+        self.assertEquals(values['net'], [1000.0 * i for i in xrange(4, 13)])
+        self.assertEquals(self.read(start_time=1000), ([], {'cpu': [],
+                                                           'mem': [],
+                                                           'net': []}))
+
+        # 100ms means, the last bucket still open
+        timestamps, values = self.read(['cpu'], level=1)
+        self.assertEquals(timestamps, [0.0, 100.0])
+        self.assertEquals(values['cpu'], [4.5, 14.5])
+
+    def test_reopen_appends(self):
+        self.write(0, 15)
+        self.write(15, 15)
+        timestamps, values = self.read()
+        self.assertEquals(timestamps, [i * 10.0 for i in xrange(30)])
+        self.assertEquals(values['cpu'], [float(i) for i in xrange(30)])
+        # the bucket open at the first close was finished by the second
+        # writer with all of its rows
+        timestamps, values = self.read(['cpu'], level=1)
+        self.assertEquals(values['cpu'], [4.5, 14.5])
+
+    def test_append_checks(self):
+        writer = ColumnStoreWriter(self.path, DS)
+        writer.append(100, _row(1))
+        self.assertRaises(ColumnStoreError, writer.append, 100, _row(2))
+        self.assertRaises(ColumnStoreError, writer.append, 200, [1.0])
+        writer.append_columns([50, 100, 150], [[1.0, 2.0, 3.0]] * 3)
+        writer.close()
+        timestamps, values = self.read()
+        self.assertEquals(timestamps, [100.0, 150.0])
+        self.assertEquals(values['net'], [1000.0, 3.0])
+
+    def test_mismatched_ds(self):
+        self.assertRaises(ColumnStoreError, ColumnStoreWriter, self.path)
+        self.write(0, 5)
+        self.assertRaises(ColumnStoreError, ColumnStoreWriter, self.path,
+                          DS[:2])
+        renamed = DS[:2] + [{'name': 'disk', 'type': 'COUNTER'}]
+        self.assertRaises(ColumnStoreError, ColumnStoreWriter, self.path,
+                          renamed)
+        retyped = DS[:2] + [{'name': 'net', 'type': 'GAUGE'}]
+        self.assertRaises(ColumnStoreError, ColumnStoreWriter, self.path,
+                          retyped)
+        # reopening without a ds uses the stored one
+        writer = ColumnStoreWriter(self.path)
+        self.assertEquals([d['name'] for d in writer.ds],
+                          ['cpu', 'mem', 'net'])
+        writer.append(50, _row(5))
+        writer.close()
+        self.assertEquals(len(self.read()[0]), 6)
+
+    def test_not_a_store(self):
+        open(self.path, 'wb').write('x' * 64)
+        self.assertRaises(ColumnStoreError, ColumnStoreReader, self.path)
+
+if __name__ == '__main__':
+    unittest.main()
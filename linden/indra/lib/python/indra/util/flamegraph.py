@@ -0,0 +1,352 @@
+#!/usr/bin/env python
+"""\
+@file flamegraph.py
+@brief Collapsed-stack and SVG flame graph export of simperf profiles.
+
+$LicenseInfo:firstyear=2009&license=mit$
+
+Copyright (c) 2009, Linden Research, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+$/LicenseInfo$
+
+Stacks are kept as a dict of 'outer;inner;...' -> weight, the collapsed
+format most flame graph tools read, with one 'stack weight' per line.
+"""
+
+import getopt
+import heapq
+import itertools
+import os
+import sys
+from xml.sax.saxutils import escape
+
+DEFAULT_WIDTH = 1200
+FRAME_HEIGHT = 16
+FONT_SIZE = 12
+DEFAULT_MAX_DEPTH = 64
+DEFAULT_MAX_STACKS = 1000
+
+def usage():
+    print "Usage:"
+    print sys.argv[0] + " [options] [HOST=]FILE..."
+    print "  Merge profiles into collapsed stacks or an SVG flame graph.  Each"
+    print "  FILE is read as the kind given by the option before it."
+    print
+    print "Options:"
+    print "  -r, --oprofile   Following files are OProfile full (callgraph) reports."
+    print "  -b, --blockmap   Following files are llperformance/llsampler output."
+    print "  -c, --collapsed  Following files are collapsed stacks.  (Default)"
+    print "  -H, --by-host    Put each file's HOST (or file name) at the stack root."
+    print "  -s, --svg        Write an SVG flame graph instead of collapsed stacks."
+    print "  -t, --title      SVG title.  (Default:  Flame Graph)"
+    print "  -o, --out        Output filename.  (Default:  stdout)"
+    print "  -h, --help       Print this message and exit."
+    print
+    print "Interfaces:"
+    print "   def from_block_map(block_map) / from_call_graph(graph)"
+    print "   def merge(stacks, ...) / write_collapsed(stacks, file)"
+    print "   def format_svg(stacks)"
+
+def _frame(name):
+    return name.replace(';', ',')
+
+def from_block_map(block_map, weight='us'):
+    """
+    Collapsed stacks from a block map (path -> stats map, as written by
+    llperformance and llsampler, or llperformance.gBlockMap itself).
+    Path totals include their children, so each stack gets what its
+    path has left after its children are taken out.
+    """
+    totals = {}
+    for path, stats in block_map.iteritems():
+        if hasattr(stats, 'get_map'):
+            stats = stats.get_map()
+        totals[path] = stats.get(weight, 0)
+
+    stacks = {}
+    children = {}
+    for path, total in totals.iteritems():
+        parent = path[:path.rindex('/')]
+        if parent in totals:
+            children[parent] = children.get(parent, 0) + total
+    for path, total in totals.iteritems():
+        own = total - children.get(path, 0)
+        if own > 0:
+            stack = ';'.join([_frame(name) for name in path.split('/') if name])
+            stacks[stack] = stacks.get(stack, 0) + own
+    return stacks
+
+def from_call_graph(graph, max_depth=DEFAULT_MAX_DEPTH, min_weight=0.5,
+                    max_stacks=DEFAULT_MAX_STACKS):
+    """
+    Collapsed stacks from an OProfile call graph
+    (simperf_oprof_interface.CallGraph).  OProfile only reports
+    caller/callee arcs, not whole stacks, so each symbol's own samples
+    are split among its callers in proportion to the arc samples and
+    followed up to the roots; weights below min_weight are dropped and
+    recursion ends the walk.  Stacks are therefore an estimate.
+
+    Shared callers can give a symbol exponentially many paths to the
+    roots, so the heaviest are followed first and after max_stacks
+    expansions the rest end where they are.
+    """
+    stacks = {}
+    labels = {}
+    for key, node in graph.nodes.iteritems():
+        labels[key] = _frame(node.symbol)
+
+    def add(path, weight):
+        stack = ';'.join([labels[frame] for frame in reversed(path)])
+        stacks[stack] = stacks.get(stack, 0) + weight
+
+    def walk(key, weight):
+        # (-weight, tie breaker, path, set of the path's frames)
+        order = itertools.count()
+        pending = [(-weight, order.next(), (key,), frozenset([key]))]
+        expanded = 0
+        while pending:
+            weight, ignored, path, on_path = heapq.heappop(pending)
+            weight = -weight
+            node = graph.nodes[path[-1]]
+            callers = [(caller, samples)
+                       for caller, samples in node.called_by.iteritems()
+                       if samples > 0 and caller not in on_path]
+            if not callers or len(path) >= max_depth or \
+                   expanded >= max_stacks:
+                add(path, weight)
+                continue
+            expanded += 1
+            total = float(sum([samples for caller, samples in callers]))
+            for caller, samples in callers:
+                share = weight * samples / total
+                if share >= min_weight:
+                    heapq.heappush(pending, (-share, order.next(),
+                                             path + (caller,),
+                                             on_path | frozenset([caller])))
+
+    for key, node in graph.nodes.iteritems():
+        if node.samples > 0:
+            walk(key, float(node.samples))
+
+    for stack, weight in stacks.items():
+        stacks[stack] = int(round(weight))
+        if not stacks[stack]:
+            del stacks[stack]
+    return stacks
+
+def merge(*stack_sets, **kwargs):
+    """
+    Adds up collapsed stacks.  Pass prefixes=[host, ...] to put each
+    set under its own root frame, so several hosts can be compared in one
+    graph.
+    """
+    prefixes = kwargs.get('prefixes')
+    merged = {}
+    for i, stacks in enumerate(stack_sets):
+        for stack, weight in stacks.iteritems():
+            if prefixes is not None:
+                stack = _frame(prefixes[i]) + ';' + stack
+            merged[stack] = merged.get(stack, 0) + weight
+    return merged
+
+def parse_collapsed(lines):
+    stacks = {}
+    for line in lines:
+        line = line.rstrip('\n')
+        try:
+            stack, weight = line.rsplit(' ', 1)
+            weight = float(weight)
+            if weight == int(weight):
+                weight = int(weight)
+        except (ValueError, OverflowError):
+            # not a stack line, or a nan or infinite weight
+            continue
+        stacks[stack] = stacks.get(stack, 0) + weight
+    return stacks
+
+def write_collapsed(stacks, output):
+    names = stacks.keys()
+    names.sort()
+    for stack in names:
+        output.write("%s %s\n" % (stack, stacks[stack]))
+
+def _tree(stacks):
+    """ Nested [weight, {name: child}] nodes """
+    root = [0, {}]
+    for stack, weight in stacks.iteritems():
+        root[0] += weight
+        node = root
+        for name in stack.split(';'):
+            child = node[1].get(name)
+            if child is None:
+                child = node[1][name] = [0, {}]
+            child[0] += weight
+            node = child
+    return root
+
+def _color(name):
+    # Stable warm colors, so a function keeps its color between graphs.
+    value = 0
+    for c in name[:16]:
+        value = (value * 31 + ord(c)) & 0xffff
+    return "rgb(%d,%d,%d)" % (205 + value % 50, 80 + (value >> 4) % 120,
+                              (value >> 8) % 55)
+
+def format_svg(stacks, title="Flame Graph", width=DEFAULT_WIDTH,
+               min_width=0.1):
+    """
+    A self-contained SVG flame graph of stacks, roots at the bottom.
+    Hovering a frame shows its name, weight and share of the total.
+    Frames narrower than min_width pixels are left out.
+    """
+    root = _tree(stacks)
+    total = float(root[0]) or 1.0
+    scale = (width - 20) / total
+
+    frames = []
+    def layout(node, x, depth):
+        names = node[1].keys()
+        names.sort()
+        for name in names:
+            child = node[1][name]
+            child_width = child[0] * scale
+            if child_width >= min_width:
+                frames.append((name, child[0], x, depth, child_width))
+                layout(child, x, depth + 1)
+            x += child_width
+    layout(root, 10.0, 0)
+
+    max_depth = max([frame[3] for frame in frames] + [0]) + 1
+    height = (max_depth + 3) * FRAME_HEIGHT + 20
+    char_width = FONT_SIZE * 0.59
+    out = ['<?xml version="1.0" standalone="no"?>\n',
+           '<svg version="1.1" width="%d" height="%d" viewBox="0 0 %d %d" '
+           'xmlns="http://www.w3.org/2000/svg">\n' % (width, height, width, height),
+           '<rect x="0" y="0" width="%d" height="%d" fill="#f8f8f8"/>\n' % (width, height),
+           '<text x="%d" y="%d" font-size="%d" font-family="Verdana" '
+           'text-anchor="middle">%s</text>\n'
+           % (width / 2, FRAME_HEIGHT + 4, FONT_SIZE + 4, escape(title))]
+    for name, weight, x, depth, frame_width in frames:
+        y = height - (depth + 2) * FRAME_HEIGHT
+        label = escape(name)
+        info = "%s (%s, %.2f%%)" % (label, weight, 100.0 * weight / total)
+        out.append('<g><title>%s</title><rect x="%.1f" y="%d" width="%.1f" '
+                   'height="%d" fill="%s" rx="2" ry="2"/>'
+                   % (info, x, y, frame_width, FRAME_HEIGHT - 1, _color(name)))
+        chars = int((frame_width - 6) / char_width)
+        if chars >= 3:
+            text = name
+            if len(text) > chars:
+                text = text[:chars - 2] + '..'
+            out.append('<text x="%.1f" y="%d" font-size="%d" '
+                       'font-family="Verdana">%s</text>'
+                       % (x + 3, y + FRAME_HEIGHT - 4, FONT_SIZE, escape(text)))
+        out.append('</g>\n')
+    out.append('</svg>\n')
+    return ''.join(out)
+
+def _load(kind, path):
+    if kind == 'oprofile':
+        from indra.util.simperf_oprof_interface import SimPerfOProfileInterface
+        oprof = SimPerfOProfileInterface(keep_result = False)
+        source = open(path, 'r')
+        try:
+            oprof.parse(source)
+        finally:
+            source.close()
+        return from_call_graph(oprof.graph)
+    if kind == 'blockmap':
+        from indra.util.simperf_proc_interface import parse_perf_logfile
+        info, block_map = parse_perf_logfile(path)
+        if 'samples' in info:
+            # llsampler counts samples
+            return from_block_map(block_map, 'count')
+        return from_block_map(block_map)
+    source = open(path, 'r')
+    try:
+        return parse_collapsed(source)
+    finally:
+        source.close()
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    opts, args = getopt.gnu_getopt(argv, "rbcHst:o:h",
+                                   ["oprofile", "blockmap", "collapsed",
+                                    "by-host", "svg", "title=", "out=", "help"])
+    by_host = False
+    svg = False
+    title = "Flame Graph"
+    output_file = sys.stdout
+    for o, a in opts:
+        if o in ("-H", "--by-host"):
+            by_host = True
+        if o in ("-s", "--svg"):
+            svg = True
+        if o in ("-t", "--title"):
+            title = a
+        if o in ("-o", "--out"):
+            output_file = open(a, 'w')
+        if o in ("-h", "--help"):
+            usage()
+            return 0
+
+    # The kind options apply to the files after them, so walk argv in
+    # order rather than use the getopt result.
+    kinds = {"-r": "oprofile", "--oprofile": "oprofile",
+             "-b": "blockmap", "--blockmap": "blockmap",
+             "-c": "collapsed", "--collapsed": "collapsed"}
+    kind = "collapsed"
+    stack_sets = []
+    hosts = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg in kinds:
+            kind = kinds[arg]
+        elif arg in ("-t", "--title", "-o", "--out"):
+            skip = True
+        elif arg.startswith("-"):
+            continue
+        elif arg in args:
+            host, path = None, arg
+            if '=' in arg:
+                host, path = arg.split('=', 1)
+            stack_sets.append(_load(kind, path))
+            hosts.append(host or os.path.basename(path))
+    if not stack_sets:
+        usage()
+        return 1
+
+    if by_host:
+        stacks = merge(prefixes=hosts, *stack_sets)
+    else:
+        stacks = merge(*stack_sets)
+    if svg:
+        output_file.write(format_svg(stacks, title))
+    else:
+        write_collapsed(stacks, output_file)
+    if output_file != sys.stdout:
+        output_file.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
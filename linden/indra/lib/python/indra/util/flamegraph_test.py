@@ -0,0 +1,148 @@
+"""\
+@file flamegraph_test.py
+@brief Test cases for collapsed stacks and flame graphs.
+
+$LicenseInfo:firstyear=2009&license=mit$
+
+Copyright (c) 2009, Linden Research, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+$/LicenseInfo$
+"""
+
+import unittest
+from cStringIO import StringIO
+
+from indra.util import flamegraph
+
+class _Node(object):
+    "What from_call_graph uses of a CallGraphNode"
+    def __init__(self, symbol, samples=0):
+        self.symbol = symbol
+        self.samples = samples
+        self.called_by = {}
+
+class _Graph(object):
+    def __init__(self):
+        self.nodes = {}
+
+    def node(self, symbol, samples=0):
+        node = self.nodes[(symbol, 'app')] = _Node(symbol, samples)
+        return node
+
+class TestFlameGraph(unittest.TestCase):
+    def test_parse_collapsed(self):
+        lines = ['main;handle;query 40\n',
+                 'main;handle 7\n',
+                 'main;idle 2.5\n',
+                 'main;handle;query 2\n',
+                 'not a stack\n',
+                 '\n',
+                 'main;broken nan\n',
+                 'main;broken inf\n',
+                 'main;with space;frame 3\n']
+        stacks = flamegraph.parse_collapsed(lines)
+        self.assertEquals(stacks, {'main;handle;query': 42,
+                                   'main;handle': 7,
+                                   'main;idle': 2.5,
+                                   'main;with space;frame': 3})
+        self.assert_(isinstance(stacks['main;handle'], int))
+        output = StringIO()
+        flamegraph.write_collapsed(stacks, output)
+        self.assertEquals(flamegraph.parse_collapsed(
+            output.getvalue().splitlines(True)), stacks)
+
+    def test_from_block_map(self):
+        block_map = {'/frame': {'us': 1000, 'count': 10},
+                     '/frame/physics': {'us': 600, 'count': 6},
+                     '/frame/physics/step;broad': {'us': 250, 'count': 3},
+                     '/frame/render': {'us': 400, 'count': 4},
+                     '/idle': {'us': 50, 'count': 1}}
+        self.assertEquals(flamegraph.from_block_map(block_map),
+                          {'frame;physics': 350,
+                           'frame;physics;step,broad': 250,
+                           'frame;render': 400,
+                           'idle': 50})
+        self.assertEquals(flamegraph.from_block_map(block_map, 'count'),
+                          {'frame;physics': 3,
+                           'frame;physics;step,broad': 3,
+                           'frame;render': 4,
+                           'idle': 1})
+
+    def test_from_call_graph(self):
+        graph = _Graph()
+        graph.node('main', 5)
+        graph.node('left').called_by = {('main', 'app'): 1}
+        graph.node('right').called_by = {('main', 'app'): 1}
+        graph.node('leaf', 100).called_by = {('left', 'app'): 30,
+                                             ('right', 'app'): 10}
+        # a recursive arc ends the walk
+        graph.node('loop', 4).called_by = {('loop', 'app'): 9}
+        self.assertEquals(flamegraph.from_call_graph(graph),
+                          {'main;left;leaf': 75, 'main;right;leaf': 25,
+                           'main': 5, 'loop': 4})
+        self.assertEquals(flamegraph.from_call_graph(graph, max_depth=2),
+                          {'left;leaf': 75, 'right;leaf': 25, 'main': 5,
+                           'loop': 4})
+
+    def test_from_call_graph_diamonds(self):
+        # 40 levels, each called by both nodes of the level above: 2**40
+        # paths from the leaf to main
+        graph = _Graph()
+        graph.node('main')
+        above = ['main', 'main']
+        for level in xrange(40):
+            names = ['a%d' % level, 'b%d' % level]
+            for name in names:
+                graph.node(name).called_by = dict(
+                    [((caller, 'app'), 1000) for caller in above])
+            above = names
+        graph.node('leaf', 10 ** 9).called_by = {(above[0], 'app'): 3000,
+                                                 (above[1], 'app'): 1000}
+        stacks = flamegraph.from_call_graph(graph, max_stacks=50)
+        self.assert_(len(stacks) <= 50 * 2 + 1)
+        # no weight is lost, only cut short
+        self.assertAlmostEquals(sum(stacks.values()), 10 ** 9, -2)
+        # the leaf's heavier caller was followed first
+        heaviest = max([(weight, stack) for stack, weight
+                        in stacks.iteritems()])[1]
+        self.assert_(heaviest.endswith(';a39;leaf'), heaviest)
+        self.failIf(len(flamegraph.from_call_graph(graph)) >
+                    flamegraph.DEFAULT_MAX_STACKS * 2 + 1)
+
+    def test_merge(self):
+        a = {'main;run': 3, 'main': 1}
+        b = {'main;run': 2}
+        self.assertEquals(flamegraph.merge(a, b), {'main;run': 5, 'main': 1})
+        self.assertEquals(flamegraph.merge(a, b, prefixes=['sim1', 'sim;2']),
+                          {'sim1;main;run': 3, 'sim1;main': 1,
+                           'sim,2;main;run': 2})
+
+    def test_format_svg(self):
+        svg = flamegraph.format_svg({'main;handle<T>': 90, 'main;tiny': 0.001},
+                                    title='A & B')
+        self.assert_(svg.startswith('<?xml'))
+        self.assert_(svg.endswith('</svg>\n'))
+        self.assert_('A &amp; B' in svg)
+        self.assert_('handle&lt;T&gt;' in svg)
+        self.assert_('tiny' not in svg)
+        self.assertEquals(svg.count('<rect'), 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,195 @@
+"""\
+@file histogram.py
+@brief Fixed-precision log-linear histograms for latency and size data.
+
+$LicenseInfo:firstyear=2009&license=mit$
+
+Copyright (c) 2009, Linden Research, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+$/LicenseInfo$
+"""
+
+import math
+
+# bucket for values at or below zero; below any real bucket index
+_ZERO_INDEX = -1 << 30
+
+_INFINITY = float('inf')
+
+class LogLinearHistogram(object):
+    """
+    A histogram whose buckets grow exponentially, in the style of
+    HdrHistogram: every power of two is split into sub_buckets equal
+    linear buckets, so any recorded value is known to within
+    1/sub_buckets of itself regardless of its magnitude.  Values at or
+    below zero share a single bucket.
+
+    Recording is O(1).  Only buckets that have been hit are stored, and
+    the number of possible buckets is bounded by the exponent range of
+    a float times sub_buckets (in practice a few dozen octaves are ever
+    hit), so memory stays small and fixed.  Histograms with the
+    same sub_buckets can be merged exactly, which makes them suitable
+    for combining results across threads, processes and intervals.
+
+    NaN and infinite values have no bucket; they are only counted in
+    'invalid' and left out of count, total, min and max.
+    """
+    def __init__(self, sub_buckets=16):
+        self.sub_buckets = sub_buckets
+        self.buckets = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.invalid = 0
+
+    def _index(self, value):
+        if value <= 0:
+            return _ZERO_INDEX
+        mantissa, exponent = math.frexp(value)
+        return exponent * self.sub_buckets + \
+               int((mantissa - 0.5) * 2 * self.sub_buckets)
+
+    def _bucket_value(self, index):
+        "Representative (midpoint) value of a bucket"
+        if index == _ZERO_INDEX:
+            return 0
+        exponent, sub = divmod(index, self.sub_buckets)
+        low = math.ldexp(0.5 + sub / (2.0 * self.sub_buckets), exponent)
+        high = math.ldexp(0.5 + (sub + 1) / (2.0 * self.sub_buckets), exponent)
+        return (low + high) / 2.0
+
+    def record(self, value, count=1):
+        if value != value or value == _INFINITY or value == -_INFINITY:
+            self.invalid += count
+            return
+        index = self._index(value)
+        buckets = self.buckets
+        buckets[index] = buckets.get(index, 0) + count
+        self.count += count
+        self.total += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        "Add the contents of another histogram into this one."
+        if other.sub_buckets != self.sub_buckets:
+            raise ValueError("cannot merge histograms with %d and %d sub-buckets"
+                             % (self.sub_buckets, other.sub_buckets))
+        buckets = self.buckets
+        for index, count in other.buckets.iteritems():
+            buckets[index] = buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.invalid += other.invalid
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+        return self
+
+    def mean(self):
+        if not self.count:
+            return None
+        return self.total / float(self.count)
+
+    def percentiles(self, percents):
+        """
+        Returns the values at each of percents (0-100), in order.  The
+        result is clamped to the recorded min and max.
+        """
+        if not self.count:
+            return [None] * len(percents)
+        indexes = self.buckets.keys()
+        indexes.sort()
+        targets = [max(1, int(math.ceil(p / 100.0 * self.count)))
+                   for p in percents]
+        order = range(len(targets))
+        order.sort(key=lambda i: targets[i])
+        results = [None] * len(targets)
+        seen = 0
+        position = 0
+        for index in indexes:
+            seen += self.buckets[index]
+            while position < len(order) and targets[order[position]] <= seen:
+                value = self._bucket_value(index)
+                results[order[position]] = min(max(value, self.min), self.max)
+                position += 1
+            if position == len(order):
+                break
+        return results
+
+    def percentile(self, percent):
+        return self.percentiles([percent])[0]
+
+    def summary(self, percents=(50, 90, 99)):
+        """
+        Returns a dict of count, invalid, min, max, mean and one
+        'p<percent>' key for each of percents, for example 'p99' or
+        'p99.9'.
+        """
+        result = {'count': self.count,
+                  'invalid': self.invalid,
+                  'min': self.min,
+                  'max': self.max,
+                  'mean': self.mean()}
+        for percent, value in zip(percents, self.percentiles(percents)):
+            result['p%s' % ('%g' % percent)] = value
+        return result
+
+    def to_llsd(self):
+        buckets = {}
+        for index, count in self.buckets.iteritems():
+            buckets[str(index)] = count
+        return {'sub_buckets': self.sub_buckets,
+                'count': self.count,
+                'total': self.total,
+                'min': self.min,
+                'max': self.max,
+                'invalid': self.invalid,
+                'buckets': buckets}
+
+    def from_llsd(cls, data):
+        histogram = cls(data['sub_buckets'])
+        for index, count in data['buckets'].iteritems():
+            histogram.buckets[int(index)] = count
+        histogram.count = data['count']
+        histogram.total = data['total']
+        histogram.min = data['min']
+        histogram.max = data['max']
+        histogram.invalid = data.get('invalid', 0)
+        return histogram
+    from_llsd = classmethod(from_llsd)
+
+def merge_histograms(histograms):
+    """
+    Merges an iterable of LogLinearHistograms (or their to_llsd() maps)
+    into a new histogram.
+    """
+    result = None
+    for histogram in histograms:
+        if isinstance(histogram, dict):
+            histogram = LogLinearHistogram.from_llsd(histogram)
+        if result is None:
+            result = LogLinearHistogram(histogram.sub_buckets)
+        result.merge(histogram)
+    return result
@@ -0,0 +1,83 @@
+"""\
+@file histogram_test.py
+@brief Tests for the log-linear histogram.
+
+$LicenseInfo:firstyear=2009&license=mit$
+
+Copyright (c) 2009, Linden Research, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+$/LicenseInfo$
+"""
+
+import math
+import unittest
+
+from indra.util.histogram import LogLinearHistogram, merge_histograms
+
+class TestLogLinearHistogram(unittest.TestCase):
+    def test_bucket_boundaries(self):
+        histogram = LogLinearHistogram(4)
+        # [1, 2) is split into [1, 1.25), [1.25, 1.5), [1.5, 1.75), [1.75, 2)
+        for low, index in [(1.0, 4), (1.25, 5), (1.5, 6), (1.75, 7), (2.0, 8)]:
+            self.assertEquals(histogram._index(low), index)
+            self.assertEquals(histogram._index(low * (1 - 1e-12)), index - 1)
+        self.assertEquals(histogram._bucket_value(4), 1.125)
+        self.assertEquals(histogram._index(0), histogram._index(-3))
+        self.assertEquals(histogram._bucket_value(histogram._index(0)), 0)
+
+    def test_relative_error(self):
+        histogram = LogLinearHistogram(16)
+        for value in [1e-6, 0.3, 7, 1000, 123456789, 2 ** 60]:
+            middle = histogram._bucket_value(histogram._index(value))
+            self.assert_(abs(middle - value) / value <= 1.0 / 16)
+
+    def test_percentiles_and_merge(self):
+        first = LogLinearHistogram()
+        second = LogLinearHistogram()
+        for value in range(1, 51):
+            first.record(value)
+        for value in range(51, 101):
+            second.record(value)
+        merged = merge_histograms([first, second.to_llsd()])
+        self.assertEquals((merged.count, merged.min, merged.max), (100, 1, 100))
+        self.assertEquals(merged.mean(), 50.5)
+        p50, p99 = merged.percentiles([50, 99])
+        self.assert_(abs(p50 - 50) <= 50 / 16.0)
+        self.assert_(abs(p99 - 99) <= 99 / 16.0)
+        self.assertRaises(ValueError, first.merge, LogLinearHistogram(8))
+
+    def test_non_finite_values(self):
+        histogram = LogLinearHistogram()
+        histogram.record(float('nan'))
+        histogram.record(float('inf'), 2)
+        histogram.record(float('-inf'))
+        histogram.record(5)
+        self.assertEquals(histogram.invalid, 4)
+        self.assertEquals((histogram.count, histogram.total), (1, 5))
+        self.assertEquals((histogram.min, histogram.max), (5, 5))
+        summary = histogram.summary()
+        self.assertEquals(summary['invalid'], 4)
+        self.failIf(math.isnan(summary['mean']))
+        copy = LogLinearHistogram.from_llsd(histogram.to_llsd())
+        self.assertEquals(copy.invalid, 4)
+        self.assertEquals(merge_histograms([histogram, copy]).invalid, 8)
+
+if __name__ == '__main__':
+    unittest.main()
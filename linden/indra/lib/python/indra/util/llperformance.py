@@ -3,43 +3,277 @@
 # ------------------------------------------------
 # Sim metrics utility functions.
 
-import glob, os, time, sys, stat, exceptions
+import glob, os, time, sys, stat, exceptions, threading, mmap, struct
 
 from indra.base import llsd
+from indra.util.histogram import LogLinearHistogram, merge_histograms
 
 gBlockMap = {}              #Map of performance metric data with function hierarchy information.
-gCurrentStatPath = ""
 
 gIsLoggingEnabled=False
 
-class LLPerfStat:
+gLiveExport = None          #Shared-memory export of gBlockMap, if started.
+
+SIMPERF_PATH = "/dev/shm/simperf/"
+CONTROL_FILE = SIMPERF_PATH + "simperf_proc_config.llsd"
+
+def _find_monotonic_ns():
+    """
+    Returns a function reading a monotonic clock in nanoseconds: Python's
+    own if it has one, clock_gettime(CLOCK_MONOTONIC) through ctypes on
+    Linux, and time.time() as a last resort.
+    """
+    if hasattr(time, 'monotonic_ns'):
+        return time.monotonic_ns
+    try:
+        import ctypes, ctypes.util
+
+        class timespec(ctypes.Structure):
+            _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+        librt = ctypes.CDLL(ctypes.util.find_library('rt') or
+                            ctypes.util.find_library('c'))
+        clock_gettime = librt.clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+        CLOCK_MONOTONIC = 1
+
+        def monotonic_ns():
+            t = timespec()
+            clock_gettime(CLOCK_MONOTONIC, ctypes.byref(t))
+            return t.tv_sec * 1000000000 + t.tv_nsec
+
+        monotonic_ns()
+        return monotonic_ns
+    except (ImportError, OSError, AttributeError, TypeError):
+        def monotonic_ns():
+            return int(time.time() * 1000000000)
+        return monotonic_ns
+
+monotonic_ns = _find_monotonic_ns()
+
+# The current stat path is kept per thread, which with eventlet's
+# monkeypatched threading is also per greenlet.
+_local = threading.local()
+
+def _get_stat(path, key):
+    stat = gBlockMap.get(path)
+    if stat is None:
+        stat = gBlockMap.setdefault(path, LLPerfStat(key))
+        if gLiveExport is not None and stat.mSlot is None:
+            stat.mSlot = gLiveExport.allocate(path)
+    return stat
+
+# Layout of the live export file, <name>_proc.<pid>.shm:
+#   header: magic, version, slot count, slots in use, pid, start time (ms)
+#   slots, one per stat path: path, sequence, count, total/min/max ns
+# A writer makes the slot sequence odd while it updates a slot, so
+# readers retry until they see the same even sequence before and after
+# reading the values.
+_LIVE_MAGIC = 'LLPS'
+_LIVE_VERSION = 1
+_live_header = struct.Struct('<4sIIIIQ')
+_LIVE_HEADER_SIZE = 32
+_LIVE_PATH_SIZE = 192
+_live_sequence = struct.Struct('<Q')
+_live_values = struct.Struct('<QQQQ')
+_LIVE_SLOT_SIZE = 256
+_LIVE_USED_OFFSET = 12
+
+class _LiveExport(object):
+    def __init__(self, filename, slot_count):
+        self.filename = filename
+        self._slot_count = slot_count
+        self._used = 0
+        self._lock = threading.Lock()
+        size = _LIVE_HEADER_SIZE + slot_count * _LIVE_SLOT_SIZE
+        shared = open(filename, 'w+b')
+        try:
+            shared.truncate(size)
+            self._map = mmap.mmap(shared.fileno(), size)
+        finally:
+            shared.close()
+        _live_header.pack_into(self._map, 0, _LIVE_MAGIC, _LIVE_VERSION,
+                               slot_count, 0, os.getpid(),
+                               int(time.time() * 1000))
+
+    def allocate(self, path):
+        """
+        Returns the offset of a new slot for path, or None if all slots
+        are taken.
+        """
+        self._lock.acquire()
+        try:
+            if self._used >= self._slot_count:
+                return None
+            offset = _LIVE_HEADER_SIZE + self._used * _LIVE_SLOT_SIZE
+            self._map[offset:offset + _LIVE_PATH_SIZE] = \
+                path[:_LIVE_PATH_SIZE - 1].ljust(_LIVE_PATH_SIZE, '\0')
+            self._used += 1
+            struct.pack_into('<I', self._map, _LIVE_USED_OFFSET, self._used)
+            return offset
+        finally:
+            self._lock.release()
+
+    def update(self, offset, count, total, minimum, maximum):
+        shared_map = self._map
+        sequence_offset = offset + _LIVE_PATH_SIZE
+        sequence, = _live_sequence.unpack_from(shared_map, sequence_offset)
+        _live_sequence.pack_into(shared_map, sequence_offset, sequence + 1)
+        _live_values.pack_into(shared_map, sequence_offset + 8,
+                               count, total, minimum, maximum)
+        _live_sequence.pack_into(shared_map, sequence_offset, sequence + 2)
+
+    def close(self):
+        self._map.close()
+        try:
+            os.unlink(self.filename)
+        except OSError:
+            pass
+
+# Reads of a slot that is being written are retried this many times.
+LIVE_READ_RETRIES = 100
+
+def read_live_stats(filename):
+    """
+    Reads a live export file while its process keeps running.  Returns
+    (info, block map) where the block map has, per stat path, 'count',
+    'us', 'min_us' and 'max_us'.  A slot still mid-update after
+    LIVE_READ_RETRIES tries, as when its writer died while updating it,
+    is left out and its path listed in info['stale'].
+    """
+    shared = open(filename, 'rb')
+    try:
+        shared_map = mmap.mmap(shared.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        shared.close()
+    try:
+        magic, version, slot_count, used, pid, timestamp = \
+               _live_header.unpack_from(shared_map, 0)
+        if magic != _LIVE_MAGIC or version != _LIVE_VERSION:
+            raise ValueError("%s is not a live performance file" % filename)
+        info = {'pid': pid, 'timestamp': timestamp, 'stale': []}
+        block_map = {}
+        for slot in xrange(min(used, slot_count)):
+            offset = _LIVE_HEADER_SIZE + slot * _LIVE_SLOT_SIZE
+            path = shared_map[offset:offset + _LIVE_PATH_SIZE].rstrip('\0')
+            sequence_offset = offset + _LIVE_PATH_SIZE
+            for attempt in xrange(LIVE_READ_RETRIES):
+                before, = _live_sequence.unpack_from(shared_map, sequence_offset)
+                values = _live_values.unpack_from(shared_map, sequence_offset + 8)
+                after, = _live_sequence.unpack_from(shared_map, sequence_offset)
+                if before == after and not before & 1:
+                    break
+                time.sleep(0)
+            else:
+                info['stale'].append(path)
+                continue
+            count, total, minimum, maximum = values
+            block_map[path] = {'count': count,
+                               'us': total // 1000,
+                               'min_us': minimum / 1000.0,
+                               'max_us': maximum / 1000.0}
+        return info, block_map
+    finally:
+        shared_map.close()
+
+# Durations are kept in microseconds in the histograms, matching the
+# 'us' totals; 8 sub-buckets per power of two keeps them within ~6%.
+HISTOGRAM_SUB_BUCKETS = 8
+
+class LLPerfStat(object):
     def __init__(self,key):
-        self.mTotalTime = 0
+        self.mTotalTime = 0     # nanoseconds
         self.mNumRuns = 0
+        self.mHistogram = LogLinearHistogram(HISTOGRAM_SUB_BUCKETS)
+        self.mMinTime = 0       # nanoseconds
+        self.mMaxTime = 0       # nanoseconds
+        self.mSlot = None       # offset in gLiveExport
         self.mName=key
         self.mTimeStamp = int(time.time()*1000)
         self.mUTCTime = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        self._lock = threading.Lock()
 
     def __str__(self):
         return "%f" %  self.mTotalTime
 
+    def record(self, elapsed_ns):
+        self._lock.acquire()
+        try:
+            self.mTotalTime += elapsed_ns
+            self.mNumRuns += 1
+            self.mHistogram.record(elapsed_ns / 1000.0)
+            if elapsed_ns < self.mMinTime or self.mNumRuns == 1:
+                self.mMinTime = elapsed_ns
+            if elapsed_ns > self.mMaxTime:
+                self.mMaxTime = elapsed_ns
+            if self.mSlot is not None and gLiveExport is not None:
+                gLiveExport.update(self.mSlot, self.mNumRuns, self.mTotalTime,
+                                   self.mMinTime, self.mMaxTime)
+        finally:
+            self._lock.release()
+
+    # start/stop time a single caller at a time; concurrent callers
+    # should go through LLPerfBlock, which keeps its own start time.
     def start(self):
-        self.mStartTime = int(time.time() * 1000000)
-        self.mNumRuns += 1
+        self.mStartTime = monotonic_ns()
 
     def stop(self):
-        execution_time = int(time.time() * 1000000) - self.mStartTime
-        self.mTotalTime += execution_time
+        self.record(monotonic_ns() - self.mStartTime)
 
     def get_map(self):
         results={}
         results['name']=self.mName
         results['utc_time']=self.mUTCTime
         results['timestamp']=self.mTimeStamp
-        results['us']=self.mTotalTime
+        results['us']=self.mTotalTime // 1000
         results['count']=self.mNumRuns
+        results['min_us']=self.mHistogram.min
+        results['max_us']=self.mHistogram.max
+        results['histogram']=self.mHistogram.to_llsd()
         return results
 
+def merge_block_maps(block_maps):
+    """
+    Combines block maps (path -> LLPerfStat.get_map() result) from
+    several processes or intervals into one, summing totals and counts
+    and merging the histograms.
+    """
+    merged = {}
+    for block_map in block_maps:
+        for path, stats in block_map.iteritems():
+            if path not in merged:
+                merged[path] = (stats, [stats])
+            else:
+                merged[path][1].append(stats)
+    result = {}
+    for path, (first, all_stats) in merged.iteritems():
+        combined = {'name': first['name'],
+                    'utc_time': first['utc_time'],
+                    'timestamp': min([s['timestamp'] for s in all_stats]),
+                    'us': sum([s['us'] for s in all_stats]),
+                    'count': sum([s['count'] for s in all_stats])}
+        histograms = [s['histogram'] for s in all_stats if 'histogram' in s]
+        if histograms:
+            histogram = merge_histograms(histograms)
+            combined['min_us'] = histogram.min
+            combined['max_us'] = histogram.max
+            combined['histogram'] = histogram.to_llsd()
+        result[path] = combined
+    return result
+
+def block_percentiles(stats, percentiles=(50, 95, 99, 99.9)):
+    """
+    Returns {'p50': ..., 'p95': ..., ...} in microseconds for one entry
+    of a block map, or None if it has no histogram.
+    """
+    if 'histogram' not in stats:
+        return None
+    histogram = LogLinearHistogram.from_llsd(stats['histogram'])
+    summary = {}
+    for percent, value in zip(percentiles, histogram.percentiles(percentiles)):
+        summary['p%s' % ('%g' % percent)] = value
+    return summary
+
 class PerfError(exceptions.Exception):
     def __init__(self):
         return
@@ -47,37 +281,109 @@ class PerfError(exceptions.Exception):
     def __Str__(self):
         print "","Unfinished LLPerfBlock"
 
-class LLPerfBlock:
-    def __init__( self, key ):
-        global gBlockMap
-        global gCurrentStatPath
-        global gIsLoggingEnabled
+class LLPerfBlock(object):
+    """
+    Times a block of code under the stat path of the blocks enclosing
+    it in the same thread.  Either call finish() or use it as a 'with'
+    block.  When logging is disabled it does nothing; use perf_block()
+    to avoid even allocating the block in that case.
+    """
+    __slots__ = ('mRunning', 'mPreviousStatPath', 'mStat', 'mStartTime')
 
+    def __init__( self, key ):
+        self.mRunning = False
         #Check to see if we're running metrics right now.
         if gIsLoggingEnabled:
             self.mRunning = True        #Mark myself as running.
-    
-            self.mPreviousStatPath = gCurrentStatPath
-            gCurrentStatPath += "/" + key
-            if gCurrentStatPath not in gBlockMap:
-                gBlockMap[gCurrentStatPath] = LLPerfStat(key)
 
-            self.mStat = gBlockMap[gCurrentStatPath]
-            self.mStat.start()
-    
-    def finish( self ):
-        global gBlockMap
-        global gIsLoggingEnabled
+            previous = getattr(_local, 'path', "")
+            self.mPreviousStatPath = previous
+            path = previous + "/" + key
+            _local.path = path
+            self.mStat = _get_stat(path, key)
+            self.mStartTime = monotonic_ns()
 
-        if gIsLoggingEnabled:
-            self.mStat.stop()
+    def finish( self ):
+        if self.mRunning:
+            self.mStat.record(monotonic_ns() - self.mStartTime)
             self.mRunning = False
-            gCurrentStatPath = self.mPreviousStatPath
+            _local.path = self.mPreviousStatPath
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.finish()
+        return False
+
+class _NullPerfBlock(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def finish(self):
+        pass
+
+_null_block = _NullPerfBlock()
+
+def perf_block(key):
+    """
+    Returns a block for 'with perf_block(key):'.  When logging is
+    disabled this is a shared do-nothing block, so the cost is one flag
+    check.
+    """
+    if not gIsLoggingEnabled:
+        return _null_block
+    return LLPerfBlock(key)
+
+def perf_timed(key=None):
+    """
+    Decorator timing every call of a function as an LLPerfBlock named
+    key (default: the function's name).
+    """
+    def decorate(function):
+        name = key or function.__name__
+
+        def timed(*args, **kwargs):
+            if not gIsLoggingEnabled:
+                return function(*args, **kwargs)
+            block = LLPerfBlock(name)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                block.finish()
+        timed.__name__ = function.__name__
+        timed.__doc__ = function.__doc__
+        return timed
+    return decorate
+
+def control_enabled():
+    """
+    True if the simperf control file exists and is younger than the
+    duration it asks for.
+    """
+    #If file exists, open
+    if not os.path.exists(CONTROL_FILE):
+        return False
+
+    file = open (CONTROL_FILE,'r')
+    try:
+        #Read serialized LLSD from file.
+        body = llsd.parse(file.read())
+    finally:
+        file.close()
 
-#    def __del__( self ):
-#        if self.mRunning:
-#            #SPATTERS FIXME
-#            raise PerfError
+    #Calculate time since file last modified.
+    stats = os.stat(CONTROL_FILE)
+    now = time.time()
+    mod = stats[stat.ST_MTIME]
+    age = now - mod
+
+    return age < ( body['duration'] )
 
 class LLPerformance:
     #--------------------------------------------------
@@ -85,6 +391,9 @@ class LLPerformance:
 
     def __init__( self, process_name = "python" ):
         self.process_name = process_name
+        self._live = False
+        self._control_lock = threading.Lock()
+        self._control_thread = None
         self.init_testing()
         self.mTimeStamp = int(time.time()*1000)
         self.mUTCTime = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
@@ -92,24 +401,76 @@ class LLPerformance:
     def init_testing( self ):
         global gIsLoggingEnabled
 
-        host_performance_file = "/dev/shm/simperf/simperf_proc_config.llsd"
-    
-        #If file exists, open
-        if os.path.exists(host_performance_file):
-            file = open (host_performance_file,'r')
-    
-            #Read serialized LLSD from file.
-            body = llsd.parse(file.read())
-    
-            #Calculate time since file last modified.
-            stats = os.stat(host_performance_file)
-            now = time.time()
-            mod = stats[stat.ST_MTIME]
-            age = now - mod
-    
-            if age < ( body['duration'] ):
-                gIsLoggingEnabled = True
-    
+        if control_enabled():
+            gIsLoggingEnabled = True
+
+    def start_live( self, check_interval = 5, slot_count = 1024 ):
+        """
+        Export gBlockMap counters through a shared-memory file that
+        simperf collectors can read at any time (see read_live_stats),
+        and re-read the control file every check_interval seconds so
+        that profiling follows its duration window.
+        """
+        global gLiveExport
+
+        if gLiveExport is None and os.path.isdir(SIMPERF_PATH):
+            gLiveExport = _LiveExport(
+                "%s%s_proc.%d.shm" % (SIMPERF_PATH, self.process_name, os.getpid()),
+                slot_count)
+            for path, stat in gBlockMap.items():
+                stat._lock.acquire()
+                try:
+                    if stat.mSlot is None:
+                        stat.mSlot = gLiveExport.allocate(path)
+                    if stat.mSlot is not None:
+                        gLiveExport.update(stat.mSlot, stat.mNumRuns, stat.mTotalTime,
+                                           stat.mMinTime, stat.mMaxTime)
+                finally:
+                    stat._lock.release()
+
+        self._control_lock.acquire()
+        try:
+            self._live = True
+            if self._control_thread is not None:
+                # still running; it carries on now that _live is set
+                return
+            self._control_thread = threading.Thread(
+                target=self._check_control, args=(check_interval,),
+                name='LLPerformanceControl')
+            self._control_thread.setDaemon(True)
+            self._control_thread.start()
+        finally:
+            self._control_lock.release()
+
+    def _check_control( self, check_interval ):
+        global gIsLoggingEnabled
+
+        # keep a local reference; module globals are cleared during
+        # interpreter shutdown while this daemon thread may still run
+        sleep = time.sleep
+        while True:
+            self._control_lock.acquire()
+            try:
+                if not self._live:
+                    self._control_thread = None
+                    return
+            finally:
+                self._control_lock.release()
+            try:
+                gIsLoggingEnabled = control_enabled()
+            except Exception:
+                pass
+            sleep(check_interval)
+
+    def stop_live( self ):
+        global gLiveExport
+
+        self._live = False
+        if gLiveExport is not None:
+            gLiveExport.close()
+            gLiveExport = None
+            for stat in gBlockMap.values():
+                stat.mSlot = None
 
     def get ( self ):
         global gIsLoggingEnabled
@@ -135,10 +496,11 @@ class LLPerformance:
     def done(self):
         global gBlockMap
 
-        if not self.get():
+        # the control window may have closed since these were collected
+        if not self.get() and not gBlockMap:
             return
 
-        output_name = "/dev/shm/simperf/%s_proc.%d.llsd" % (self.process_name, os.getpid())
+        output_name = "%s%s_proc.%d.llsd" % (SIMPERF_PATH, self.process_name, os.getpid())
         output_file = open(output_name, 'w')
         process_info = {
             "name"  :   self.process_name,
@@ -150,9 +512,10 @@ class LLPerformance:
         output_file.write(llsd.format_notation(process_info))
         output_file.write('\n')
 
-        for key in gBlockMap.keys():
-            gBlockMap[key] = gBlockMap[key].get_map()
-        output_file.write(llsd.format_notation(gBlockMap))
+        block_map = {}
+        for key, stat in gBlockMap.items():
+            block_map[key] = stat.get_map()
+        output_file.write(llsd.format_notation(block_map))
         output_file.write('\n')
         output_file.close()
 
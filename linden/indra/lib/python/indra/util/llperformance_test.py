@@ -0,0 +1,147 @@
+"""\
+@file llperformance_test.py
+@brief Tests for the live shared-memory stats export.
+
+$LicenseInfo:firstyear=2009&license=mit$
+
+Copyright (c) 2009, Linden Research, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+$/LicenseInfo$
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from indra.base import llsd
+from indra.util import llperformance
+
+def _control_threads():
+    return [thread for thread in threading.enumerate()
+            if thread.getName() == 'LLPerformanceControl']
+
+class TestLiveStats(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.export = llperformance._LiveExport(
+            os.path.join(self.dir, 'test_proc.1.shm'), 4)
+
+    def tearDown(self):
+        self.export.close()
+        shutil.rmtree(self.dir)
+
+    def test_read(self):
+        first = self.export.allocate('/frame')
+        second = self.export.allocate('/frame/physics')
+        self.export.update(first, 3, 6000000, 1000000, 3000000)
+        self.export.update(second, 1, 2500, 2500, 2500)
+        info, block_map = llperformance.read_live_stats(self.export.filename)
+        self.assertEquals(info['pid'], os.getpid())
+        self.assertEquals(info['stale'], [])
+        self.assertEquals(block_map['/frame'],
+                          {'count': 3, 'us': 6000, 'min_us': 1000.0,
+                           'max_us': 3000.0})
+        self.assertEquals(block_map['/frame/physics']['us'], 2)
+        self.assertEquals(block_map['/frame/physics']['min_us'], 2.5)
+
+    def test_slots_run_out(self):
+        for i in range(4):
+            self.assertNotEquals(self.export.allocate('/%d' % i), None)
+        self.assertEquals(self.export.allocate('/more'), None)
+
+    def test_writer_died_mid_update(self):
+        good = self.export.allocate('/good')
+        dead = self.export.allocate('/dead')
+        self.export.update(good, 1, 1000, 1000, 1000)
+        self.export.update(dead, 1, 1000, 1000, 1000)
+        # leave the sequence odd, as a writer killed inside update() would
+        sequence_offset = dead + llperformance._LIVE_PATH_SIZE
+        sequence, = llperformance._live_sequence.unpack_from(
+            self.export._map, sequence_offset)
+        llperformance._live_sequence.pack_into(self.export._map,
+                                               sequence_offset, sequence + 1)
+        info, block_map = llperformance.read_live_stats(self.export.filename)
+        self.assertEquals(block_map.keys(), ['/good'])
+        self.assertEquals(info['stale'], ['/dead'])
+
+    def test_not_a_live_file(self):
+        name = os.path.join(self.dir, 'other.shm')
+        open(name, 'wb').write('\0' * 64)
+        self.assertRaises(ValueError, llperformance.read_live_stats, name)
+
+class TestLLPerformance(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.saved = (llperformance.SIMPERF_PATH, llperformance.CONTROL_FILE,
+                      llperformance.gBlockMap,
+                      llperformance.gIsLoggingEnabled)
+        llperformance.SIMPERF_PATH = self.dir + '/'
+        # no control file, so profiling is off unless a test turns it on
+        llperformance.CONTROL_FILE = os.path.join(self.dir, 'control.llsd')
+        llperformance.gBlockMap = {}
+
+    def tearDown(self):
+        (llperformance.SIMPERF_PATH, llperformance.CONTROL_FILE,
+         llperformance.gBlockMap, llperformance.gIsLoggingEnabled) = self.saved
+        shutil.rmtree(self.dir)
+
+    def output(self):
+        name = os.path.join(self.dir, 'test_proc.%d.llsd' % os.getpid())
+        if not os.path.exists(name):
+            return None
+        lines = open(name).read().splitlines()
+        return llsd.parse(lines[0]), llsd.parse(lines[1])
+
+    def test_done_after_window_closed(self):
+        perf = llperformance.LLPerformance('test')
+        llperformance.gIsLoggingEnabled = True
+        llperformance._get_stat('/frame', 'frame').record(2000000)
+        # the control thread turned logging off again
+        llperformance.gIsLoggingEnabled = False
+        perf.done()
+        info, block_map = self.output()
+        self.assertEquals(info['name'], 'test')
+        self.assertEquals(block_map['/frame']['count'], 1)
+        self.assertEquals(block_map['/frame']['us'], 2000)
+
+    def test_done_without_data(self):
+        llperformance.LLPerformance('test').done()
+        self.assertEquals(self.output(), None)
+
+    def test_one_control_thread(self):
+        before = len(_control_threads())
+        perf = llperformance.LLPerformance('test')
+        perf.start_live(check_interval=0.05)
+        perf.start_live(check_interval=0.05)
+        self.assertEquals(len(_control_threads()), before + 1)
+        perf.stop_live()
+        perf.start_live(check_interval=0.05)
+        self.assertEquals(len(_control_threads()), before + 1)
+        perf.stop_live()
+        deadline = time.time() + 5
+        while len(_control_threads()) > before and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEquals(len(_control_threads()), before)
+
+if __name__ == '__main__':
+    unittest.main()
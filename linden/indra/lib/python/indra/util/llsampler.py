@@ -0,0 +1,200 @@
+#!/usr/bin/python
+
+# ------------------------------------------------
+# Statistical sampling profiler for python processes.  A background
+# thread periodically reads every other thread's stack from
+# sys._current_frames() and counts how often each call path is seen.
+# The counts are written as /dev/shm/simperf/<name>_proc.<pid>.llsd in
+# the same layout as llperformance, so simperf_proc_interface and the
+# other simperf readers consume them without changes.  Sampling follows
+# the duration window of simperf_proc_config.llsd, like LLPerfBlock.
+
+import os, sys, time, threading, atexit
+
+from indra.base import llsd
+from indra.util import llperformance
+
+DEFAULT_INTERVAL = 0.01     # seconds between samples
+DEFAULT_MAX_DEPTH = 64      # frames kept per stack, innermost dropped
+
+class SamplingProfiler(object):
+    """
+    Samples python stacks of all threads but its own.  Each stat path is
+    the chain of 'module:function' labels from the outermost frame, and
+    like nested LLPerfBlocks a path's count includes the samples of its
+    children.  'us' is an estimate: samples times the sampling interval.
+    """
+    def __init__(self, process_name = "pysample", interval = DEFAULT_INTERVAL,
+                 max_depth = DEFAULT_MAX_DEPTH, check_interval = 5,
+                 path = None):
+        self.process_name = process_name
+        self.interval = interval
+        self.max_depth = max_depth
+        self.check_interval = check_interval
+        self.path = path or llperformance.SIMPERF_PATH
+        self.mTimeStamp = int(time.time()*1000)
+        self.mUTCTime = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        self._stacks = {}       # tuple of code objects -> samples
+        self._labels = {}       # code object -> 'module:function'
+        self._samples = 0
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run,
+                                        name='SamplingProfiler')
+        self._thread.setDaemon(True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """
+        Stops sampling and writes what has been collected.
+        """
+        if not self._running:
+            return
+        self._running = False
+        if self._thread is not threading.currentThread():
+            self._thread.join()
+        self.write()
+
+    def _run(self):
+        # keep local references; module globals are cleared during
+        # interpreter shutdown while this daemon thread may still run
+        sleep = time.sleep
+        now = time.time
+        current_frames = sys._current_frames
+        enabled = llperformance.control_enabled
+        sample = self.sample
+        own_id = threading.currentThread().ident
+
+        active = False
+        next_check = 0
+        while self._running:
+            if now() >= next_check:
+                was_active = active
+                try:
+                    active = enabled()
+                except Exception:
+                    # a control file being written or malformed
+                    active = False
+                next_check = now() + self.check_interval
+                if was_active and not active:
+                    # the duration window closed
+                    self.write()
+            if active:
+                sample(current_frames(), own_id)
+                sleep(self.interval)
+            else:
+                sleep(max(0, next_check - now()))
+
+    def sample(self, frames, skip_id = None):
+        """
+        Counts one sample of each thread's stack in frames, as returned
+        by sys._current_frames().
+        """
+        max_depth = self.max_depth
+        stacks = self._stacks
+        self._lock.acquire()
+        try:
+            for thread_id, frame in frames.iteritems():
+                if thread_id == skip_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+                stack.reverse()
+                stack = tuple(stack[:max_depth])
+                stacks[stack] = stacks.get(stack, 0) + 1
+            self._samples += 1
+        finally:
+            self._lock.release()
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            module = os.path.splitext(os.path.basename(code.co_filename))[0]
+            label = "%s:%s" % (module, code.co_name)
+            self._labels[code] = label
+        return label
+
+    def get_block_map(self):
+        """
+        Returns the samples as a block map, path -> stat map, with the
+        same keys LLPerfStat.get_map() uses.
+        """
+        self._lock.acquire()
+        try:
+            stacks = self._stacks.items()
+        finally:
+            self._lock.release()
+
+        counts = {}
+        for stack, samples in stacks:
+            path = ''
+            for code in stack:
+                path = path + '/' + self._label(code)
+                counts[path] = counts.get(path, 0) + samples
+
+        interval_us = int(self.interval * 1000000)
+        block_map = {}
+        for path, samples in counts.iteritems():
+            block_map[path] = {
+                'name'      :   path[path.rindex('/') + 1:],
+                'utc_time'  :   self.mUTCTime,
+                'timestamp' :   self.mTimeStamp,
+                'us'        :   samples * interval_us,
+                'count'     :   samples,
+                }
+        return block_map
+
+    def write(self):
+        """
+        Writes <name>_proc.<pid>.llsd in the llperformance layout.
+        Nothing is written before the first sample.
+        """
+        if not self._samples or not os.path.isdir(self.path):
+            return
+        output_name = "%s%s_proc.%d.llsd" % (self.path, self.process_name, os.getpid())
+        process_info = {
+            "name"  :   self.process_name,
+            "pid"   :   os.getpid(),
+            "ppid"  :   os.getppid(),
+            "timestamp" :   self.mTimeStamp,
+            "utc_time"  :   self.mUTCTime,
+            "samples"   :   self._samples,
+            "interval_us" : int(self.interval * 1000000),
+            }
+        # write a temporary file and rename it so readers never see a
+        # partial one
+        tmp_name = output_name + '.tmp'
+        output_file = open(tmp_name, 'w')
+        try:
+            output_file.write(llsd.format_notation(process_info))
+            output_file.write('\n')
+            output_file.write(llsd.format_notation(self.get_block_map()))
+            output_file.write('\n')
+        finally:
+            output_file.close()
+        os.rename(tmp_name, output_name)
+
+_profiler = None
+
+def start(process_name = "pysample", interval = DEFAULT_INTERVAL):
+    """
+    Starts the process-wide sampling profiler.
+    """
+    global _profiler
+    if _profiler is None:
+        _profiler = SamplingProfiler(process_name, interval)
+    _profiler.start()
+    return _profiler
+
+def stop():
+    if _profiler is not None:
+        _profiler.stop()
@@ -0,0 +1,145 @@
+"""\
+@file llsampler_test.py
+@brief Tests for the sampling profiler.
+
+$LicenseInfo:firstyear=2009&license=mit$
+
+Copyright (c) 2009, Linden Research, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+$/LicenseInfo$
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+from indra.base import llsd
+from indra.util import llperformance, llsampler
+
+class _Code(object):
+    def __init__(self, filename, name):
+        self.co_filename = filename
+        self.co_name = name
+
+class _Frame(object):
+    def __init__(self, code, back=None):
+        self.f_code = code
+        self.f_back = back
+
+def _stack(*codes):
+    "The innermost frame of a stack calling codes, outermost first."
+    frame = None
+    for code in codes:
+        frame = _Frame(code, frame)
+    return frame
+
+main = _Code('/usr/lib/python/app/server.py', 'main')
+handle = _Code('/usr/lib/python/app/server.py', 'handle')
+query = _Code('/usr/lib/python/app/db.py', 'query')
+wait = _Code('/usr/lib/python/threading.py', 'wait')
+
+class TestSamplingProfiler(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.profiler = llsampler.SamplingProfiler(
+            'test', interval=0.01, path=self.dir + '/')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_block_map(self):
+        profiler = self.profiler
+        for i in xrange(3):
+            profiler.sample({1: _stack(main, handle, query),
+                             2: _stack(wait),
+                             3: _stack(main, handle)}, skip_id=2)
+        profiler.sample({1: _stack(main, handle, query), 2: _stack(wait)})
+        block_map = profiler.get_block_map()
+        self.assertEquals(sorted(block_map.keys()),
+                          ['/server:main', '/server:main/server:handle',
+                           '/server:main/server:handle/db:query',
+                           '/threading:wait'])
+        # a path counts the samples of its children
+        self.assertEquals(block_map['/server:main']['count'], 7)
+        self.assertEquals(block_map['/server:main/server:handle']['count'], 7)
+        query_stats = block_map['/server:main/server:handle/db:query']
+        self.assertEquals(query_stats['count'], 4)
+        self.assertEquals(query_stats['us'], 40000)
+        self.assertEquals(query_stats['name'], 'db:query')
+        self.assertEquals(block_map['/threading:wait']['count'], 1)
+
+    def test_max_depth(self):
+        self.profiler.max_depth = 2
+        self.profiler.sample({1: _stack(main, handle, query)})
+        self.assertEquals(sorted(self.profiler.get_block_map().keys()),
+                          ['/server:main', '/server:main/server:handle'])
+
+    def test_write(self):
+        self.profiler.write()
+        self.assertEquals(os.listdir(self.dir), [])
+        self.profiler.sample({1: _stack(main, handle)})
+        self.profiler.sample(sys._current_frames())
+        self.profiler.write()
+        name = 'test_proc.%d.llsd' % os.getpid()
+        self.assertEquals(os.listdir(self.dir), [name])
+        lines = open(os.path.join(self.dir, name)).read().splitlines()
+        info = llsd.parse(lines[0])
+        self.assertEquals(info['name'], 'test')
+        self.assertEquals(info['samples'], 2)
+        self.assertEquals(info['interval_us'], 10000)
+        block_map = llsd.parse(lines[1])
+        self.assertEquals(block_map['/server:main/server:handle']['count'], 1)
+        # this thread's real stack was sampled too
+        self.assert_([path for path in block_map
+                      if path.endswith('/llsampler_test:test_write')])
+
+    def wait_for(self, condition):
+        deadline = time.time() + 10
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+        return condition()
+
+    def test_control_file(self):
+        control_file = llperformance.CONTROL_FILE
+        llperformance.CONTROL_FILE = os.path.join(self.dir, 'control.llsd')
+        profiler = self.profiler
+        profiler.check_interval = 0.01
+        try:
+            for body in ("{'duration':", "{'interval':i60}"):
+                open(llperformance.CONTROL_FILE, 'w').write(body)
+                profiler.start()
+                time.sleep(0.1)
+                self.assert_(profiler._thread.isAlive())
+                self.assertEquals(profiler._samples, 0)
+                profiler.stop()
+            open(llperformance.CONTROL_FILE, 'w').write("{'duration':i60}")
+            profiler.start()
+            self.assert_(self.wait_for(lambda: profiler._samples > 0))
+            profiler.stop()
+        finally:
+            llperformance.CONTROL_FILE = control_file
+        self.assertEquals(os.listdir(self.dir).count(
+            'test_proc.%d.llsd' % os.getpid()), 1)
+
+if __name__ == '__main__':
+    unittest.main()
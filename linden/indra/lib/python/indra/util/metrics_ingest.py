@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+"""\
+@file metrics_ingest.py
+@brief Parallel aggregation of LLMETRICS log lines.
+
+$LicenseInfo:firstyear=2009&license=mit$
+
+Copyright (c) 2009, Linden Research, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+$/LicenseInfo$
+"""
+
+import csv
+import getopt
+import os
+import re
+import sys
+
+from indra.base import llsd
+from indra.util.histogram import LogLinearHistogram
+
+DEFAULT_CHUNK_SIZE = 16 * 1024 * 1024
+DEFAULT_PERCENTILES = (50, 90, 99)
+
+_metrics_line_re = re.compile(r'LLMETRICS \((\d+)\) (\S+) (.*)$')
+
+def usage():
+    print "Usage:"
+    print sys.argv[0] + " [options] LOGFILE..."
+    print "  Summarize the LLMETRICS lines in metrics or syslog output.  Files"
+    print "  are split into chunks at line boundaries and parsed in parallel."
+    print "  For every table, reports the number of rows and, for every numeric"
+    print "  key (nested maps are flattened with '.'), the count, sum, min, max,"
+    print "  mean and percentiles of its values."
+    print
+    print "Options:"
+    print "  -j, --jobs      Worker processes.  (Default:  number of CPUs)"
+    print "  -c, --chunk     Chunk size in MB.  (Default:  %d)" % (DEFAULT_CHUNK_SIZE >> 20)
+    print "  -f, --format    Output format, llsd or csv.  (Default:  llsd)"
+    print "  -o, --out       Output filename.  (Default:  stdout)"
+    print "  -h, --help      Print this message and exit."
+    print
+    print "Interfaces:"
+    print "   def ingest(paths, ...)          # returns {table: TableSummary}"
+    print "   def format_llsd(tables) / write_csv(tables, file)"
+
+class TableSummary(object):
+    """
+    Row count and per-key value histograms for one LLMETRICS table.
+    Memory depends on the number of distinct keys, not on the number of
+    rows.
+    """
+    def __init__(self):
+        self.rows = 0
+        self.keys = {}
+
+    def add(self, stats, prefix=''):
+        for key, value in stats.iteritems():
+            if isinstance(value, dict):
+                self.add(value, prefix + key + '.')
+            elif isinstance(value, (int, long, float)) \
+                     and not isinstance(value, bool):
+                histogram = self.keys.get(prefix + key)
+                if histogram is None:
+                    histogram = self.keys[prefix + key] = LogLinearHistogram()
+                histogram.record(value)
+
+    def merge(self, other):
+        self.rows += other.rows
+        for key, histogram in other.keys.iteritems():
+            if key in self.keys:
+                self.keys[key].merge(histogram)
+            else:
+                self.keys[key] = histogram
+        return self
+
+    def summary(self, percentiles=DEFAULT_PERCENTILES):
+        keys = {}
+        for key, histogram in self.keys.iteritems():
+            keys[key] = histogram.summary(percentiles)
+            keys[key]['sum'] = histogram.total
+        return {'rows': self.rows, 'keys': keys}
+
+def _merge_tables(into, tables):
+    for table, summary in tables.iteritems():
+        if table in into:
+            into[table].merge(summary)
+        else:
+            into[table] = summary
+    return into
+
+def ingest_lines(lines, tables=None):
+    """
+    Adds the LLMETRICS records in lines to tables, a dict of table name
+    to TableSummary, and returns it.
+    """
+    if tables is None:
+        tables = {}
+    search = _metrics_line_re.search
+    parse = llsd.parse_notation
+    for line in lines:
+        if 'LLMETRICS' not in line:
+            continue
+        match = search(line)
+        if match is None:
+            continue
+        try:
+            stats = parse(match.group(3).strip())
+        except Exception:
+            continue
+        table = match.group(2)
+        summary = tables.get(table)
+        if summary is None:
+            summary = tables[table] = TableSummary()
+        summary.rows += 1
+        if isinstance(stats, dict):
+            summary.add(stats)
+    return tables
+
+def _chunks(path, chunk_size):
+    """
+    Splits a file into (path, start, end) ranges of about chunk_size
+    bytes, each ending at a line boundary.
+    """
+    size = os.path.getsize(path)
+    chunks = []
+    source = open(path, 'rb')
+    try:
+        start = 0
+        while start < size:
+            end = start + chunk_size
+            if end >= size:
+                end = size
+            else:
+                source.seek(end)
+                source.readline()
+                end = source.tell()
+            chunks.append((path, start, end))
+            start = end
+    finally:
+        source.close()
+    return chunks
+
+def _ingest_chunk(chunk):
+    path, start, end = chunk
+    source = open(path, 'rb')
+    try:
+        source.seek(start)
+        data = source.read(end - start)
+    finally:
+        source.close()
+    return ingest_lines(data.splitlines())
+
+def ingest(paths, processes=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Summarizes the LLMETRICS lines in the files at paths and returns a
+    dict of table name to TableSummary.  Chunks of the files are parsed
+    by a pool of processes worker processes (default: one per CPU); with
+    processes=1 everything is parsed in this process.
+    """
+    chunks = []
+    for path in paths:
+        chunks.extend(_chunks(path, chunk_size))
+
+    tables = {}
+    if processes == 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            _merge_tables(tables, _ingest_chunk(chunk))
+        return tables
+
+    import multiprocessing
+    pool = multiprocessing.Pool(processes)
+    try:
+        for chunk_tables in pool.imap_unordered(_ingest_chunk, chunks):
+            _merge_tables(tables, chunk_tables)
+    finally:
+        pool.close()
+        pool.join()
+    return tables
+
+def format_llsd(tables, percentiles=DEFAULT_PERCENTILES):
+    summary = {}
+    for table, table_summary in tables.iteritems():
+        summary[table] = table_summary.summary(percentiles)
+    return llsd.format_pretty_xml(summary)
+
+def write_csv(tables, output, percentiles=DEFAULT_PERCENTILES):
+    percentile_names = ['p%s' % ('%g' % p) for p in percentiles]
+    writer = csv.writer(output)
+    writer.writerow(['table', 'rows', 'key', 'count', 'sum', 'min', 'max',
+                     'mean'] + percentile_names)
+    table_names = tables.keys()
+    table_names.sort()
+    for table in table_names:
+        summary = tables[table].summary(percentiles)
+        keys = summary['keys'].keys()
+        keys.sort()
+        for key in keys:
+            stats = summary['keys'][key]
+            writer.writerow([table, summary['rows'], key, stats['count'],
+                             stats['sum'], stats['min'], stats['max'],
+                             stats['mean']] +
+                            [stats[name] for name in percentile_names])
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    opts, args = getopt.getopt(argv, "j:c:f:o:h",
+                               ["jobs=", "chunk=", "format=", "out=", "help"])
+    processes = None
+    chunk_size = DEFAULT_CHUNK_SIZE
+    output_format = 'llsd'
+    output_file = sys.stdout
+    for o, a in opts:
+        if o in ("-j", "--jobs"):
+            processes = int(a)
+        if o in ("-c", "--chunk"):
+            chunk_size = int(a) << 20
+        if o in ("-f", "--format"):
+            output_format = a
+        if o in ("-o", "--out"):
+            output_file = open(a, 'w')
+        if o in ("-h", "--help"):
+            usage()
+            return 0
+    if not args or output_format not in ('llsd', 'csv'):
+        usage()
+        return 1
+
+    tables = ingest(args, processes, chunk_size)
+    if output_format == 'csv':
+        write_csv(tables, output_file)
+    else:
+        print >>output_file, format_llsd(tables)
+    if output_file != sys.stdout:
+        output_file.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
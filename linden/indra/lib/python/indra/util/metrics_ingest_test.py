@@ -0,0 +1,117 @@
+"""\
+@file metrics_ingest_test.py
+@brief Test cases for LLMETRICS log ingestion.
+
+$LicenseInfo:firstyear=2009&license=mit$
+
+Copyright (c) 2009, Linden Research, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+$/LicenseInfo$
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from cStringIO import StringIO
+
+from indra.util import metrics_ingest
+
+def _log_lines(count):
+    lines = []
+    for i in xrange(count):
+        lines.append("Oct 19 05:58:06 sim%d simulator: LLMETRICS (%d) sim "
+                     "{'fps':r%d,'agents':i%d,'mem':{'rss':i%d},"
+                     "'region':'r%d','paused':true}\n"
+                     % (i % 4, i, 40 + i % 10, i % 7, 1000 + i, i % 3))
+        if i % 10 == 0:
+            lines.append("LLMETRICS (%d) login {'time':r%d}\n" % (i, i))
+            lines.append("Oct 19 05:58:06 sim0 simulator: unrelated\n")
+            lines.append("LLMETRICS (%d) sim {not notation\n" % i)
+    return lines
+
+class TestMetricsIngest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, lines):
+        path = os.path.join(self.dir, name)
+        open(path, 'wb').write(''.join(lines))
+        return path
+
+    def test_ingest_lines(self):
+        tables = metrics_ingest.ingest_lines(_log_lines(100))
+        self.assertEquals(sorted(tables.keys()), ['login', 'sim'])
+        sim = tables['sim'].summary()
+        self.assertEquals(sim['rows'], 100)
+        self.assertEquals(sorted(sim['keys'].keys()),
+                          ['agents', 'fps', 'mem.rss'])
+        fps = sim['keys']['fps']
+        self.assertEquals(fps['count'], 100)
+        self.assertEquals(fps['min'], 40)
+        self.assertEquals(fps['max'], 49)
+        self.assertEquals(fps['sum'], sum([40 + i % 10 for i in xrange(100)]))
+        self.assertEquals(tables['login'].summary()['rows'], 10)
+
+    def test_chunks_end_at_lines(self):
+        lines = _log_lines(200)
+        path = self.write('metrics.log', lines)
+        chunks = metrics_ingest._chunks(path, 1000)
+        self.assert_(len(chunks) > 10)
+        data = open(path, 'rb').read()
+        self.assertEquals(chunks[0][1], 0)
+        self.assertEquals(chunks[-1][2], len(data))
+        for (p, start, end), (q, next_start, next_end) in zip(chunks,
+                                                              chunks[1:]):
+            self.assertEquals(end, next_start)
+            self.assertEquals(data[end - 1], '\n')
+
+    def test_chunked_matches_whole(self):
+        first = _log_lines(200)
+        second = _log_lines(50)
+        paths = [self.write('a.log', first), self.write('b.log', second)]
+        whole = metrics_ingest.ingest_lines(first + second)
+        for processes in (1, 2):
+            tables = metrics_ingest.ingest(paths, processes, chunk_size=1000)
+            self.assertEquals(sorted(tables.keys()), sorted(whole.keys()))
+            for table in whole:
+                self.assertEquals(tables[table].summary(),
+                                  whole[table].summary())
+
+    def test_output(self):
+        tables = metrics_ingest.ingest_lines(_log_lines(20))
+        output = StringIO()
+        metrics_ingest.write_csv(tables, output)
+        rows = output.getvalue().splitlines()
+        self.assertEquals(rows[0], 'table,rows,key,count,sum,min,max,mean,'
+                          'p50,p90,p99')
+        self.assertEquals([row.split(',')[:3] for row in rows[1:]],
+                          [['login', '2', 'time'],
+                           ['sim', '20', 'agents'],
+                           ['sim', '20', 'fps'],
+                           ['sim', '20', 'mem.rss']])
+        self.assert_('<key>mem.rss</key>' in
+                     metrics_ingest.format_llsd(tables))
+
+if __name__ == '__main__':
+    unittest.main()
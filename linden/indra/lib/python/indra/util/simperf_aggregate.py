@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+"""\
+@file simperf_aggregate.py
+@brief Parallel rollups of simperf proc logs across all pids on a host.
+
+$LicenseInfo:firstyear=2009&license=mit$
+
+Copyright (c) 2009, Linden Research, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+$/LicenseInfo$
+"""
+
+import csv
+import getopt
+import os
+import sys
+
+from indra.base import llsd
+from indra.util.histogram import LogLinearHistogram
+from indra.util import simperf_proc_interface
+
+DEFAULT_BUCKET = 60000      # timestamps are in ms
+DEFAULT_PERCENTILES = (50, 90, 99)
+
+def usage():
+    print "Usage:"
+    print sys.argv[0] + " [options]"
+    print "  Roll up the simperf proc logs of every matching pid.  Each file is"
+    print "  reduced in a worker process to, for every numeric column (nested"
+    print "  maps are flattened with '.'), the count, min, max, mean and"
+    print "  percentiles of its values plus per-interval buckets, and the"
+    print "  results are merged per pid and for the whole host."
+    print
+    print "Options:"
+    print "  -d, --dir       Directory of proc logs.  (Default:  %s)" % simperf_proc_interface.DEFAULT_PATH
+    print "  -p, --pid       Only this pid."
+    print "  -t, --type      Only this stat type, e.g. sim."
+    print "  -c, --columns   Comma separated columns.  (Default:  all)"
+    print "  -b, --bucket    Interval bucket size in ms.  (Default:  %d)" % DEFAULT_BUCKET
+    print "  -s, --start     Only frames at or after this timestamp."
+    print "  -e, --end       Only frames at or before this timestamp."
+    print "  -j, --jobs      Worker processes.  (Default:  number of CPUs)"
+    print "  -f, --format    Output format, llsd or csv.  (Default:  llsd)"
+    print "  -o, --out       Output filename.  (Default:  stdout)"
+    print "  -h, --help      Print this message and exit."
+    print
+    print "Interfaces:"
+    print "   def aggregate(...)              # returns ({pid: rollups}, host rollups)"
+    print "   def format_llsd(by_pid, host) / write_csv(by_pid, host, file)"
+
+class ColumnRollup(object):
+    """
+    Value histogram and per-interval buckets for one column.  Compact and
+    mergeable, so workers can send it back to the parent cheaply.
+    """
+    def __init__(self, bucket_size=DEFAULT_BUCKET):
+        self.bucket_size = bucket_size
+        self.histogram = LogLinearHistogram()
+        self.buckets = {}       # interval start -> [count, sum, min, max]
+
+    def add(self, timestamp, value):
+        self.histogram.record(value)
+        start = timestamp - timestamp % self.bucket_size
+        bucket = self.buckets.get(start)
+        if bucket is None:
+            self.buckets[start] = [1, value, value, value]
+        else:
+            bucket[0] += 1
+            bucket[1] += value
+            if value < bucket[2]:
+                bucket[2] = value
+            if value > bucket[3]:
+                bucket[3] = value
+
+    def merge(self, other):
+        self.histogram.merge(other.histogram)
+        for start, (count, total, low, high) in other.buckets.iteritems():
+            bucket = self.buckets.get(start)
+            if bucket is None:
+                self.buckets[start] = [count, total, low, high]
+            else:
+                bucket[0] += count
+                bucket[1] += total
+                bucket[2] = min(bucket[2], low)
+                bucket[3] = max(bucket[3], high)
+        return self
+
+    def summary(self, percentiles=DEFAULT_PERCENTILES):
+        summary = self.histogram.summary(percentiles)
+        buckets = []
+        starts = self.buckets.keys()
+        starts.sort()
+        for start in starts:
+            count, total, low, high = self.buckets[start]
+            buckets.append({'start': start, 'count': count, 'min': low,
+                            'max': high, 'mean': float(total) / count})
+        summary['buckets'] = buckets
+        return summary
+
+def _add_frame(rollups, frame, timestamp, columns, bucket_size, prefix=''):
+    for key, value in frame.iteritems():
+        if isinstance(value, dict):
+            _add_frame(rollups, value, timestamp, columns, bucket_size,
+                       prefix + key + '.')
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, long, float)):
+            continue
+        column = prefix + key
+        if column == 'timestamp':
+            continue
+        if columns is not None and column not in columns:
+            continue
+        rollup = rollups.get(column)
+        if rollup is None:
+            rollup = rollups[column] = ColumnRollup(bucket_size)
+        rollup.add(timestamp, value)
+
+def merge_rollups(into, rollups):
+    """
+    Merges a {column: ColumnRollup} dict into another and returns it.
+    """
+    for column, rollup in rollups.iteritems():
+        if column in into:
+            into[column].merge(rollup)
+        else:
+            into[column] = rollup
+    return into
+
+def _iter_frames(filename, start_time, end_time):
+    if start_time is not None or end_time is not None:
+        # seek through the timestamp index
+        for frame in simperf_proc_interface.iter_logfile_window(
+            filename, start_time, end_time):
+            yield frame
+        return
+
+    sourcefile = open(filename, 'r')
+    try:
+        sourcefile.readline()       # meta info line
+        for line in sourcefile:
+            try:
+                frame = llsd.parse(line)
+            except Exception:
+                # frame still being written
+                continue
+            yield frame
+    finally:
+        sourcefile.close()
+
+def aggregate_file(filename, columns=None, bucket_size=DEFAULT_BUCKET,
+                   start_time=None, end_time=None):
+    """
+    Returns {column: ColumnRollup} for the frames of one proc log.
+    Each frame is rolled up as it is read, so memory use does not grow
+    with the size of the log.
+    """
+    rollups = {}
+    for frame in _iter_frames(filename, start_time, end_time):
+        if not isinstance(frame, dict) or 'timestamp' not in frame:
+            continue
+        _add_frame(rollups, frame, int(frame['timestamp']), columns,
+                   bucket_size)
+    return rollups
+
+def _aggregate_job(job):
+    pid, filename, columns, bucket_size, start_time, end_time = job
+    return pid, aggregate_file(filename, columns, bucket_size, start_time,
+                               end_time)
+
+def aggregate(pid=None, stat_type=None, path=None, columns=None,
+              bucket_size=DEFAULT_BUCKET, processes=None, start_time=None,
+              end_time=None):
+    """
+    Rolls up every <type>_proc.<pid>.llsd file matching pid and stat_type
+    and returns ({pid: {column: ColumnRollup}}, {column: ColumnRollup})
+    for the pids and the whole host.  Files are spread over a pool of
+    processes worker processes (default: one per CPU); with processes=1
+    everything runs in this process.
+    """
+    if path is None:
+        path = simperf_proc_interface.DEFAULT_PATH
+    if columns is not None:
+        columns = dict.fromkeys(columns)
+    jobs = []
+    for file_name in os.listdir(path):
+        if not file_name.endswith(".llsd") or file_name == "simperf_proc_config.llsd":
+            continue
+        (cur_pid, cur_stat_type) = simperf_proc_interface.parse_proc_filename(file_name)
+        if cur_pid is None:
+            continue
+        if pid is not None and pid != cur_pid:
+            continue
+        if stat_type is not None and stat_type != cur_stat_type:
+            continue
+        jobs.append((cur_pid, os.path.join(path, file_name), columns,
+                     bucket_size, start_time, end_time))
+
+    by_pid = {}
+    host = {}
+    if processes == 1 or len(jobs) <= 1:
+        results = map(_aggregate_job, jobs)
+        pool = None
+    else:
+        import multiprocessing
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap_unordered(_aggregate_job, jobs)
+    try:
+        for cur_pid, rollups in results:
+            merge_rollups(by_pid.setdefault(cur_pid, {}), rollups)
+            for column, rollup in rollups.iteritems():
+                # copy, so host totals don't change the per-pid rollups
+                merge_rollups(host, {column: ColumnRollup(bucket_size).merge(rollup)})
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return by_pid, host
+
+def _summaries(rollups, percentiles):
+    summary = {}
+    for column, rollup in rollups.iteritems():
+        summary[column] = rollup.summary(percentiles)
+    return summary
+
+def format_llsd(by_pid, host, percentiles=DEFAULT_PERCENTILES):
+    pids = {}
+    for pid, rollups in by_pid.iteritems():
+        pids[pid] = _summaries(rollups, percentiles)
+    return llsd.format_pretty_xml({'host': _summaries(host, percentiles),
+                                   'pids': pids})
+
+def write_csv(by_pid, host, output, percentiles=DEFAULT_PERCENTILES):
+    percentile_names = ['p%s' % ('%g' % p) for p in percentiles]
+    writer = csv.writer(output)
+    writer.writerow(['pid', 'column', 'count', 'min', 'max', 'mean'] +
+                    percentile_names)
+    pids = by_pid.keys()
+    pids.sort()
+    for pid, rollups in [('host', host)] + [(p, by_pid[p]) for p in pids]:
+        summary = _summaries(rollups, percentiles)
+        columns = summary.keys()
+        columns.sort()
+        for column in columns:
+            stats = summary[column]
+            writer.writerow([pid, column, stats['count'], stats['min'],
+                             stats['max'], stats['mean']] +
+                            [stats[name] for name in percentile_names])
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    opts, args = getopt.getopt(argv, "d:p:t:c:b:s:e:j:f:o:h",
+                               ["dir=", "pid=", "type=", "columns=",
+                                "bucket=", "start=", "end=", "jobs=",
+                                "format=", "out=", "help"])
+    path = None
+    pid = None
+    stat_type = None
+    columns = None
+    bucket_size = DEFAULT_BUCKET
+    start_time = None
+    end_time = None
+    processes = None
+    output_format = 'llsd'
+    output_file = sys.stdout
+    for o, a in opts:
+        if o in ("-d", "--dir"):
+            path = a
+        if o in ("-p", "--pid"):
+            pid = a
+        if o in ("-t", "--type"):
+            stat_type = a
+        if o in ("-c", "--columns"):
+            columns = a.split(',')
+        if o in ("-b", "--bucket"):
+            bucket_size = int(a)
+        if o in ("-s", "--start"):
+            start_time = int(a)
+        if o in ("-e", "--end"):
+            end_time = int(a)
+        if o in ("-j", "--jobs"):
+            processes = int(a)
+        if o in ("-f", "--format"):
+            output_format = a
+        if o in ("-o", "--out"):
+            output_file = open(a, 'w')
+        if o in ("-h", "--help"):
+            usage()
+            return 0
+    if args or output_format not in ('llsd', 'csv'):
+        usage()
+        return 1
+
+    by_pid, host = aggregate(pid, stat_type, path, columns, bucket_size,
+                             processes, start_time, end_time)
+    if output_format == 'csv':
+        write_csv(by_pid, host, output_file)
+    else:
+        print >>output_file, format_llsd(by_pid, host)
+    if output_file != sys.stdout:
+        output_file.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""\
+@file simperf_aggregate_test.py
+@brief Test cases for the simperf proc log aggregator.
+
+$LicenseInfo:firstyear=2009&license=mit$
+
+Copyright (c) 2009, Linden Research, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+$/LicenseInfo$
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from cStringIO import StringIO
+
+from indra.base import llsd
+from indra.util import simperf_aggregate
+
+def _frames(pid, count):
+    frames = []
+    for i in xrange(count):
+        frames.append({'timestamp': 1000000 + i * 10000,
+                       'fps': 40.0 + i % 5,
+                       'agents': pid % 10 + i,
+                       'frame': {'us': 1000 * (i + 1), 'name': 'frame'},
+                       'paused': False})
+    return frames
+
+class TestSimperfAggregate(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        for pid in (101, 102):
+            self.write('sim_proc.%d.llsd' % pid, _frames(pid, 20))
+        self.write('viewer_proc.103.llsd', _frames(103, 5))
+        open(os.path.join(self.dir, 'simperf_proc_config.llsd'),
+             'w').write(llsd.format_notation({'duration': 10}) + '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, frames):
+        output = open(os.path.join(self.dir, name), 'w')
+        output.write(llsd.format_notation({'name': name}) + '\n')
+        for frame in frames:
+            output.write(llsd.format_notation(frame) + '\n')
+        output.close()
+
+    def test_aggregate_file(self):
+        filename = os.path.join(self.dir, 'sim_proc.101.llsd')
+        # a frame still being written is skipped
+        open(filename, 'a').write("{'timestamp':i1")
+        rollups = simperf_aggregate.aggregate_file(filename)
+        self.assertEquals(sorted(rollups.keys()),
+                          ['agents', 'fps', 'frame.us'])
+        summary = rollups['frame.us'].summary()
+        self.assertEquals(summary['count'], 20)
+        self.assertEquals(summary['min'], 1000)
+        self.assertEquals(summary['max'], 20000)
+        # 60s buckets of frames 10s apart
+        self.assertEquals([(b['start'], b['count'])
+                           for b in summary['buckets']],
+                          [(960000, 2), (1020000, 6), (1080000, 6),
+                           (1140000, 6)])
+        self.assertEquals(summary['buckets'][0]['mean'], 1500.0)
+        self.assertEquals(summary['buckets'][0]['max'], 2000)
+
+        rollups = simperf_aggregate.aggregate_file(
+            filename, columns={'fps': None}, bucket_size=50000)
+        self.assertEquals(rollups.keys(), ['fps'])
+        self.assertEquals([(b['start'], b['count'])
+                           for b in rollups['fps'].summary()['buckets']],
+                          [(1000000, 5), (1050000, 5), (1100000, 5),
+                           (1150000, 5)])
+
+    def test_time_window(self):
+        filename = os.path.join(self.dir, 'sim_proc.101.llsd')
+        rollups = simperf_aggregate.aggregate_file(
+            filename, start_time=1050000, end_time=1099999)
+        self.assertEquals(rollups['frame.us'].summary()['count'], 5)
+        self.assertEquals(rollups['frame.us'].summary()['min'], 6000)
+
+    def test_aggregate(self):
+        for processes in (1, 2):
+            by_pid, host = simperf_aggregate.aggregate(
+                path=self.dir, processes=processes)
+            self.assertEquals(sorted(by_pid.keys()), ['101', '102', '103'])
+            self.assertEquals(by_pid['101']['agents'].summary()['min'], 1)
+            self.assertEquals(by_pid['102']['agents'].summary()['min'], 2)
+            self.assertEquals(host['agents'].summary()['count'], 45)
+            self.assertEquals(host['agents'].summary()['min'], 1)
+            # host totals are separate from the per-pid rollups
+            self.assertEquals(by_pid['101']['agents'].summary()['count'], 20)
+
+        by_pid, host = simperf_aggregate.aggregate(
+            stat_type='sim', path=self.dir, columns=['fps'], processes=1)
+        self.assertEquals(sorted(by_pid.keys()), ['101', '102'])
+        self.assertEquals(host.keys(), ['fps'])
+        by_pid, host = simperf_aggregate.aggregate(
+            pid='103', path=self.dir, processes=1)
+        self.assertEquals(by_pid.keys(), ['103'])
+
+    def test_output(self):
+        by_pid, host = simperf_aggregate.aggregate(
+            path=self.dir, columns=['fps'], processes=1)
+        output = StringIO()
+        simperf_aggregate.write_csv(by_pid, host, output)
+        rows = [row.split(',') for row in output.getvalue().splitlines()]
+        self.assertEquals(rows[0][:2], ['pid', 'column'])
+        self.assertEquals([row[:3] for row in rows[1:]],
+                          [['host', 'fps', '45'], ['101', 'fps', '20'],
+                           ['102', 'fps', '20'], ['103', 'fps', '5']])
+        summary = llsd.parse(simperf_aggregate.format_llsd(by_pid, host))
+        self.assertEquals(summary['host']['fps']['count'], 45)
+        self.assertEquals(summary['pids']['103']['fps']['max'], 44.0)
+
+if __name__ == '__main__':
+    unittest.main()
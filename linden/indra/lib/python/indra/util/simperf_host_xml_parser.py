@@ -27,10 +27,19 @@ THE SOFTWARE.
 $/LicenseInfo$
 """
 
-import sys, os, getopt, time
+import sys, os, getopt, time, operator
 import simplejson
+from array import array
 from xml import sax
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from indra.base import llsd
+from indra.util.columnstore import ColumnStoreWriter
+
 
 def usage():
     print "Usage:"
@@ -48,6 +57,11 @@ def usage():
     print "Options:"
     print "  -i, --in      Input settings filename.  (Default:  stdin)"
     print "  -o, --out     Output settings filename.  (Default:  stdout)"
+    print "  -s, --stream  Convert row by row in constant memory.  Row times come"
+    print "                from rrdtool's per-row comments."
+    print "  -f, --format  Output format with --stream, json or llsd.  (Default:  json)"
+    print "  -c, --store   Append new rows to this column store instead of writing"
+    print "                JSON (see indra.util.columnstore)."
     print "  -h, --help    Print this message and exit."
     print
     print "Example: %s -i rrddump.xml -o rrddump.json" % sys.argv[0]
@@ -55,6 +69,8 @@ def usage():
     print "Interfaces:"
     print "   class SimPerfHostXMLParser()         # SAX content handler"
     print "   def simperf_host_xml_fixup(parser)   # post-parse value fixup"
+    print "   class SimPerfHostRRDStream(output)   # streaming parse and fixup"
+    print "   def simperf_host_xml_store(parser, path)  # append to a column store"
 
 class SimPerfHostXMLParser(sax.handler.ContentHandler):
 
@@ -185,6 +201,46 @@ class SimPerfHostXMLParser(sax.handler.ContentHandler):
         if self._rrd_capture:
             self._rrd_chars = self._rrd_chars + content.strip()
 
+# Fixup for GAUGE fields that are really COUNTS.  They
+# were forced to GAUGE to try to disable rrdtool's
+# data interpolation/extrapolation for non-uniform time
+# samples.
+FIXUP_TAGS = [ "cpu_user",
+               "cpu_nice",
+               "cpu_sys",
+               "cpu_idle",
+               "cpu_waitio",
+               "cpu_intr",
+               # "file_active",
+               # "file_free",
+               # "inode_active",
+               # "inode_free",
+               "netif_in_kb",
+               "netif_in_pkts",
+               "netif_in_errs",
+               "netif_in_drop",
+               "netif_out_kb",
+               "netif_out_pkts",
+               "netif_out_errs",
+               "netif_out_drop",
+               "vm_page_in",
+               "vm_page_out",
+               "vm_swap_in",
+               "vm_swap_out",
+               #"vm_mem_total",
+               #"vm_mem_used",
+               #"vm_mem_active",
+               #"vm_mem_inactive",
+               #"vm_mem_free",
+               #"vm_mem_buffer",
+               #"vm_swap_cache",
+               #"vm_swap_total",
+               #"vm_swap_used",
+               #"vm_swap_free",
+               "cpu_interrupts",
+               "cpu_switches",
+               "cpu_forks" ]
+
 def _make_numeric(value):
     try:
         value = float(value)
@@ -192,124 +248,378 @@ def _make_numeric(value):
         value = ""
     return value
 
-def simperf_host_xml_fixup(parser, filter_start_time = None, filter_end_time = None):
-    # Fixup for GAUGE fields that are really COUNTS.  They
-    # were forced to GAUGE to try to disable rrdtool's
-    # data interpolation/extrapolation for non-uniform time
-    # samples.
-    fixup_tags = [ "cpu_user",
-                   "cpu_nice",
-                   "cpu_sys",
-                   "cpu_idle",
-                   "cpu_waitio",
-                   "cpu_intr",
-                   # "file_active",
-                   # "file_free",
-                   # "inode_active",
-                   # "inode_free",
-                   "netif_in_kb",
-                   "netif_in_pkts",
-                   "netif_in_errs",
-                   "netif_in_drop",
-                   "netif_out_kb",
-                   "netif_out_pkts",
-                   "netif_out_errs",
-                   "netif_out_drop",
-                   "vm_page_in",
-                   "vm_page_out",
-                   "vm_swap_in",
-                   "vm_swap_out",
-                   #"vm_mem_total",
-                   #"vm_mem_used",
-                   #"vm_mem_active",
-                   #"vm_mem_inactive",
-                   #"vm_mem_free",
-                   #"vm_mem_buffer",
-                   #"vm_swap_cache",
-                   #"vm_swap_total",
-                   #"vm_swap_used",
-                   #"vm_swap_free",
-                   "cpu_interrupts",
-                   "cpu_switches",
-                   "cpu_forks" ]
+def _convert_rows(rows, col_count):
+    """ Convert string rows to one typed array per column """
+    if numpy is not None:
+        try:
+            return list(numpy.array(rows, dtype=float).reshape(len(rows), col_count).T)
+        except ValueError:
+            # Something that isn't a number; fall back to cell by cell.
+            return [numpy.array([_make_float(row[j]) for row in rows])
+                    for j in range(col_count)]
+    columns = []
+    for j in range(col_count):
+        cells = [row[j] for row in rows]
+        try:
+            columns.append(array('d', map(float, cells)))
+        except ValueError:
+            columns.append(array('d', map(_make_float, cells)))
+    return columns
+
+def _make_float(value):
+    try:
+        return float(value)
+    except:
+        return float('nan')
+
+def _row_equal(parser, i, j):
+    """ Compare rows i and j of the unconverted records as numbers """
+    for a, b in zip(parser.rrd_records[i], parser.rrd_records[j]):
+        if a != b and _make_float(a) != _make_float(b):
+            return False
+    return True
 
+def simperf_host_xml_columns(parser, filter_start_time = None, filter_end_time = None):
+    """
+    Column-wise simperf_host_xml_fixup.  Returns (timestamps, columns),
+    one array per parser.rrd_ds entry, holding only the rows in the time
+    window.  The arrays are numpy arrays when numpy is available and
+    array('d') otherwise.  The parser itself is left unchanged.
+
+    Only the window is converted from strings, plus the row after it
+    (to recognize fillers) and the last kept row before it (to take
+    deltas from).
+    """
     col_count = len(parser.rrd_ds)
     row_count = len(parser.rrd_records)
+    step = parser.rrd_step
+    start_time = parser.rrd_last_update - (step * (row_count - 1))
 
-    # Process the last row separately, just to make all values numeric.
-    for j in range(col_count):
-        parser.rrd_records[row_count - 1][j] = _make_numeric(parser.rrd_records[row_count - 1][j])
-
-    # Process all other row/columns.
-    last_different_row = row_count - 1
-    current_row = row_count - 2
-    while current_row >= 0:
-        # Check for a different value than the previous row.  If everything is the same
-        # then this is probably just a filler/bogus entry.
-        is_different = False
-        for j in range(col_count):
-            parser.rrd_records[current_row][j] = _make_numeric(parser.rrd_records[current_row][j])
-            if parser.rrd_records[current_row][j] != parser.rrd_records[last_different_row][j]:
-                # We're good.  This is a different row.
-                is_different = True
+    # Row range of the time window, timestamps being
+    # (start_time + i * step) * 1000.
+    first, last = 0, row_count - 1
+    if step:
+        if filter_start_time is not None:
+            first = max(first, -(-(filter_start_time - start_time * 1000) // (step * 1000)))
+        if filter_end_time is not None:
+            last = min(last, (filter_end_time - start_time * 1000) // (step * 1000))
+    if first > last:
+        if numpy is not None:
+            return numpy.zeros(0, dtype=numpy.int64), [numpy.zeros(0) for j in range(col_count)]
+        return [], [array('d') for j in range(col_count)]
 
-        if not is_different:
-            # This is a filler/bogus entry.  Just ignore it.
-            for j in range(col_count):
-                parser.rrd_records[current_row][j] = float('nan')
+    # Rows equal to the row after them are filler/bogus entries.  Find
+    # the last row before the window that isn't.
+    base = first - 1
+    while base >= 0 and _row_equal(parser, base, base + 1):
+        base -= 1
+    low = max(base, 0)
+    high = min(last + 1, row_count - 1)
+    columns = _convert_rows(parser.rrd_records[low:high + 1], col_count)
+    count = high - low + 1
+    fixup = [j for j in range(col_count) if parser.rrd_ds[j]["name"] in FIXUP_TAGS]
+    nan = float('nan')
+
+    if numpy is not None:
+        different = numpy.ones(count, dtype=bool)
+        if count > 1:
+            different[:-1] = False
+            for column in columns:
+                different[:-1] |= column[:-1] != column[1:]
+        kept = numpy.flatnonzero(different)
+        for j in fixup:
+            column = columns[j]
+            # Deltas use the raw value of the previous kept row.
+            column[kept[1:]] = column[kept[1:]] - column[kept[:-1]]
+        for column in columns:
+            column[~different] = nan
+        if low == 0:
+            for j in fixup:
+                columns[j][0] = nan
+        offset = first - low
+        columns = [column[offset:offset + last - first + 1] for column in columns]
+        timestamps = (start_time + numpy.arange(first, last + 1, dtype=numpy.int64) * step) * 1000
+        return timestamps, columns
+
+    different = [False] * (count - 1) + [True]
+    for column in columns:
+        different[:-1] = map(operator.or_, different[:-1],
+                             map(operator.ne, column[:-1], column[1:]))
+    kept = [i for i in range(count) if different[i]]
+    for j in fixup:
+        column = columns[j]
+        raw = array('d', column)
+        for i, previous in zip(kept[1:], kept):
+            column[i] = raw[i] - raw[previous]
+    fillers = [i for i in range(count) if not different[i]]
+    for column in columns:
+        for i in fillers:
+            column[i] = nan
+    if low == 0:
+        for j in fixup:
+            columns[j][0] = nan
+    offset = first - low
+    columns = [column[offset:offset + last - first + 1] for column in columns]
+    timestamps = [(start_time + i * step) * 1000 for i in range(first, last + 1)]
+    return timestamps, columns
+
+def simperf_host_xml_fixup(parser, filter_start_time = None, filter_end_time = None):
+    # Various format fixups:  string-to-num, gauge-to-counts, add
+    # a time stamp.  Done a column at a time, see simperf_host_xml_columns.
+    timestamps, columns = simperf_host_xml_columns(parser, filter_start_time,
+                                                   filter_end_time)
+    if numpy is not None:
+        timestamps = timestamps.tolist()
+        columns = [column.tolist() for column in columns]
+    parser.rrd_records = [list(row) for row in zip(timestamps, *columns)]
+    parser.rrd_ds.insert(0, {"type": "GAUGE", "name": "javascript_timestamp"})
+
+def simperf_host_xml_store(parser, store_path):
+    """
+    Appends the parsed rows newer than the last stored row to the column
+    store at store_path (see indra.util.columnstore), creating it if
+    needed.  Returns the number of rows added.
+    """
+    writer = ColumnStoreWriter(store_path, parser.rrd_ds)
+    try:
+        filter_start_time = None
+        if writer.last_time is not None:
+            filter_start_time = writer.last_time + 1
+        timestamps, columns = simperf_host_xml_columns(parser, filter_start_time)
+        writer.append_columns(timestamps, columns)
+    finally:
+        writer.close()
+    return len(timestamps)
+
+
+class SimPerfHostRRDStream(object):
+    """
+    Streaming form of SimPerfHostXMLParser plus simperf_host_xml_fixup.
+    Parses the 'rrdtool dump' XML with expat callbacks and writes each
+    row to the output as soon as the row after it has been read, so
+    memory does not grow with the number of rows.
+
+    The result matches the batch conversion except for the timestamps:
+    the batch code spaces rows 'step' apart back from lastupdate, even
+    across rows it dropped for NaN values, while this takes each row's
+    time from the comment rrdtool writes in front of it (or the previous
+    row's time plus the RRA step when there is none).  Each <rra> is
+    also fixed up separately, so no deltas are taken across them.
+    """
+    def __init__(self, output, output_format = "json",
+                 filter_start_time = None, filter_end_time = None,
+                 fixup_tags = FIXUP_TAGS):
+        self.output = output
+        self.output_format = output_format
+        self.filter_start_time = filter_start_time
+        self.filter_end_time = filter_end_time
+        self.fixup_tags = fixup_tags
+        self.rrd_last_update = 0         # public
+        self.rrd_step = 0                # public
+        self.rrd_ds = []                 # public
+        self.row_count = 0               # public, rows written
+        self._path = []
+        self._chars = None
+        self._ds_val = None
+        self._pdp_per_row = 1
+        self._row = None
+        self._row_has_nan = False
+        self._comment_time = None
+        self._last_time = None
+        self._fixup_columns = []
+        self._started = False
+        self._pending = None             # (timestamp, values), one-row lookahead
+        self._previous = None            # last row kept, for the deltas
+        self._first_row = True           # next row is the RRA's first
+
+    def convert(self, input_file):
+        from xml.parsers import expat
+        parser = expat.ParserCreate()
+        parser.buffer_text = True
+        parser.StartElementHandler = self._start_element
+        parser.EndElementHandler = self._end_element
+        parser.CharacterDataHandler = self._characters
+        parser.CommentHandler = self._comment
+        parser.ParseFile(input_file)
+        self._flush_database()
+        if not self._started:
+            self._write_header()
+        self._write_footer()
+
+    def _start_element(self, name, attrs):
+        path = self._path
+        path.append(name)
+        depth = len(path)
+        if depth == 5 and name == "v":
+            self._chars = []
+        elif depth == 4 and name == "row":
+            self._row = []
+            self._row_has_nan = False
+        elif depth == 3 and name == "database":
+            if not self._started:
+                self._write_header()
+            self._flush_database()
+        elif depth == 3 and path[1] == "ds" and name in ("name", "type"):
+            self._chars = []
+        elif depth == 3 and path[1] == "rra" and name == "pdp_per_row":
+            self._chars = []
+        elif depth == 2 and name in ("lastupdate", "step"):
+            self._chars = []
+        elif depth == 2 and name == "ds":
+            self._ds_val = {}
+
+    def _end_element(self, name):
+        path = self._path
+        depth = len(path)
+        if self._chars is not None:
+            text = "".join(self._chars).strip()
+            self._chars = None
+            if depth == 5:
+                if text == "NaN":
+                    self._row_has_nan = True
+                else:
+                    self._row.append(_make_numeric(text))
+            elif depth == 3 and path[1] == "ds":
+                self._ds_val[name] = text
+            elif depth == 3:
+                self._pdp_per_row = long(text)
+            elif name == "lastupdate":
+                self.rrd_last_update = long(text)
+            elif name == "step":
+                self.rrd_step = long(text)
+        elif depth == 4 and name == "row":
+            self._end_row()
+        elif depth == 2 and name == "ds":
+            self.rrd_ds.append(self._ds_val)
+        path.pop()
+
+    def _characters(self, content):
+        if self._chars is not None:
+            self._chars.append(content)
+
+    def _comment(self, text):
+        # rrdtool writes '<!-- 2009-06-01 12:00:00 PDT / 1243882800 -->'
+        # before each row.
+        if len(self._path) == 3 and "/" in text:
+            try:
+                self._comment_time = long(text.rsplit("/", 1)[1]) * 1000
+            except ValueError:
+                pass
+
+    def _end_row(self):
+        if self._comment_time is not None:
+            timestamp = self._comment_time
+        elif self._last_time is not None:
+            timestamp = self._last_time + self.rrd_step * self._pdp_per_row * 1000
         else:
-            # Some tags need to be converted into deltas.
-            for j in range(col_count):
-                if parser.rrd_ds[j]["name"] in fixup_tags:
-                    parser.rrd_records[last_different_row][j] = \
-                        parser.rrd_records[last_different_row][j] - parser.rrd_records[current_row][j]
-            last_different_row = current_row
+            timestamp = None
+        self._comment_time = None
+        self._last_time = timestamp
+        if self._row_has_nan:
+            return
 
-        current_row -= 1
+        row = (timestamp, self._row)
+        pending = self._pending
+        self._pending = row
+        if pending is not None:
+            # A row equal to the one after it is a filler/bogus entry.
+            self._emit(pending, pending[1] != row[1])
 
-    # Set fixup_tags in the first row to 'nan' since they aren't useful anymore.
-    for j in range(col_count):
-        if parser.rrd_ds[j]["name"] in fixup_tags:
-            parser.rrd_records[0][j] = float('nan')
-
-    # Add a timestamp to each row and to the catalog.  Format and name
-    # chosen to match other simulator logging (hopefully).
-    start_time = parser.rrd_last_update - (parser.rrd_step * (row_count - 1))
-    # Build a filtered list of rrd_records if we are limited to a time range.
-    filter_records = False
-    if filter_start_time is not None or filter_end_time is not None:
-        filter_records = True
-        filtered_rrd_records = []
-        if filter_start_time is None:
-            filter_start_time = start_time * 1000
-        if filter_end_time is None:
-            filter_end_time = parser.rrd_last_update * 1000
-        
-    for i in range(row_count):
-        record_timestamp = (start_time + (i * parser.rrd_step)) * 1000
-        parser.rrd_records[i].insert(0, record_timestamp)
-        if filter_records:
-            if filter_start_time <= record_timestamp and record_timestamp <= filter_end_time:
-                filtered_rrd_records.append(parser.rrd_records[i])
+    def _flush_database(self):
+        if self._pending is not None:
+            self._emit(self._pending, True)
+        self._pending = None
+        self._previous = None
+        self._first_row = True
 
-    if filter_records:
-        parser.rrd_records = filtered_rrd_records
+    def _emit(self, row, is_different):
+        timestamp, values = row
+        first_row, self._first_row = self._first_row, False
+        if not is_different:
+            out = [float('nan')] * len(values)
+        else:
+            out = list(values)
+            previous = self._previous
+            for j in self._fixup_columns:
+                if previous is None:
+                    # No earlier row in this RRA to take a delta from.
+                    # Like the batch fixup, only the first row is
+                    # blanked; a row after fillers keeps its count.
+                    if first_row:
+                        out[j] = float('nan')
+                else:
+                    out[j] = values[j] - previous[j]
+            self._previous = values
 
-    parser.rrd_ds.insert(0, {"type": "GAUGE", "name": "javascript_timestamp"})
+        if self.filter_start_time is not None and timestamp < self.filter_start_time:
+            return
+        if self.filter_end_time is not None and timestamp > self.filter_end_time:
+            return
+        out.insert(0, timestamp)
+        if self.output_format == "llsd":
+            # LLSD has no NaN; leave the value undefined
+            text = llsd.format_notation([value if value == value else None
+                                         for value in out])
+        else:
+            text = simplejson.dumps(out)
+        if self.row_count:
+            self.output.write(",\n")
+        self.output.write(text)
+        self.row_count += 1
+
+    def _write_header(self):
+        self._started = True
+        self._fixup_columns = [j for j in range(len(self.rrd_ds))
+                               if self.rrd_ds[j].get("name") in self.fixup_tags]
+        ds = [{"type": "GAUGE", "name": "javascript_timestamp"}] + self.rrd_ds
+        if self.output_format == "llsd":
+            self.output.write("{'step':%s,'lastupdate':%s,'ds':%s,'database':[\n"
+                              % (llsd.format_notation(self.rrd_step),
+                                 llsd.format_notation(self.rrd_last_update * 1000),
+                                 llsd.format_notation(ds)))
+        else:
+            self.output.write('{"step": %s, "lastupdate": %s, "ds": %s, "database": [\n'
+                              % (simplejson.dumps(self.rrd_step),
+                                 simplejson.dumps(self.rrd_last_update * 1000),
+                                 simplejson.dumps(ds)))
+
+    def _write_footer(self):
+        self.output.write("]}\n")
 
 
 def main(argv=None):
-    opts, args = getopt.getopt(sys.argv[1:], "i:o:h", ["in=", "out=", "help"])
+    opts, args = getopt.getopt(sys.argv[1:], "i:o:sf:c:h",
+                               ["in=", "out=", "stream", "format=", "store=", "help"])
     input_file = sys.stdin
     output_file = sys.stdout
+    stream = False
+    store_path = None
+    output_format = "json"
     for o, a in opts:
         if o in ("-i", "--in"):
             input_file = open(a, 'r')
         if o in ("-o", "--out"):
             output_file = open(a, 'w')
+        if o in ("-s", "--stream"):
+            stream = True
+        if o in ("-f", "--format"):
+            output_format = a
+        if o in ("-c", "--store"):
+            store_path = a
         if o in ("-h", "--help"):
             usage()
             sys.exit(0)
+    if output_format not in ("json", "llsd") or (output_format == "llsd" and not stream):
+        usage()
+        return 1
+
+    if stream:
+        SimPerfHostRRDStream(output_file, output_format).convert(input_file)
+        if input_file != sys.stdin:
+            input_file.close()
+        if output_file != sys.stdout:
+            output_file.close()
+        return 0
 
     # Using the SAX parser as it is at least 4X faster and far, far
     # smaller on this dataset than the DOM-based interface in xml.dom.minidom.
@@ -322,6 +632,10 @@ def main(argv=None):
     if input_file != sys.stdin:
         input_file.close()
 
+    if store_path is not None:
+        simperf_host_xml_store(handler, store_path)
+        return 0
+
     # Various format fixups:  string-to-num, gauge-to-counts, add
     # a time stamp, etc.
     simperf_host_xml_fixup(handler)
@@ -0,0 +1,243 @@
+"""\
+@file simperf_host_xml_parser_test.py
+@brief Test cases for the rrdtool dump converters.
+
+$LicenseInfo:firstyear=2009&license=mit$
+
+Copyright (c) 2009, Linden Research, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+$/LicenseInfo$
+"""
+
+import random
+import unittest
+from cStringIO import StringIO
+from xml import sax
+
+from indra.base import llsd
+from indra.util import simperf_host_xml_parser
+from indra.util.simperf_host_xml_parser import FIXUP_TAGS, \
+     SimPerfHostXMLParser, SimPerfHostRRDStream
+
+DS = ['cpu_user', 'vm_mem_used', 'netif_in_kb', 'load']
+STEP = 60
+LAST_UPDATE = 1243882800
+
+def rrd_dump(rand, row_count, nan_rows=False):
+    """ 'rrdtool dump' XML for one RRA of row_count rows, with runs of
+    repeated (filler) rows and, if nan_rows, some rows holding NaN """
+    parts = ['<?xml version="1.0" encoding="utf-8"?>\n<rrd>\n',
+             '\t<version>0003</version>\n\t<step>%d</step>\n' % STEP,
+             '\t<lastupdate>%d</lastupdate>\n' % LAST_UPDATE]
+    for name in DS:
+        parts.append('\t<ds>\n\t\t<name> %s </name>\n\t\t<type> GAUGE </type>\n'
+                     '\t\t<minimal_heartbeat>120</minimal_heartbeat>\n'
+                     '\t</ds>\n' % name)
+    parts.append('\t<rra>\n\t\t<cf>AVERAGE</cf>\n'
+                 '\t\t<pdp_per_row>1</pdp_per_row>\n\t\t<cdp_prep>\n')
+    for name in DS:
+        parts.append('\t\t\t<ds><value> NaN </value></ds>\n')
+    parts.append('\t\t</cdp_prep>\n\t\t<database>\n')
+    counters = [1000.0, 0.0, 50.0, 0.0]
+    row = None
+    for i in xrange(row_count):
+        when = LAST_UPDATE - STEP * (row_count - 1 - i)
+        if row is None or rand.random() > 0.3:
+            counters[0] += rand.randint(0, 500)
+            counters[2] += rand.randint(0, 3) * 0.5
+            row = [counters[0], float(rand.randint(1, 8) * 1024),
+                   counters[2], rand.randint(0, 400) / 100.0]
+        values = ['%0.10e' % value for value in row]
+        if nan_rows and rand.random() < 0.05:
+            values[rand.randint(0, len(values) - 1)] = 'NaN'
+        parts.append('\t\t\t<!-- 2009-06-01 12:00:00 PDT / %d --> <row>%s</row>\n'
+                     % (when, ''.join(['<v> %s </v>' % value
+                                       for value in values])))
+    parts.append('\t\t</database>\n\t</rra>\n</rrd>\n')
+    return ''.join(parts)
+
+def _old_fixup(parser, filter_start_time=None, filter_end_time=None):
+    """ The per-row simperf_host_xml_fixup this module used to have """
+    col_count = len(parser.rrd_ds)
+    row_count = len(parser.rrd_records)
+    make_numeric = simperf_host_xml_parser._make_numeric
+
+    for j in range(col_count):
+        parser.rrd_records[row_count - 1][j] = \
+            make_numeric(parser.rrd_records[row_count - 1][j])
+
+    last_different_row = row_count - 1
+    current_row = row_count - 2
+    while current_row >= 0:
+        is_different = False
+        for j in range(col_count):
+            parser.rrd_records[current_row][j] = \
+                make_numeric(parser.rrd_records[current_row][j])
+            if parser.rrd_records[current_row][j] != \
+                   parser.rrd_records[last_different_row][j]:
+                is_different = True
+
+        if not is_different:
+            for j in range(col_count):
+                parser.rrd_records[current_row][j] = float('nan')
+        else:
+            for j in range(col_count):
+                if parser.rrd_ds[j]["name"] in FIXUP_TAGS:
+                    parser.rrd_records[last_different_row][j] = \
+                        parser.rrd_records[last_different_row][j] - \
+                        parser.rrd_records[current_row][j]
+            last_different_row = current_row
+
+        current_row -= 1
+
+    for j in range(col_count):
+        if parser.rrd_ds[j]["name"] in FIXUP_TAGS:
+            parser.rrd_records[0][j] = float('nan')
+
+    start_time = parser.rrd_last_update - (parser.rrd_step * (row_count - 1))
+    filter_records = False
+    if filter_start_time is not None or filter_end_time is not None:
+        filter_records = True
+        filtered_rrd_records = []
+        if filter_start_time is None:
+            filter_start_time = start_time * 1000
+        if filter_end_time is None:
+            filter_end_time = parser.rrd_last_update * 1000
+
+    for i in range(row_count):
+        record_timestamp = (start_time + (i * parser.rrd_step)) * 1000
+        parser.rrd_records[i].insert(0, record_timestamp)
+        if filter_records:
+            if filter_start_time <= record_timestamp and \
+                   record_timestamp <= filter_end_time:
+                filtered_rrd_records.append(parser.rrd_records[i])
+
+    if filter_records:
+        parser.rrd_records = filtered_rrd_records
+
+    parser.rrd_ds.insert(0, {"type": "GAUGE", "name": "javascript_timestamp"})
+
+def _parse(dump):
+    handler = SimPerfHostXMLParser()
+    sax.parseString(dump, handler)
+    return handler
+
+def _comparable(rows):
+    """ NaN never equals itself, so compare it as None """
+    return [[value if value == value else None for value in row]
+            for row in rows]
+
+def _windows(rand, row_count):
+    first = (LAST_UPDATE - STEP * (row_count - 1)) * 1000
+    last = LAST_UPDATE * 1000
+    windows = [(None, None), (first, last), (first - 5000, None),
+               (None, last + 5000), (last + 1, None), (None, first - 1)]
+    for i in xrange(10):
+        start = rand.randint(first - 100000, last + 100000)
+        windows.append((start, start + rand.randint(0, 30) * STEP * 1000))
+        windows.append((start, None))
+        windows.append((None, start))
+    return windows
+
+class TestRRDStream(unittest.TestCase):
+    def stream(self, dump, start=None, end=None):
+        output = StringIO()
+        stream = SimPerfHostRRDStream(output, 'llsd', start, end)
+        stream.convert(StringIO(dump))
+        return stream, llsd.parse(output.getvalue())
+
+    def test_matches_batch(self):
+        rand = random.Random(41)
+        for row_count in (1, 2, 3, 50, 300):
+            dump = rrd_dump(rand, row_count)
+            for start, end in _windows(rand, row_count):
+                old = _parse(dump)
+                _old_fixup(old, start, end)
+                stream, result = self.stream(dump, start, end)
+                self.assertEquals(result['ds'], old.rrd_ds)
+                self.assertEquals(result['step'], STEP)
+                self.assertEquals(result['lastupdate'], LAST_UPDATE * 1000)
+                self.assertEquals(result['database'],
+                                  _comparable(old.rrd_records))
+                self.assertEquals(stream.row_count, len(old.rrd_records))
+
+    def test_nan_rows_dropped(self):
+        dump = rrd_dump(random.Random(4141), 200, nan_rows=True)
+        old = _parse(dump)
+        stream, result = self.stream(dump)
+        self.assertEquals(len(result['database']), len(old.rrd_records))
+        self.assert_(len(result['database']) < 200)
+        times = [row[0] for row in result['database']]
+        self.assertEquals(times, sorted(times))
+
+class TestColumnFixup(unittest.TestCase):
+    def setUp(self):
+        self.numpy = simperf_host_xml_parser.numpy
+
+    def tearDown(self):
+        simperf_host_xml_parser.numpy = self.numpy
+
+    def implementations(self):
+        """ Runs the caller's checks with numpy, if installed, and with
+        array('d') """
+        if self.numpy is not None:
+            yield 'numpy'
+        simperf_host_xml_parser.numpy = None
+        yield 'array'
+
+    def test_matches_per_row_fixup(self):
+        rand = random.Random(42)
+        dumps = [rrd_dump(rand, row_count, nan_rows)
+                 for row_count in (1, 2, 3, 50, 300)
+                 for nan_rows in (False, True)]
+        for implementation in self.implementations():
+            for dump in dumps:
+                row_count = len(_parse(dump).rrd_records)
+                for start, end in _windows(rand, row_count):
+                    old = _parse(dump)
+                    _old_fixup(old, start, end)
+                    new = _parse(dump)
+                    simperf_host_xml_parser.simperf_host_xml_fixup(
+                        new, start, end)
+                    self.assertEquals(new.rrd_ds, old.rrd_ds)
+                    self.assertEquals(_comparable(new.rrd_records),
+                                      _comparable(old.rrd_records),
+                                      '%s %s' % (implementation,
+                                                 (row_count, start, end)))
+
+    def test_columns(self):
+        dump = rrd_dump(random.Random(4242), 100)
+        for implementation in self.implementations():
+            parser = _parse(dump)
+            records = [list(row) for row in parser.rrd_records]
+            timestamps, columns = \
+                simperf_host_xml_parser.simperf_host_xml_columns(
+                    parser, (LAST_UPDATE - 10 * STEP) * 1000)
+            self.assertEquals(len(timestamps), 11)
+            self.assertEquals(timestamps[-1], LAST_UPDATE * 1000)
+            self.assertEquals(len(columns), len(DS))
+            self.assertEquals([len(column) for column in columns],
+                              [11] * len(DS))
+            # the parser is left alone
+            self.assertEquals(parser.rrd_records, records)
+            self.assertEquals(len(parser.rrd_ds), len(DS))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -48,16 +48,203 @@ def usage():
     print "Options:"
     print "  -i, --in      Input settings filename.  (Default:  stdin)"
     print "  -o, --out     Output settings filename.  (Default:  stdout)"
+    print "  -t, --top     Print the N symbols with the most self and inclusive"
+    print "                samples instead."
+    print "  -d, --diff    Print the change in each symbol's share of samples"
+    print "                since this baseline report instead, regressions first."
     print "  -h, --help    Print this message and exit."
     print
     print "Interfaces:"
     print "   class SimPerfOProfileInterface()"
+    print "   class CallGraph()                   # .graph of a parsed report"
+    print "   def diff(profile_a, profile_b)"
     
-class SimPerfOProfileInterface:
+class CallGraphNode(object):
+    """
+    One symbol of a profile.  samples are the symbol's own samples;
+    calls and called_by map the (symbol, file) key of each callee and
+    caller to the samples on that arc.
+    """
+    __slots__ = ('symbol', 'file', 'samples', 'percentage', 'calls', 'called_by')
+
+    def __init__(self, symbol, file):
+        self.symbol = symbol
+        self.file = file
+        self.samples = 0
+        self.percentage = 0.0
+        self.calls = {}
+        self.called_by = {}
+
+    def key(self):
+        return (self.symbol, self.file)
+
+    def __repr__(self):
+        return "<CallGraphNode %s (%s) %d>" % (self.symbol, self.file, self.samples)
+
+class CallGraph(object):
+    """
+    Indexed form of an OProfile report.  Symbol and file names are
+    interned, numbers are parsed once, and nodes are indexed by
+    (symbol, file) and by symbol, so lookups don't scan the report.
+    """
     def __init__(self):
+        self.nodes = {}                 # (symbol, file) -> CallGraphNode
+        self.by_symbol = {}             # symbol -> [CallGraphNode]
+        self.total_samples = 0
+
+    def node(self, symbol, file):
+        key = (symbol, file)
+        node = self.nodes.get(key)
+        if node is None:
+            node = self.nodes[key] = CallGraphNode(symbol, file)
+            self.by_symbol.setdefault(symbol, []).append(node)
+        return node
+
+    def find(self, symbol):
+        """ Return the nodes for symbol, in any file """
+        return self.by_symbol.get(symbol, [])
+
+    def _resolve(self, symbol):
+        if isinstance(symbol, CallGraphNode):
+            return [symbol]
+        if isinstance(symbol, tuple):
+            return [self.nodes[symbol]]
+        return self.find(symbol)
+
+    def top_self(self, n=10):
+        """ The n nodes with the most samples of their own """
+        nodes = self.nodes.values()
+        nodes.sort(key=lambda node: node.samples, reverse=True)
+        return nodes[:n]
+
+    def inclusive_samples(self):
+        """
+        {(symbol, file): samples} estimating each symbol's samples
+        including everything below it in the call tree.  Callee arcs
+        only hold the callee's own samples, so each callee passes up
+        the share of its inclusive samples that its arc from the caller
+        has of its own samples.  Arcs back to a symbol still being
+        totalled (recursion) are left out, so nothing is counted twice.
+        """
+        nodes = self.nodes
+        totals = {}
+        on_path = set()
+        for root in nodes:
+            if root in totals:
+                continue
+            # iterative depth first walk; call chains can be deep
+            on_path.add(root)
+            stack = [(root, iter(nodes[root].calls))]
+            while stack:
+                key, callees = stack[-1]
+                for callee in callees:
+                    if callee not in totals and callee not in on_path \
+                           and callee in nodes:
+                        on_path.add(callee)
+                        stack.append((callee, iter(nodes[callee].calls)))
+                        break
+                else:
+                    stack.pop()
+                    on_path.discard(key)
+                    node = nodes[key]
+                    total = float(node.samples)
+                    for callee, samples in node.calls.iteritems():
+                        if callee not in totals:
+                            # recursion
+                            continue
+                        own = nodes[callee].samples or \
+                              sum(nodes[callee].called_by.itervalues())
+                        if own:
+                            share = min(1.0, float(samples) / own)
+                            total += totals[callee] * share
+                    totals[key] = total
+        return totals
+
+    def inclusive(self, symbol):
+        """ Estimated inclusive samples of symbol (a name, key or node),
+        see inclusive_samples() """
+        totals = self.inclusive_samples()
+        return sum([totals[node.key()] for node in self._resolve(symbol)])
+
+    def top_inclusive(self, n=10):
+        """ [(node, samples)] for the n nodes with the most estimated
+        inclusive samples """
+        totals = self.inclusive_samples()
+        nodes = [(self.nodes[key], samples)
+                 for key, samples in totals.iteritems()]
+        nodes.sort(key=lambda item: item[1], reverse=True)
+        return nodes[:n]
+
+    def _arcs(self, symbol, attribute, n):
+        arcs = {}
+        for node in self._resolve(symbol):
+            for key, samples in getattr(node, attribute).iteritems():
+                arcs[key] = arcs.get(key, 0) + samples
+        arcs = [(self.node(*key), samples) for key, samples in arcs.iteritems()]
+        arcs.sort(key=lambda arc: arc[1], reverse=True)
+        if n is not None:
+            arcs = arcs[:n]
+        return arcs
+
+    def callers(self, symbol, n=None):
+        """ [(caller node, samples)] for symbol (a name, key or node),
+        most samples first """
+        return self._arcs(symbol, 'called_by', n)
+
+    def callees(self, symbol, n=None):
+        """ [(callee node, samples)] for symbol (a name, key or node),
+        most samples first """
+        return self._arcs(symbol, 'calls', n)
+
+def _fields(line):
+    """ Parse a report line into (samples, percentage, file, symbol) """
+    fld1, fld2, fld3, fld4 = line.split(None, 3)
+    return (int(fld1), float(fld2), intern(fld3), intern(fld4.strip("\n")))
+
+def diff(profile_a, profile_b, n=None, inclusive=False):
+    """
+    Compare two profiles (CallGraphs or parsed SimPerfOProfileInterfaces)
+    by each symbol's share of all samples.  Returns
+    [(symbol, file, percent in a, percent in b, change)] with the
+    largest regressions first.  Shares rather than sample counts are
+    compared since profiles are rarely the same length.
+    """
+    if isinstance(profile_a, SimPerfOProfileInterface):
+        profile_a = profile_a.graph
+    if isinstance(profile_b, SimPerfOProfileInterface):
+        profile_b = profile_b.graph
+
+    def shares(graph):
+        total = float(graph.total_samples) or 1.0
+        if inclusive:
+            samples = graph.inclusive_samples()
+        else:
+            samples = dict([(key, node.samples)
+                            for key, node in graph.nodes.iteritems()])
+        result = {}
+        for key, count in samples.iteritems():
+            result[key] = 100.0 * count / total
+        return result
+
+    shares_a = shares(profile_a)
+    shares_b = shares(profile_b)
+    changes = []
+    for key in dict.fromkeys(shares_a.keys() + shares_b.keys()):
+        before = shares_a.get(key, 0.0)
+        after = shares_b.get(key, 0.0)
+        changes.append((key[0], key[1], before, after, after - before))
+    changes.sort(key=lambda change: change[4], reverse=True)
+    if n is not None:
+        changes = changes[:n]
+    return changes
+
+class SimPerfOProfileInterface:
+    def __init__(self, keep_result = True):
         self.isBrief = True             # public
         self.isValid = False            # public
         self.result = []                # public
+        self.graph = CallGraph()        # public
+        self._keep_result = keep_result # False to build only the graph
 
     def parse(self, input):
         in_samples = False
@@ -77,16 +264,8 @@ class SimPerfOProfileInterface:
             except ValueError:
                 pass
 
-    def _parseBrief(self, input, line1):
-        try:
-            fld1, fld2, fld3, fld4 = line1.split(None, 3)
-            self.result.append({"samples" : fld1,
-                                "percentage" : fld2,
-                                "file" : fld3,
-                                "symbol" : fld4.strip("\n")})
-        except ValueError:
-            pass
-        for line in input:
+    def _addBrief(self, line):
+        if self._keep_result:
             try:
                 fld1, fld2, fld3, fld4 = line.split(None, 3)
                 self.result.append({"samples" : fld1,
@@ -95,22 +274,46 @@ class SimPerfOProfileInterface:
                                     "symbol" : fld4.strip("\n")})
             except ValueError:
                 pass
+        # only lines with numeric samples and percentages go in the graph
+        try:
+            samples, percentage, file, symbol = _fields(line)
+        except ValueError:
+            return
+        node = self.graph.node(symbol, file)
+        node.samples += samples
+        node.percentage += percentage
+        self.graph.total_samples += samples
+
+    def _parseBrief(self, input, line1):
+        self._addBrief(line1)
+        for line in input:
+            self._addBrief(line)
 
     def _parseFull(self, input):
         state = 0       # In 'called_by' section
         calls = []
         called_by = []
         current = {}
+        keep_result = self._keep_result
+        graph = self.graph
+        node = None
+        node_calls = []
+        node_called_by = []
         for line in input:
             if line[0:6] == "------":
                 if len(current):
                     current["calls"] = calls
                     current["called_by"] = called_by
                     self.result.append(current)
+                if node is not None:
+                    self._link(node, node_calls, node_called_by)
                 state = 0
                 calls = []
                 called_by = []
                 current = {}
+                node = None
+                node_calls = []
+                node_called_by = []
             else:
                 try:
                     fld1, fld2, fld3, fld4 = line.split(None, 3)
@@ -120,37 +323,105 @@ class SimPerfOProfileInterface:
                            "symbol" : fld4.strip("\n")}
                 except ValueError:
                     continue
+                # only lines with numeric samples and percentages go in
+                # the graph; .result keeps them all
+                try:
+                    fields = _fields(line)
+                except ValueError:
+                    fields = None
                 if line[0] != " ":
-                    current = tmp
+                    if keep_result:
+                        current = tmp
+                    if fields is None:
+                        node = None
+                    else:
+                        node = graph.node(fields[3], fields[2])
+                        node.samples += fields[0]
+                        node.percentage += fields[1]
+                        graph.total_samples += fields[0]
                     state = 1       # In 'calls' section
                 elif state == 0:
-                    called_by.append(tmp)
+                    if keep_result:
+                        called_by.append(tmp)
+                    if fields is not None:
+                        node_called_by.append(fields)
                 else:
-                    calls.append(tmp)
+                    if keep_result:
+                        calls.append(tmp)
+                    if fields is not None:
+                        node_calls.append(fields)
         if len(current):
             current["calls"] = calls
             current["called_by"] = called_by
             self.result.append(current)
+        if node is not None:
+            self._link(node, node_calls, node_called_by)
+
+    def _link(self, node, calls, called_by):
+        for samples, percentage, file, symbol in calls:
+            if (symbol == node.symbol and file == node.file) or \
+                   symbol.endswith(" [self]"):
+                # oprofile lists a function's own samples as a callee too
+                continue
+            key = (symbol, file)
+            node.calls[key] = node.calls.get(key, 0) + samples
+            self.graph.node(symbol, file)
+        for samples, percentage, file, symbol in called_by:
+            key = (symbol, file)
+            node.called_by[key] = node.called_by.get(key, 0) + samples
+            self.graph.node(symbol, file)
 
 
 def main(argv=None):
-    opts, args = getopt.getopt(sys.argv[1:], "i:o:h", ["in=", "out=", "help"])
+    opts, args = getopt.getopt(sys.argv[1:], "i:o:t:d:h",
+                               ["in=", "out=", "top=", "diff=", "help"])
     input_file = sys.stdin
     output_file = sys.stdout
+    top = None
+    baseline = None
     for o, a in opts:
         if o in ("-i", "--in"):
             input_file = open(a, 'r')
         if o in ("-o", "--out"):
             output_file = open(a, 'w')
+        if o in ("-t", "--top"):
+            top = int(a)
+        if o in ("-d", "--diff"):
+            baseline = a
         if o in ("-h", "--help"):
             usage()
             sys.exit(0)
 
-    oprof = SimPerfOProfileInterface()
+    oprof = SimPerfOProfileInterface(keep_result = top is None and baseline is None)
     oprof.parse(input_file)
     if input_file != sys.stdin:
         input_file.close()
 
+    if baseline is not None:
+        before = SimPerfOProfileInterface(keep_result = False)
+        baseline_file = open(baseline, 'r')
+        before.parse(baseline_file)
+        baseline_file.close()
+        changes = [{"symbol" : symbol,
+                    "file" : file,
+                    "before" : a,
+                    "after" : b,
+                    "change" : change}
+                   for symbol, file, a, b, change in diff(before, oprof, top)]
+        print >>output_file, simplejson.dumps(changes)
+        return 0
+
+    if top is not None:
+        print >>output_file, simplejson.dumps(
+            {"self" : [{"symbol" : node.symbol,
+                        "file" : node.file,
+                        "samples" : node.samples} for node in oprof.graph.top_self(top)],
+             "inclusive" : [{"symbol" : node.symbol,
+                             "file" : node.file,
+                             "samples" : samples}
+                            for node, samples in oprof.graph.top_inclusive(top)]})
+        return 0
+
     # Create JSONable dict with interesting data and format/print it
     print >>output_file, simplejson.dumps(oprof.result)
 
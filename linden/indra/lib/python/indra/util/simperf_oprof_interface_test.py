@@ -0,0 +1,161 @@
+"""\
+@file simperf_oprof_interface_test.py
+@brief Test cases for the OProfile report call graph.
+
+$LicenseInfo:firstyear=2009&license=mit$
+
+Copyright (c) 2009, Linden Research, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+$/LicenseInfo$
+"""
+
+import unittest
+
+from indra.util.simperf_oprof_interface import SimPerfOProfileInterface, \
+     diff
+
+HEADER = """\
+CPU: Core 2, speed 2400 MHz (estimated)
+Counted CPU_CLK_UNHALTED events with a unit mask of 0x00 (Unhalted core cycles)
+samples  %        image name               symbol name
+"""
+
+SEPARATOR = "-" * 79 + "\n"
+
+# main -> frame -> (physics -> step, render), and main -> a <-> b
+FULL_REPORT = HEADER + SEPARATOR + """\
+10        4.0000  simulator                main
+  100     40.0000  simulator                frame
+  6        2.4000  simulator                a
+  10       4.0000  simulator                main [self]
+""" + SEPARATOR + """\
+  100     100.000  simulator                main
+100      40.0000  simulator                frame
+  60      24.0000  simulator                physics
+  30      12.0000  simulator                render
+  100     40.0000  simulator                frame [self]
+""" + SEPARATOR + """\
+  60      100.000  simulator                frame
+60       24.0000  simulator                physics
+  20       8.0000  libphysics.so            step
+""" + SEPARATOR + """\
+  20      100.000  simulator                physics
+20        8.0000  libphysics.so            step
+""" + SEPARATOR + """\
+  30      100.000  simulator                frame
+30       12.0000  simulator                render
+  (no symbols)
+""" + SEPARATOR + """\
+  6        60.000  simulator                main
+  4        40.000  simulator                b
+10        4.0000  simulator                a
+  4        1.6000  simulator                b
+""" + SEPARATOR + """\
+  4       100.000  simulator                a
+4         1.6000  simulator                b
+  4        1.6000  simulator                a
+""" + SEPARATOR
+
+BRIEF_REPORT = HEADER + """\
+150      60.0000  simulator                frame
+50       20.0000  libphysics.so            step
+n/a      n/a      simulator                (no symbols)
+50       20.0000  simulator                main
+"""
+
+def _parse(report):
+    oprof = SimPerfOProfileInterface()
+    oprof.parse(iter(report.splitlines(True)))
+    return oprof
+
+class TestCallGraph(unittest.TestCase):
+    def setUp(self):
+        self.oprof = _parse(FULL_REPORT)
+        self.graph = self.oprof.graph
+
+    def test_parse_full(self):
+        self.assert_(self.oprof.isValid)
+        self.failIf(self.oprof.isBrief)
+        self.assertEquals(len(self.oprof.result), 7)
+        self.assertEquals(self.oprof.result[1]['symbol'], 'frame')
+        self.assertEquals([c['symbol'] for c in self.oprof.result[1]['calls']],
+                          ['physics', 'render', 'frame [self]'])
+        self.assertEquals(self.graph.total_samples, 234)
+        frame = self.graph.nodes[('frame', 'simulator')]
+        self.assertEquals(frame.samples, 100)
+        # the [self] line is not a callee
+        self.assertEquals(frame.calls, {('physics', 'simulator'): 60,
+                                        ('render', 'simulator'): 30})
+        self.assertEquals(frame.called_by, {('main', 'simulator'): 100})
+        self.assertEquals([node.file for node in self.graph.find('step')],
+                          ['libphysics.so'])
+
+    def test_callers_and_callees(self):
+        self.assertEquals([(node.symbol, samples) for node, samples
+                           in self.graph.callees('frame')],
+                          [('physics', 60), ('render', 30)])
+        self.assertEquals([(node.symbol, samples) for node, samples
+                           in self.graph.callers('a')],
+                          [('main', 6), ('b', 4)])
+        self.assertEquals(len(self.graph.callees('frame', 1)), 1)
+
+    def test_top(self):
+        self.assertEquals([node.symbol for node in self.graph.top_self(3)],
+                          ['frame', 'physics', 'render'])
+        top = self.graph.top_inclusive(4)
+        self.assertEquals([node.symbol for node, samples in top],
+                          ['main', 'frame', 'physics', 'render'])
+
+    def test_inclusive(self):
+        # deeper than one level: frame gets step's samples through physics
+        self.assertEquals(self.graph.inclusive('step'), 20)
+        self.assertEquals(self.graph.inclusive('physics'), 80)
+        self.assertEquals(self.graph.inclusive('frame'), 210)
+        # a and b call each other; the recursion is counted once
+        a = self.graph.inclusive('a')
+        b = self.graph.inclusive('b')
+        self.assert_(10 <= a <= 14, a)
+        self.assert_(4 <= b <= 8, b)
+        main = self.graph.inclusive(('main', 'simulator'))
+        self.assert_(226 <= main <= 220 + 0.6 * 14, main)
+
+    def test_parse_brief(self):
+        oprof = _parse(BRIEF_REPORT)
+        self.assert_(oprof.isBrief)
+        self.assertEquals(len(oprof.result), 4)
+        self.assertEquals(oprof.result[2]['samples'], 'n/a')
+        self.assertEquals(oprof.graph.total_samples, 250)
+        self.assertEquals(sorted(oprof.graph.nodes.keys()),
+                          [('frame', 'simulator'), ('main', 'simulator'),
+                           ('step', 'libphysics.so')])
+
+    def test_diff(self):
+        changes = diff(_parse(BRIEF_REPORT), self.oprof)
+        self.assertEquals(changes[0][:2], ('physics', 'simulator'))
+        self.assertAlmostEquals(changes[0][4], 100.0 * 60 / 234)
+        self.assertEquals(changes[-1][:2], ('frame', 'simulator'))
+        self.assertAlmostEquals(changes[-1][4], 100.0 * 100 / 234 - 60.0)
+        self.assertEquals(len(diff(self.graph, self.graph, 2)), 2)
+        self.failIf([change for change
+                     in diff(self.graph, self.graph, inclusive=True)
+                     if change[4]])
+
+if __name__ == '__main__':
+    unittest.main()
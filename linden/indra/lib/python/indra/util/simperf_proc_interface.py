@@ -5,19 +5,174 @@
 # files that contain performance statistics.
 
 # ----------------------------------------------------
-import sys, os
+import sys, os, re, struct, fcntl, time
 
 if os.path.exists("setup-path.py"):
     execfile("setup-path.py")
 
 from indra.base import llsd
+from indra.util import llperformance
 
 DEFAULT_PATH="/dev/shm/simperf/"
 
 
+# ----------------------------------------------------
+# Sidecar timestamp index, <log file>.idx.  A header followed by one
+# (byte offset, timestamp) entry for every INDEX_INTERVAL-th frame line.
+# The header records how far into the log the index reaches, so each
+# update only reads what has been appended since; a log that shrank, was
+# replaced (new inode) or was rewritten in place (changed since it was
+# indexed, but not by an append) is indexed again from the start.
+INDEX_SUFFIX = ".idx"
+INDEX_MAGIC = "LLPIDX02"
+INDEX_INTERVAL = 64
+INDEX_TAIL = 16
+_index_header = struct.Struct('<8sIIQQqqd16s')  # magic, interval, frames
+                                            # since last entry, indexed
+                                            # bytes, inode, first/last
+                                            # timestamp, log mtime, last
+                                            # INDEX_TAIL indexed bytes
+_index_entry = struct.Struct('<Qq')          # offset, timestamp
+
+_timestamp_re = re.compile(r"""['"]timestamp['"]:i?(-?\d+)""")
+
+def _frame_timestamp(line):
+    """ Return the timestamp of a frame line, or None """
+    # Nested maps may carry their own 'timestamp', so only trust the
+    # quick match if it is the only one.
+    matches = _timestamp_re.findall(line)
+    if len(matches) == 1:
+        return int(matches[0])
+    try:
+        return int(llsd.parse(line)['timestamp'])
+    except:
+        return None
+
+def _tail(sourcefile, indexed):
+    """ The INDEX_TAIL bytes before indexed, as stored in the header;
+    sourcefile must be positioned at their start """
+    return sourcefile.read(min(indexed, INDEX_TAIL)).ljust(INDEX_TAIL, '\0')
+
+def update_logfile_index(filename, interval=INDEX_INTERVAL):
+    """ Bring <filename>.idx up to date with the log and return its
+    header as (entry count, first timestamp, last timestamp) """
+    index_name = filename + INDEX_SUFFIX
+    sourcefile = open(filename, 'rb')
+    try:
+        try:
+            indexfile = open(index_name, 'r+b')
+        except IOError:
+            indexfile = open(index_name, 'w+b')
+        try:
+            fcntl.flock(indexfile.fileno(), fcntl.LOCK_EX)
+            log_stat = os.fstat(sourcefile.fileno())
+            header = indexfile.read(_index_header.size)
+            if len(header) == _index_header.size:
+                (magic, cur_interval, pending, indexed, inode,
+                 first_time, last_time, mod_time, tail) = \
+                 _index_header.unpack(header)
+            else:
+                magic = None
+            stale = magic != INDEX_MAGIC or cur_interval != interval or \
+                    inode != log_stat.st_ino or indexed > log_stat.st_size
+            if not stale and mod_time != log_stat.st_mtime:
+                # Changed since it was indexed.  Only an append, which
+                # leaves the indexed bytes alone, keeps the index.
+                if indexed == log_stat.st_size:
+                    stale = True
+                else:
+                    sourcefile.seek(max(0, indexed - INDEX_TAIL))
+                    stale = _tail(sourcefile, indexed) != tail
+            if stale:
+                pending, indexed, first_time, last_time = 0, 0, -1, -1
+                indexfile.truncate(_index_header.size)
+
+            sourcefile.seek(indexed)
+            if indexed == 0:
+                # The first line is the meta info line.
+                info_line = sourcefile.readline()
+                if not info_line.endswith('\n'):
+                    return (0, None, None)
+                indexed = sourcefile.tell()
+
+            entries = []
+            while True:
+                line = sourcefile.readline()
+                if not line.endswith('\n'):
+                    # nothing more, or a frame still being written
+                    break
+                timestamp = _frame_timestamp(line)
+                if timestamp is not None:
+                    if pending == 0:
+                        entries.append(_index_entry.pack(indexed, timestamp))
+                    pending = (pending + 1) % interval
+                    if first_time < 0:
+                        first_time = timestamp
+                    last_time = timestamp
+                indexed += len(line)
+
+            indexfile.seek(0, 2)
+            indexfile.write(''.join(entries))
+            count = (indexfile.tell() - _index_header.size) / _index_entry.size
+            sourcefile.seek(max(0, indexed - INDEX_TAIL))
+            indexfile.seek(0)
+            indexfile.write(_index_header.pack(INDEX_MAGIC, interval, pending,
+                                               indexed, log_stat.st_ino,
+                                               first_time, last_time,
+                                               log_stat.st_mtime,
+                                               _tail(sourcefile, indexed)))
+        finally:
+            indexfile.close()
+    finally:
+        sourcefile.close()
+    if first_time < 0:
+        return (count, None, None)
+    return (count, first_time, last_time)
+
+def _find_logfile_offset(filename, count, start_time):
+    """ Binary search the index for the offset of the last indexed frame
+    before start_time """
+    indexfile = open(filename + INDEX_SUFFIX, 'rb')
+    try:
+        low, high = 0, count
+        offset = None
+        while low < high:
+            middle = (low + high) // 2
+            indexfile.seek(_index_header.size + middle * _index_entry.size)
+            (entry_offset, timestamp) = _index_entry.unpack(
+                indexfile.read(_index_entry.size))
+            if timestamp < start_time:
+                offset = entry_offset
+                low = middle + 1
+            else:
+                high = middle
+        if offset is None and count:
+            # start_time is before the first indexed frame
+            indexfile.seek(_index_header.size)
+            (offset, timestamp) = _index_entry.unpack(
+                indexfile.read(_index_entry.size))
+        return offset
+    finally:
+        indexfile.close()
+
+def _trim_frame(partial_doc, target_column):
+    if target_column is None:
+        return partial_doc
+    trim_doc = { target_column: partial_doc[target_column] }
+    if target_column != "fps":
+        trim_doc[ 'fps' ] = partial_doc[ 'fps' ]
+    trim_doc[ '/total_time' ] = partial_doc[ '/total_time' ]
+    trim_doc[ 'utc_time' ] = partial_doc[ 'utc_time' ]
+    return trim_doc
+
 # ----------------------------------------------------
 # Pull out the stats and return a single document
-def parse_logfile(filename, target_column=None, verbose=False):
+def parse_logfile(filename, target_column=None, verbose=False,
+                  start_time=None, end_time=None):
+    if start_time is not None or end_time is not None:
+        return _parse_logfile_window(filename, target_column, verbose,
+                                     start_time, end_time)
+
     full_doc = []
     # Open source temp log file.  Let exceptions percolate up.
     sourcefile = open( filename,'r')
@@ -29,19 +184,67 @@ def parse_logfile(filename, target_column=None, verbose=False):
     for line in sourcefile.xreadlines():
         partial_doc = llsd.parse(line)
         if partial_doc is not None:
-            if target_column is None:
-                full_doc.append(partial_doc)
-            else:
-                trim_doc = { target_column: partial_doc[target_column] }
-                if target_column != "fps":
-                    trim_doc[ 'fps' ] = partial_doc[ 'fps' ]
-                trim_doc[ '/total_time' ] = partial_doc[ '/total_time' ]
-                trim_doc[ 'utc_time' ] = partial_doc[ 'utc_time' ]
-                full_doc.append(trim_doc)
+            full_doc.append(_trim_frame(partial_doc, target_column))
 
     sourcefile.close()
     return full_doc
 
+def _parse_logfile_window(filename, target_column, verbose, start_time, end_time):
+    """ Return the frames with start_time <= timestamp <= end_time, seeking
+    to them through the sidecar index """
+    full_doc = []
+    if verbose:
+        print "Reading " + filename
+
+    if target_column is None:
+        sourcefile = open(filename, 'r')
+        try:
+            info_line = sourcefile.readline()
+        finally:
+            sourcefile.close()
+        if not info_line:
+            return full_doc
+        full_doc.append(llsd.parse(info_line))
+    full_doc.extend(iter_logfile_window(filename, start_time, end_time,
+                                        target_column))
+    return full_doc
+
+def iter_logfile_window(filename, start_time=None, end_time=None,
+                        target_column=None):
+    """ Yield the frames with start_time <= timestamp <= end_time one at a
+    time, without the meta info line, seeking to them through the sidecar
+    index """
+    sourcefile = open(filename, 'r')
+    try:
+        if not sourcefile.readline():
+            return
+        offset = None
+        if start_time is not None:
+            try:
+                (count, first_time, last_time) = update_logfile_index(filename)
+                offset = _find_logfile_offset(filename, count, start_time)
+            except (IOError, OSError):
+                # No index in a read-only directory; scan instead.
+                pass
+        if offset is not None:
+            sourcefile.seek(offset)
+
+        # Frames are in time order; check the timestamp before parsing
+        # the whole frame.
+        for line in sourcefile.xreadlines():
+            timestamp = _frame_timestamp(line)
+            if timestamp is None:
+                continue
+            if start_time is not None and timestamp < start_time:
+                continue
+            if end_time is not None and timestamp > end_time:
+                break
+            partial_doc = llsd.parse(line)
+            if partial_doc is not None:
+                yield _trim_frame(partial_doc, target_column)
+    finally:
+        sourcefile.close()
+
 # Extract just the meta info line, and the timestamp of the first/last frame entry.
 def parse_logfile_info(filename, verbose=False):
     # Open source temp log file.  Let exceptions percolate up.
@@ -52,58 +255,50 @@ def parse_logfile_info(filename, verbose=False):
 
     # The first line is the meta info line.
     info_line = sourcefile.readline()
+    sourcefile.close()
     if not info_line:
-        sourcefile.close()
         return None
 
-    # The rest of the lines are frames.  Read the first and last to get the time range.
+    # The sidecar index knows the first and last frame times.
     info = llsd.parse( info_line )
-    info['start_time'] = None
-    info['end_time'] = None
-    first_frame = sourcefile.readline()
-    if first_frame:
-        try:
-            info['start_time'] = int(llsd.parse(first_frame)['timestamp'])
-        except:
-            pass
-
-    # Read the file backwards to find the last two lines.
-    sourcefile.seek(0, 2)
-    file_size = sourcefile.tell()
-    offset = 1024
-    num_attempts = 0
-    end_time = None
-    if file_size < offset:
-        offset = file_size
-    while 1:
-        sourcefile.seek(-1*offset, 2)
-        read_str = sourcefile.read(offset)
-        # Remove newline at the end
-        if read_str[offset - 1] == '\n':
-            read_str = read_str[0:-1]
-        lines = read_str.split('\n')
-        full_line = None
-        if len(lines) > 2:  # Got two line
-            try:
-                end_time = llsd.parse(lines[-1])['timestamp']
-            except:
-                # We couldn't parse this line.  Try once more.
-                try:
-                    end_time = llsd.parse(lines[-2])['timestamp']
-                except:
-                    # Nope.  Just move on.
-                    pass
-            break
-        if len(read_str) == file_size:   # Reached the beginning
-            break
-        offset += 1024
-
-    info['end_time'] = int(end_time)
-
-    sourcefile.close()
+    try:
+        (count, info['start_time'], info['end_time']) = update_logfile_index(filename)
+    except (IOError, OSError):
+        # No index in a read-only directory; scan instead.
+        frames = parse_logfile(filename)[1:]
+        info['start_time'] = None
+        info['end_time'] = None
+        if frames:
+            info['start_time'] = int(frames[0]['timestamp'])
+            info['end_time'] = int(frames[-1]['timestamp'])
     return info
     
 
+# Extract the block map written by indra.util.llperformance.
+def parse_perf_logfile(filename, verbose=False):
+    """ Return (process info, block map) from an llperformance output file """
+    sourcefile = open(filename, 'r')
+    if verbose:
+        print "Reading " + filename
+    try:
+        info = llsd.parse(sourcefile.readline())
+        block_map = llsd.parse(sourcefile.readline())
+    finally:
+        sourcefile.close()
+    return info, block_map
+
+def get_perf_percentiles(block_map, percentiles=(50, 95, 99, 99.9)):
+    """ Return { path: { 'p50': us, 'p95': us, ... } } for a block map """
+    result = {}
+    for path, stats in block_map.iteritems():
+        summary = llperformance.block_percentiles(stats, percentiles)
+        if summary is not None:
+            summary['count'] = stats['count']
+            summary['min_us'] = stats.get('min_us')
+            summary['max_us'] = stats.get('max_us')
+            result[path] = summary
+    return result
+
 def parse_proc_filename(filename):
     try:
         name_as_list = filename.split(".")
@@ -126,7 +321,8 @@ def get_simstats_list(path=None):
                 simstats_list.append(simstats_info)
     return simstats_list
 
-def get_log_info_list(pid=None, stat_type=None, path=None, target_column=None, verbose=False):
+def get_log_info_list(pid=None, stat_type=None, path=None, target_column=None, verbose=False,
+                      start_time=None, end_time=None):
     """ Return data from all llsd files matching the pid and stat type """
     if path is None:
         path = DEFAULT_PATH
@@ -140,9 +336,178 @@ def get_log_info_list(pid=None, stat_type=None, path=None, target_column=None, v
                 continue
             if stat_type is not None and stat_type != cur_stat_type:
                 continue
-            log_info_list[cur_pid] = parse_logfile(path + file_name, target_column, verbose)
+            log_info_list[cur_pid] = parse_logfile(path + file_name, target_column, verbose,
+                                                   start_time, end_time)
     return log_info_list
 
+def get_perf_percentiles_list(pid=None, stat_type=None, path=None,
+                              percentiles=(50, 95, 99, 99.9), verbose=False):
+    """ Return per-path percentiles from all llperformance files matching
+    the pid and stat type, as { pid: { path: { 'p50': us, ... } } } """
+    if path is None:
+        path = DEFAULT_PATH
+    percentiles_list = {}
+    for file_name in os.listdir ( path ):
+        if file_name.endswith(".llsd") and file_name != "simperf_proc_config.llsd":
+            (cur_pid, cur_stat_type) = parse_proc_filename(file_name)
+            if cur_pid is None:
+                continue
+            if pid is not None and pid != cur_pid:
+                continue
+            if stat_type is not None and stat_type != cur_stat_type:
+                continue
+            try:
+                info, block_map = parse_perf_logfile(path + file_name, verbose)
+            except Exception:
+                # not an llperformance file
+                continue
+            if isinstance(block_map, dict):
+                percentiles_list[cur_pid] = get_perf_percentiles(block_map,
+                                                                 percentiles)
+    return percentiles_list
+
+def get_live_stats_list(pid=None, stat_type=None, path=None):
+    """ Return { pid: (info, block map) } read from the live shared-memory
+    exports (<type>_proc.<pid>.shm) of running processes """
+    if path is None:
+        path = DEFAULT_PATH
+    live_stats_list = {}
+    for file_name in os.listdir(path):
+        if file_name.endswith(".shm"):
+            (cur_pid, cur_stat_type) = parse_proc_filename(file_name)
+            if cur_pid is None:
+                continue
+            if pid is not None and pid != cur_pid:
+                continue
+            if stat_type is not None and stat_type != cur_stat_type:
+                continue
+            try:
+                live_stats_list[cur_pid] = llperformance.read_live_stats(path + file_name)
+            except (IOError, ValueError):
+                # the process exited or is still setting up
+                continue
+    return live_stats_list
+
+class SimPerfFollower(object):
+    """ Tail the <type>_proc.<pid>.llsd files in a directory, returning
+    only frames written since the previous poll.  The directory is listed
+    again only when its mtime changes, and a file that shrinks or is
+    replaced is read again from the start. """
+    def __init__(self, pid=None, stat_type=None, path=None, columns=None,
+                 verbose=False):
+        if path is None:
+            path = DEFAULT_PATH
+        self.pid = pid
+        self.stat_type = stat_type
+        self.path = path
+        self.columns = columns
+        self.verbose = verbose
+        self.info = {}          # pid -> meta info line
+        self._files = {}        # file name -> _FollowedFile
+        self._dir_mtime = None
+
+    def _scan(self):
+        dir_mtime = os.stat(self.path).st_mtime
+        if dir_mtime == self._dir_mtime:
+            return
+        self._dir_mtime = dir_mtime
+        names = os.listdir(self.path)
+        for file_name in names:
+            if file_name in self._files:
+                continue
+            if not file_name.endswith(".llsd") or file_name == "simperf_proc_config.llsd":
+                continue
+            (cur_pid, cur_stat_type) = parse_proc_filename(file_name)
+            if cur_pid is None:
+                continue
+            if self.pid is not None and self.pid != cur_pid:
+                continue
+            if self.stat_type is not None and self.stat_type != cur_stat_type:
+                continue
+            if self.verbose:
+                print "Following " + file_name
+            self._files[file_name] = _FollowedFile(cur_pid)
+        for file_name in self._files.keys():
+            if file_name not in names:
+                del self._files[file_name]
+
+    def _trim(self, frame):
+        if self.columns is None:
+            return frame
+        trim_doc = {}
+        for column in self.columns:
+            if column in frame:
+                trim_doc[column] = frame[column]
+        for column in ('timestamp', 'utc_time'):
+            if column in frame:
+                trim_doc[column] = frame[column]
+        return trim_doc
+
+    def poll(self):
+        """ Return [(pid, frame), ...] for frames written since the last
+        call """
+        self._scan()
+        frames = []
+        for file_name, followed in self._files.items():
+            try:
+                lines = followed.read(os.path.join(self.path, file_name))
+            except (IOError, OSError):
+                # removed between the listing and the read
+                continue
+            for line in lines:
+                if not line.strip():
+                    # llsd.parse('') is False, not None
+                    continue
+                doc = llsd.parse(line)
+                if doc is None:
+                    continue
+                if followed.info is None:
+                    followed.info = self.info[followed.pid] = doc
+                else:
+                    frames.append((followed.pid, self._trim(doc)))
+        return frames
+
+    def follow(self, interval=1.0):
+        """ Generate (pid, frame) forever, checking for new frames every
+        interval seconds """
+        while True:
+            frames = self.poll()
+            if not frames:
+                time.sleep(interval)
+            for frame in frames:
+                yield frame
+
+class _FollowedFile(object):
+    def __init__(self, pid):
+        self.pid = pid
+        self.info = None
+        self.inode = None
+        self.offset = 0
+        self.partial = ''
+
+    def read(self, filename):
+        """ Return the complete lines appended since the last read """
+        sourcefile = open(filename, 'r')
+        try:
+            file_stat = os.fstat(sourcefile.fileno())
+            if file_stat.st_ino != self.inode or file_stat.st_size < self.offset:
+                # new or rotated file
+                self.inode = file_stat.st_ino
+                self.offset = 0
+                self.partial = ''
+                self.info = None
+            if file_stat.st_size == self.offset:
+                return []
+            sourcefile.seek(self.offset)
+            data = sourcefile.read(file_stat.st_size - self.offset)
+        finally:
+            sourcefile.close()
+        self.offset += len(data)
+        lines = (self.partial + data).split('\n')
+        # the last piece is a line still being written, or ''
+        self.partial = lines.pop()
+        return lines
+
 def delete_simstats_files(pid=None, stat_type=None, path=None):
     """ Delete *.<pid>.llsd files """
     if path is None:
@@ -159,6 +524,8 @@ def delete_simstats_files(pid=None, stat_type=None, path=None):
                 continue
             del_list.append(cur_pid)
             # Allow delete related exceptions to percolate up if this fails.
-            os.unlink(os.path.join(DEFAULT_PATH, file_name))
+            os.unlink(os.path.join(path, file_name))
+            if os.path.exists(os.path.join(path, file_name + INDEX_SUFFIX)):
+                os.unlink(os.path.join(path, file_name + INDEX_SUFFIX))
     return del_list
 
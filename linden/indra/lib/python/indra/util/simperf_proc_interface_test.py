@@ -0,0 +1,219 @@
+"""\
+@file simperf_proc_interface_test.py
+@brief Test cases for reading simperf proc logs.
+
+$LicenseInfo:firstyear=2009&license=mit$
+
+Copyright (c) 2009, Linden Research, Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+$/LicenseInfo$
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from indra.base import llsd
+from indra.util import simperf_proc_interface
+from indra.util.simperf_proc_interface import parse_logfile, \
+     parse_logfile_info, update_logfile_index, iter_logfile_window, \
+     SimPerfFollower
+
+def _frame(i, value=None):
+    if value is None:
+        value = i
+    return {'timestamp': 1000 + i * 10, 'fps': 45.0, 'utc_time': 'now',
+            '/total_time': {'us': value, 'timestamp': 1},
+            'frame': value}
+
+class _ProcLog(object):
+    def __init__(self, path, pid=101):
+        self.filename = os.path.join(path, 'sim_proc.%d.llsd' % pid)
+        self.pid = pid
+        output = open(self.filename, 'w')
+        output.write(llsd.format_notation({'name': 'sim', 'pid': pid}) + '\n')
+        output.close()
+
+    def append(self, text):
+        output = open(self.filename, 'a')
+        output.write(text)
+        output.close()
+
+    def append_frames(self, frames):
+        self.append(''.join([llsd.format_notation(frame) + '\n'
+                             for frame in frames]))
+
+class TestLogfileIndex(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.log = _ProcLog(self.dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def window(self, start, end):
+        return [frame['frame'] for frame
+                in parse_logfile(self.log.filename, start_time=start,
+                                 end_time=end)[1:]]
+
+    def test_window_matches_scan(self):
+        self.log.append_frames([_frame(i) for i in xrange(300)])
+        everything = parse_logfile(self.log.filename)
+        self.assertEquals(len(everything), 301)
+        for start, end in [(None, None), (0, 5000), (1000, 1000),
+                           (1005, 1055), (1640, None), (None, 1639),
+                           (3990, 4100), (5000, None), (None, 999)]:
+            expected = [frame['frame'] for frame in everything[1:]
+                        if (start is None or frame['timestamp'] >= start)
+                        and (end is None or frame['timestamp'] <= end)]
+            self.assertEquals(self.window(start, end), expected,
+                              (start, end))
+        self.assertEquals(parse_logfile(self.log.filename, 'frame',
+                                        start_time=1010, end_time=1010),
+                          [{'frame': 1, 'fps': 45.0, 'utc_time': 'now',
+                            '/total_time': {'us': 1, 'timestamp': 1}}])
+
+    def test_iter_window(self):
+        self.log.append_frames([_frame(i) for i in xrange(300)])
+        frames = iter_logfile_window(self.log.filename, 1005, 1055)
+        self.assertEquals(frames.next()['frame'], 1)
+        self.assertEquals([frame['frame'] for frame in frames], [2, 3, 4, 5])
+        self.assertEquals(len(list(iter_logfile_window(self.log.filename))),
+                          300)
+        self.assertEquals(list(iter_logfile_window(self.log.filename,
+                                                   end_time=999)), [])
+
+    def test_index_follows_appends(self):
+        self.log.append_frames([_frame(i) for i in xrange(100)])
+        self.assertEquals(update_logfile_index(self.log.filename, 16),
+                          (7, 1000, 1990))
+        # a frame still being written is left for the next update
+        partial = llsd.format_notation(_frame(100))
+        self.log.append(partial[:10])
+        self.assertEquals(update_logfile_index(self.log.filename, 16),
+                          (7, 1000, 1990))
+        self.log.append(partial[10:] + '\n')
+        self.log.append_frames([_frame(i) for i in xrange(101, 150)])
+        self.assertEquals(update_logfile_index(self.log.filename, 16),
+                          (10, 1000, 2490))
+        self.assertEquals(self.window(1985, 2005), [99, 100])
+        info = parse_logfile_info(self.log.filename)
+        self.assertEquals((info['pid'], info['start_time'],
+                           info['end_time']), (101, 1000, 2490))
+
+    def test_rewritten_in_place(self):
+        self.log.append_frames([_frame(i, 100 + i) for i in xrange(50)])
+        self.assertEquals(self.window(1100, 1100), [110])
+        size = os.path.getsize(self.log.filename)
+        inode = os.stat(self.log.filename).st_ino
+        # rewrite it in place, as llperformance does, with the same
+        # size but frames at other times
+        output = open(self.log.filename, 'r+')
+        output.write(llsd.format_notation({'name': 'sim', 'pid': 101}) + '\n')
+        output.write(''.join([llsd.format_notation(
+            dict(_frame(i + 50, 100 + i), timestamp=1500 + i * 10)) + '\n'
+                              for i in xrange(50)]))
+        output.close()
+        os.utime(self.log.filename, (0, 0))
+        self.assertEquals(os.path.getsize(self.log.filename), size)
+        self.assertEquals(os.stat(self.log.filename).st_ino, inode)
+        self.assertEquals(update_logfile_index(self.log.filename)[1:],
+                          (1500, 1990))
+        self.assertEquals(self.window(1600, 1600), [110])
+
+        # and rewritten again, longer
+        output = open(self.log.filename, 'r+')
+        output.write(llsd.format_notation({'name': 'sim', 'pid': 101}) + '\n')
+        output.write(''.join([llsd.format_notation(_frame(i, 200 + i)) + '\n'
+                              for i in xrange(60)]))
+        output.close()
+        os.utime(self.log.filename, (1, 1))
+        self.assertEquals(update_logfile_index(self.log.filename)[1:],
+                          (1000, 1590))
+        self.assertEquals(self.window(1100, 1100), [210])
+
+    def test_shrunk(self):
+        self.log.append_frames([_frame(i) for i in xrange(50)])
+        update_logfile_index(self.log.filename)
+        _ProcLog(self.dir).append_frames([_frame(i) for i in xrange(5)])
+        self.assertEquals(update_logfile_index(self.log.filename)[1:],
+                          (1000, 1040))
+
+    def test_delete(self):
+        self.log.append_frames([_frame(i) for i in xrange(5)])
+        update_logfile_index(self.log.filename)
+        other = _ProcLog(self.dir, 102)
+        self.assertEquals(simperf_proc_interface.delete_simstats_files(
+            '101', path=self.dir), ['101'])
+        self.assertEquals(os.listdir(self.dir),
+                          [os.path.basename(other.filename)])
+
+class TestFollower(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def poll(self, follower):
+        return sorted([(pid, frame['frame']) for pid, frame
+                       in follower.poll()])
+
+    def test_follow(self):
+        first = _ProcLog(self.dir, 101)
+        first.append_frames([_frame(0), _frame(1)])
+        open(os.path.join(self.dir, 'simperf_proc_config.llsd'),
+             'w').write("{'duration':i60}\n")
+        follower = SimPerfFollower(path=self.dir)
+        self.assertEquals(self.poll(follower), [('101', 0), ('101', 1)])
+        self.assertEquals(follower.info['101']['pid'], 101)
+        self.assertEquals(self.poll(follower), [])
+
+        # blank lines and a frame still being written
+        partial = llsd.format_notation(_frame(2))
+        first.append('\n\n' + partial[:7])
+        self.assertEquals(self.poll(follower), [])
+        first.append(partial[7:] + '\n')
+        second = _ProcLog(self.dir, 102)
+        second.append_frames([_frame(5)])
+        self.assertEquals(self.poll(follower), [('101', 2), ('102', 5)])
+
+        # a replaced file is read from the start
+        os.unlink(first.filename)
+        first = _ProcLog(self.dir, 101)
+        first.append_frames([_frame(7)])
+        self.assertEquals(self.poll(follower), [('101', 7)])
+        os.unlink(second.filename)
+        self.assertEquals(self.poll(follower), [])
+        self.assertEquals(follower._files.keys(),
+                          [os.path.basename(first.filename)])
+
+    def test_filters(self):
+        _ProcLog(self.dir, 101).append_frames([_frame(1)])
+        _ProcLog(self.dir, 102).append_frames([_frame(2)])
+        follower = SimPerfFollower(pid='102', path=self.dir,
+                                   columns=['frame'])
+        self.assertEquals(follower.poll(),
+                          [('102', {'frame': 2, 'timestamp': 1020,
+                                    'utc_time': 'now'})])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -144,8 +144,9 @@ def fetch(url):
         # *FIX: this doesn't throw an exception for a 404, and oddly enough the sl.com 404 page actually gets parsed successfully
         return ''.join(urllib.urlopen(url).readlines())   
 
-def cache_master(master_url):
-    """Using the url for the master, updates the local cache, and returns an url to the local cache."""
+def cache_master(master_url, parse=llmessage.parseTemplateString):
+    """Using the url for the master, updates the local cache, and returns an url to the local cache.
+    parse is used to check a new master before it is cached."""
     master_cache = local_master_cache_filename()
     master_cache_url = 'file://' + master_cache
     # decide whether to refresh the master cache based on its age
@@ -157,7 +158,7 @@ def cache_master(master_url):
     print "Refreshing master cache from %s" % master_url
     def get_and_test_master():
         new_master_contents = fetch(master_url)
-        llmessage.parseTemplateString(new_master_contents)
+        parse(new_master_contents)
         return new_master_contents
     try:
         new_master_contents = retry(3, get_and_test_master)
@@ -230,6 +231,10 @@ http://wiki.secondlife.com/wiki/Template_verifier.py
     parser.add_option(
         '-c', '--cache_master', action='store_true', dest='cache_master',
         default=False,  help="""Set to true to attempt use local cached copy of the master template.""")
+    parser.add_option(
+        '--no_parse_cache', action='store_false', dest='parse_cache',
+        default=True, help="""Always parse the templates instead of loading parsed templates
+cached by content hash in %s.""" % llmessage.defaultTemplateCacheDir())
 
     options, args = parser.parse_args(sysargs)
 
@@ -266,17 +271,22 @@ http://wiki.secondlife.com/wiki/Template_verifier.py
         print "current:", current_filename
         current_url = 'file://%s' % current_filename
 
+    if options.parse_cache:
+        parse = llmessage.parseTemplateStringCached
+    else:
+        parse = llmessage.parseTemplateString
+
     # retrieve the contents of the local template and check for syntax
     current = fetch(current_url)
-    current_parsed = llmessage.parseTemplateString(current)
+    current_parsed = parse(current)
 
     if options.cache_master:
         # optionally return a url to a locally-cached master so we don't hit the network all the time
-        master_url = cache_master(master_url)
+        master_url = cache_master(master_url, parse)
 
     def parse_master_url():
         master = fetch(master_url)
-        return llmessage.parseTemplateString(master)
+        return parse(master)
     try:
         master_parsed = retry(3, parse_master_url)
     except (IOError, tokenstream.ParseError), e: